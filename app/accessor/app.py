@@ -2,9 +2,11 @@ from fastapi import FastAPI
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 from dotenv import load_dotenv, find_dotenv
+from common import metrics, probes, resilience, upstream, tracing
 import logging
 import asyncio
 import httpx
+import time
 import os
 
 class OperationRequest(BaseModel):
@@ -24,112 +26,195 @@ DEPLOYER_IP = os.getenv("DEPLOYER_IP", "deployer")
 DEPLOYER_PORT = os.getenv("DEPLOYER_PORT", "48000")
 DEPLOYER_ADDRESS = f"http://{DEPLOYER_IP}:{DEPLOYER_PORT}"
 
-async def connect_to_service(service_name: str, service_address: str, retries: int = None):
-    logger.info(f"Connecting to '{service_name}' at {service_address}")
-    async with httpx.AsyncClient() as client:
-        attempt = 0
-        while retries is None or attempt < retries:
-            try:
-                response = await client.get(f"{service_address}/health")
-                response.raise_for_status()
-                logger.info(f"Successfully connected to '{service_name}' at {service_address}")
-                break
-            except Exception as e:
-                attempt += 1
-                logger.error(f"Failed to connect to '{service_name}' at {service_address} (attempt {attempt}): {e}")
-                await asyncio.sleep(2)
-    return None
+#? Has to cover the slowest driver readiness on deployer, ready_retries * (ready_interval + probe timeout): 90 * (2 + 2) seconds for mysql
+WAKE_TIMEOUT = float(os.getenv("WAKE_TIMEOUT", 420))
+#? The same wait for readiness, plus pulling the image if the host does not have it yet
+DEPLOY_TIMEOUT = float(os.getenv("DEPLOY_TIMEOUT", 600))
+
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", 100))
+UPSTREAM_MAX_KEEPALIVE = int(os.getenv("UPSTREAM_MAX_KEEPALIVE", 20))
+
+OPERATIONS = ["index", "deploy", "deploy_batch", "wake", "delete", "search"]
+
+#? Deployments hold a docker host busy for a long time, few of them run at once and the rest wait briefly or are shed
+deployer_guard = resilience.load_guard("deployer", "DEPLOYER", {
+    "max_concurrency": 8, "max_queue": 16, "queue_timeout": 5,
+    "breaker_window": 20, "breaker_min_requests": 10, "breaker_open_seconds": 30,
+})
+http_client: httpx.AsyncClient | None = None
+
+startup = probes.StartupProbes({
+    "proxier": lambda: probes.check_service(http_client, PROXIER_ADDRESS),
+    "deployer": lambda: probes.check_service(http_client, DEPLOYER_ADDRESS),
+})
 
 async def lifespan(app: FastAPI):
     logger.info("Starting service 'ACCESSOR'")
     
-    await connect_to_service("PROXIER", PROXIER_ADDRESS)
-    await connect_to_service("DEPLOYER", DEPLOYER_ADDRESS)
+    global http_client
+    http_client = upstream.client(limits=httpx.Limits(max_connections=UPSTREAM_MAX_CONNECTIONS,
+                                                      max_keepalive_connections=UPSTREAM_MAX_KEEPALIVE))
+    
+    await startup.run()
     
-    logger.info("Service 'ACCESSOR' started successfully")
+    logger.info(f"Service 'ACCESSOR' started ({startup.status()})")
     
     yield
     
+    await startup.stop()
+    await http_client.aclose()
     logger.info("Shutting down service 'ACCESSOR'")
 
+async def call_deployer(path: str, payload: dict, timeout=httpx.USE_CLIENT_DEFAULT):
+    async with deployer_guard.call() as call:
+        response = await http_client.post(f"{DEPLOYER_ADDRESS}{path}", json=payload, timeout=timeout)
+        call.record(response.status_code)
+        return response
+
+async def wake_database(id: str):
+    #? Waking up waits for the database to be ready, which can take a while
+    return await call_deployer("/wake", {"id": id}, timeout=WAKE_TIMEOUT)
+
+def relay(response: httpx.Response):
+    #? Keeps the hint of upstreams shedding load so clients back off
+    headers = {"Retry-After": response.headers["retry-after"]} if "retry-after" in response.headers else None
+    try:
+        return JSONResponse(status_code=response.status_code, content=response.json(), headers=headers)
+    except Exception as e:
+        return JSONResponse(status_code=response.status_code, content={"message": response.text}, headers=headers)
+
 app = FastAPI(lifespan=lifespan)
+metrics.instrument_app(app, "accessor")
+tracing.instrument_app(app, "accessor")
 logger = logging.getLogger("uvicorn.error")
 
 @app.get("/health")
 async def health():
-    return JSONResponse(status_code=200, content={"message": "ok"})
+    return JSONResponse(status_code=200, content={"message": "ok", **startup.summary()})
+
+@app.get("/ready")
+async def ready():
+    return await probes.readiness({
+        "proxier": lambda: probes.check_service(http_client, PROXIER_ADDRESS),
+        "deployer": lambda: probes.check_service(http_client, DEPLOYER_ADDRESS),
+    })
 
 @app.post("/operation")
 async def operation(request: OperationRequest):
-    logger.info("Request")
+    logger.debug(f"Operation '{request.operation}' requested")
+    start = time.perf_counter()
+    
+    span = tracing.current_span.get()
+    if span is not None:
+        span.set_attribute("operation", request.operation)
+    
+    try:
+        response = await run_operation(request)
+    except resilience.Rejected as e:
+        logger.warning(f"Operation '{request.operation}' rejected: {e}")
+        response = resilience.rejection_response(e)
+    except httpx.TimeoutException as e:
+        logger.error(f"Operation '{request.operation}' timed out waiting for '{e.request.url.host}'")
+        response = JSONResponse(status_code=504, content={"message": f"Operation '{request.operation}' timed out waiting for an upstream"})
+    except httpx.RequestError as e:
+        logger.error(f"Operation '{request.operation}' failed reaching '{e.request.url.host}': {e}")
+        response = JSONResponse(status_code=502, content={"message": f"Operation '{request.operation}' could not reach an upstream"})
+    
+    status_code = getattr(response, "status_code", 200)
+    operation_label = request.operation if request.operation in OPERATIONS else "unknown"
+    metrics.OPERATION_DURATION.observe(time.perf_counter() - start, operation=operation_label, status=status_code)
+    return response
+
+async def run_operation(request: OperationRequest):
     if request.operation == "index":
-        async with httpx.AsyncClient() as client:
-            response = await client.post(f"{PROXIER_ADDRESS}/indexer/index", json=request.parameters)
-            try: 
-                return JSONResponse(status_code=response.status_code, content=response.json()) 
-            except Exception as e:
-                return JSONResponse(status_code=response.status_code, content={"message": response.text})
+        response = await http_client.post(f"{PROXIER_ADDRESS}/indexer/index", json=request.parameters)
+        return relay(response)
     
     elif request.operation == "deploy":
-        async with httpx.AsyncClient() as client:
-            response = await client.post(f"{DEPLOYER_ADDRESS}/deploy", json=request.parameters)
-            try: 
-                return JSONResponse(status_code=response.status_code, content=response.json()) 
-            except Exception as e:
-                return JSONResponse(status_code=response.status_code, content={"message": response.text})
+        response = await call_deployer("/deploy", request.parameters, timeout=DEPLOY_TIMEOUT)
+        return relay(response)
+    
+    elif request.operation == "deploy_batch":
+        response = await call_deployer("/deploy_batch", request.parameters, timeout=None)
+        return relay(response)
+    
+    elif request.operation == "wake":
+        response = await wake_database(str(request.parameters.get("id", "")))
+        return relay(response)
     
     elif request.operation == "delete":
-        async with httpx.AsyncClient() as client:  
-            try:      
-                response = await client.post(f"{PROXIER_ADDRESS}/searcher/id", json={"id": str(request.parameters["id"])})
-                data = response.json()
-                
-                if data["result"] is None:
-                    return JSONResponse(status_code=response.status_code, content=response.json())
-                
-                external = data["result"]["connection"]["external"]
-            except Exception as e:
-                logger.error("Could not determine if database is external or internal")
-                return JSONResponse(status_code=500, content={"message": "Could not determine if database is external or internal"})
-
-            if external is None:
-                return JSONResponse(status_code=500, content={"message": "Internal server error"})
+        try:      
+            response = await http_client.post(f"{PROXIER_ADDRESS}/searcher/id", json={
+                "id": str(request.parameters["id"]),
+                "consistency_token": request.parameters.get("consistency_token", None),
+            })
+            if response.status_code != 200:
+                return relay(response)
+            data = response.json()
+            
+            if data["result"] is None:
+                return JSONResponse(status_code=response.status_code, content=response.json())
             
-            if external:
-                response = await client.post(f"{PROXIER_ADDRESS}/indexer/index", json=request.parameters)
-                try:
-                    return JSONResponse(status_code=response.status_code, content=response.json()) 
-                except Exception as e:
-                    return JSONResponse(status_code=response.status_code, content={"message": response.text})
-            elif not external:
-                response = await client.post(f"{DEPLOYER_ADDRESS}/delete", json=request.parameters)
-                try:
-                    return JSONResponse(status_code=response.status_code, content=response.json()) 
-                except Exception as e:
-                    return JSONResponse(status_code=response.status_code, content={"message": response.text})
+            external = data["result"]["connection"]["external"]
+        except Exception as e:
+            logger.error("Could not determine if database is external or internal")
+            return JSONResponse(status_code=500, content={"message": "Could not determine if database is external or internal"})
+
+        if external is None:
+            return JSONResponse(status_code=500, content={"message": "Internal server error"})
+        
+        if external:
+            response = await http_client.post(f"{PROXIER_ADDRESS}/indexer/index", json=request.parameters)
+            return relay(response)
+        elif not external:
+            response = await call_deployer("/delete", request.parameters)
+            return relay(response)
     
     elif request.operation == "search":
         id = request.parameters.get("id", None)
         tags = request.parameters.get("tags", None)
+        #? Returned by index and deploy, makes the search see that write even when it reads from a secondary
+        consistency_token = request.parameters.get("consistency_token", None)
+        facets = request.parameters.get("facets", None)
+
+        #? Only the counts per value travel back, the matching documents never leave 'dbindex'
+        if facets is not None:
+            if id:
+                return JSONResponse(status_code=400, content={"message": "Facets are counted over tags, please remove the id"})
+            response = await http_client.post(f"{PROXIER_ADDRESS}/searcher/facets", json={
+                "facets": facets,
+                "tags": tags or {},
+                "limit": request.parameters.get("limit", None),
+                "consistency_token": consistency_token,
+            })
+            return relay(response)
 
         if id and tags:
             return JSONResponse(status_code=400, content={"message": "Can only search by tags or id, please remove one"})
 
         if id and not tags:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(f"{PROXIER_ADDRESS}/searcher/id", json={"id": str(id)})
-                try: 
-                    return JSONResponse(status_code=response.status_code, content=response.json()) 
-                except Exception as e:
-                    return JSONResponse(status_code=response.status_code, content={"message": response.text})
+            response = await http_client.post(f"{PROXIER_ADDRESS}/searcher/id", json={"id": str(id), "consistency_token": consistency_token})
+            if response.status_code != 200:
+                return relay(response)
+            data = response.json()
+            
+            result = data.get("result")
+            if result and result.get("state") == "hibernated":
+                wake_response = await wake_database(str(id))
+                if wake_response.status_code != 200:
+                    return relay(wake_response)
+                result["state"] = "running"
+            
+            return JSONResponse(status_code=response.status_code, content=data)
         
         if tags and not id:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(f"{PROXIER_ADDRESS}/searcher/tags", json={"tags": tags})
-                try: 
-                    return JSONResponse(status_code=response.status_code, content=response.json()) 
-                except Exception as e:
-                    return JSONResponse(status_code=response.status_code, content={"message": response.text})
+            response = await http_client.post(f"{PROXIER_ADDRESS}/searcher/tags", json={
+                "tags": tags,
+                "health": request.parameters.get("health", None),
+                "sort": request.parameters.get("sort", None),
+                "consistency_token": consistency_token,
+            })
+            return relay(response)
         
         else:
-            return JSONResponse(status_code=500, content={"message": "Unknown error"})
\ No newline at end of file
+            return JSONResponse(status_code=500, content={"message": "Unknown error"})
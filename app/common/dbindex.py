@@ -0,0 +1,77 @@
+from contextlib import contextmanager
+from pymongo import read_preferences
+from bson import json_util
+import base64
+import os
+
+#? Tokens need sessions, which in-process stand-ins like mongomock do not support
+CONSISTENCY_TOKENS = os.getenv("DBINDEX_CONSISTENCY_TOKENS", "true").lower() in ("1", "true", "yes")
+
+READ_PREFERENCES = {
+    "primary": read_preferences.Primary,
+    "primaryPreferred": read_preferences.PrimaryPreferred,
+    "secondary": read_preferences.Secondary,
+    "secondaryPreferred": read_preferences.SecondaryPreferred,
+    "nearest": read_preferences.Nearest,
+}
+
+#? The server refuses anything lower, it has to cover the heartbeat frequency plus the idle write period
+MIN_MAX_STALENESS = 90
+
+class InvalidToken(ValueError):
+    pass
+
+def address(ip: str, port):
+    #? A full connection string (replica set, several hosts, options) takes precedence over IP and port
+    return os.getenv("DBINDEX_URI") or f"mongodb://{ip}:{port}"
+
+def read_preference(mode: str, max_staleness: float | None = None):
+    if mode not in READ_PREFERENCES:
+        raise ValueError(f"Unknown read preference '{mode}', use one of {list(READ_PREFERENCES)}")
+    if mode == "primary":
+        return read_preferences.Primary()
+
+    if max_staleness is None:
+        return READ_PREFERENCES[mode]()
+    if max_staleness < MIN_MAX_STALENESS:
+        raise ValueError(f"Max staleness must be at least {MIN_MAX_STALENESS} seconds, got {max_staleness}")
+    return READ_PREFERENCES[mode](max_staleness=int(max_staleness))
+
+def optional_float(value: str | None):
+    return float(value) if value else None
+
+############################! Consistency tokens ############################
+
+@contextmanager
+def write_session(client):
+    if not CONSISTENCY_TOKENS:
+        yield None
+        return
+    with client.start_session(causal_consistency=True) as session:
+        yield session
+
+def encode_token(session):
+    #? Standalone servers do not report an operation time, reads there always see the latest writes anyway
+    if session is None or session.operation_time is None or session.cluster_time is None:
+        return None
+    data = json_util.dumps({"operation_time": session.operation_time, "cluster_time": session.cluster_time})
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip("=")
+
+def decode_token(token: str):
+    try:
+        data = json_util.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        return data["operation_time"], data["cluster_time"]
+    except Exception:
+        raise InvalidToken("Consistency token is not valid")
+
+@contextmanager
+def read_session(client, token: str | None):
+    #? Reads in a causally consistent session that has seen the write wait for a secondary to catch up to it
+    if not token or not CONSISTENCY_TOKENS:
+        yield None
+        return
+    operation_time, cluster_time = decode_token(token)
+    with client.start_session(causal_consistency=True) as session:
+        session.advance_cluster_time(cluster_time)
+        session.advance_operation_time(operation_time)
+        yield session
@@ -0,0 +1,307 @@
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
+from bisect import bisect_left
+import threading
+import time
+import re
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (0, 1, 5, 10, 50, 100, 500, 1000, 5000, 10000)
+
+class Registry:
+
+    def __init__(self):
+        self.metrics = []
+        self.const_labels = {}
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render(self.const_labels))
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+def format_labels(names: tuple, values: tuple, const_labels: dict, extra: str = None):
+    pairs = [f'{k}="{v}"' for k, v in const_labels.items()]
+    pairs.extend(f'{k}="{v}"' for k, v in zip(names, values))
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Metric:
+    type = None
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), registry: Registry = REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+        registry.register(self)
+
+    def key(self, labels: dict):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self, const_labels: dict):
+        lines = self.header()
+        with self.lock:
+            for key, value in self.values.items():
+                lines.append(f"{self.name}_total{format_labels(self.labelnames, key, const_labels)} {value}")
+        return lines
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def render(self, const_labels: dict):
+        lines = self.header()
+        with self.lock:
+            for key, value in self.values.items():
+                lines.append(f"{self.name}{format_labels(self.labelnames, key, const_labels)} {value}")
+        return lines
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS,
+                 registry: Registry = REGISTRY):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self.key(labels)
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                #? [per bucket counts..., +Inf count, sum]
+                state = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            state[index] += 1
+            state[-1] += value
+
+    def time(self, **labels):
+        return Timer(self, labels)
+
+    def render(self, const_labels: dict):
+        lines = self.header()
+        with self.lock:
+            items = [(key, list(state)) for key, state in self.values.items()]
+
+        bounds = [f'le="{bound}"' for bound in self.buckets] + ['le="+Inf"']
+        for key, state in items:
+            labels = format_labels(self.labelnames, key, const_labels)
+            cumulative = 0
+            for bound, count in zip(bounds, state):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{format_labels(self.labelnames, key, const_labels, bound)} {cumulative}")
+            lines.append(f"{self.name}_sum{labels} {state[-1]}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+class Timer:
+
+    def __init__(self, histogram: Histogram, labels: dict):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        labels = self.labels
+        if "outcome" in self.histogram.labelnames and "outcome" not in labels:
+            labels = {**labels, "outcome": "error" if exc_type else "ok"}
+        self.histogram.observe(time.perf_counter() - self.start, **labels)
+        return False
+
+############################! Service metrics ############################
+
+HTTP_REQUEST_DURATION = Histogram("http_request_duration_seconds", "Latency of the requests served",
+                                  ("method", "route", "status"))
+HTTP_REQUESTS_IN_PROGRESS = Gauge("http_requests_in_progress", "Requests being served")
+
+OPERATION_DURATION = Histogram("operation_duration_seconds", "Latency of the accessor operations",
+                               ("operation", "status"))
+
+UPSTREAM_REQUEST_DURATION = Histogram("upstream_request_duration_seconds", "Latency of the calls to other services",
+                                      ("target", "method", "outcome"))
+UPSTREAM_REQUESTS_IN_FLIGHT = Gauge("upstream_requests_in_flight", "Calls to other services waiting for a response",
+                                    ("target",))
+UPSTREAM_AVAILABLE = Gauge("upstream_available", "Whether an upstream of a route receives traffic (healthy and not ejected)",
+                           ("route", "upstream"))
+UPSTREAM_EJECTIONS = Counter("upstream_ejections", "Upstreams ejected after consecutive failures", ("route", "upstream"))
+UPSTREAM_REJECTIONS = Counter("upstream_rejections", "Calls to other services rejected without being sent",
+                              ("target", "reason"))
+UPSTREAM_QUEUED = Gauge("upstream_queued", "Calls to other services waiting for a concurrency slot", ("target",))
+CIRCUIT_BREAKER_STATE = Gauge("circuit_breaker_state", "Circuit breaker state, 0 closed, 1 open and 2 half open",
+                              ("target",))
+
+MONGO_COMMAND_DURATION = Histogram("mongo_command_duration_seconds", "Latency of the commands sent to mongodb",
+                                   ("command", "outcome"))
+MONGO_DOCUMENTS_RETURNED = Histogram("mongo_documents_returned", "Documents returned per mongodb command",
+                                     ("command",), buckets=SIZE_BUCKETS)
+MONGO_POOL_CONNECTIONS = Gauge("mongo_pool_connections", "Open connections in the mongodb pool", ("address",))
+MONGO_POOL_CHECKED_OUT = Gauge("mongo_pool_checked_out", "Connections of the mongodb pool in use", ("address",))
+
+FACETS_CACHE_LOOKUPS = Counter("facets_cache_lookups", "Facet counts looked up in the searcher cache", ("result",))
+
+DATABASE_PROBE_DURATION = Histogram("database_probe_duration_seconds", "Round trip of the monitor probes to the indexed databases",
+                                    ("manager", "outcome"))
+DATABASES_BY_HEALTH = Gauge("databases_by_health", "Indexed databases per health status after the last monitor cycle",
+                            ("status",))
+MONITOR_CYCLE_DURATION = Histogram("monitor_cycle_duration_seconds", "Time taken to probe every indexed database")
+
+DOCKER_API_DURATION = Histogram("docker_api_duration_seconds", "Latency of the docker API calls",
+                                ("call", "status"))
+
+############################! FastAPI instrumentation ############################
+
+#? Handlers serving many paths from a single route, like 'proxier', label their requests with the path they resolved
+ROUTE_SCOPE_KEY = "metrics.route"
+
+def set_route(scope: dict, route: str):
+    scope[ROUTE_SCOPE_KEY] = route
+
+class MetricsMiddleware:
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        start = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        HTTP_REQUESTS_IN_PROGRESS.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_REQUESTS_IN_PROGRESS.dec()
+            route = scope.get(ROUTE_SCOPE_KEY) or getattr(scope.get("route"), "path", "unmatched")
+            HTTP_REQUEST_DURATION.observe(time.perf_counter() - start, method=scope["method"], route=route, status=status)
+
+async def metrics_endpoint():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+def instrument_app(app: FastAPI, service: str):
+    REGISTRY.const_labels["service"] = service
+    app.add_middleware(MetricsMiddleware)
+    app.add_api_route("/metrics", metrics_endpoint, methods=["GET"], include_in_schema=False)
+    return app
+
+############################! Mongo instrumentation ############################
+
+def mongo_listeners():
+    from pymongo import monitoring
+
+    class CommandMetrics(monitoring.CommandListener):
+
+        def started(self, event):
+            pass
+
+        def succeeded(self, event):
+            MONGO_COMMAND_DURATION.observe(event.duration_micros / 1e6, command=event.command_name, outcome="ok")
+            cursor = event.reply.get("cursor") if isinstance(event.reply, dict) else None
+            if cursor is not None:
+                batch = cursor.get("firstBatch", cursor.get("nextBatch", []))
+                MONGO_DOCUMENTS_RETURNED.observe(len(batch), command=event.command_name)
+
+        def failed(self, event):
+            MONGO_COMMAND_DURATION.observe(event.duration_micros / 1e6, command=event.command_name, outcome="error")
+
+    class PoolMetrics(monitoring.ConnectionPoolListener):
+
+        def pool_created(self, event):
+            pass
+
+        def pool_ready(self, event):
+            pass
+
+        def pool_cleared(self, event):
+            pass
+
+        def pool_closed(self, event):
+            pass
+
+        def connection_created(self, event):
+            MONGO_POOL_CONNECTIONS.inc(address=format_address(event.address))
+
+        def connection_ready(self, event):
+            pass
+
+        def connection_closed(self, event):
+            MONGO_POOL_CONNECTIONS.dec(address=format_address(event.address))
+
+        def connection_check_out_started(self, event):
+            pass
+
+        def connection_check_out_failed(self, event):
+            pass
+
+        def connection_checked_out(self, event):
+            MONGO_POOL_CHECKED_OUT.inc(address=format_address(event.address))
+
+        def connection_checked_in(self, event):
+            MONGO_POOL_CHECKED_OUT.dec(address=format_address(event.address))
+
+    return [CommandMetrics(), PoolMetrics()]
+
+def format_address(address: tuple):
+    return f"{address[0]}:{address[1]}"
+
+############################! Docker instrumentation ############################
+
+DOCKER_ID_COLLECTIONS = {"containers", "images", "networks", "volumes", "exec"}
+DOCKER_STATIC_SEGMENTS = {"json", "create", "prune", "search", "load", "get"}
+
+def normalize_docker_path(path: str):
+    segments = re.sub(r"^/v[\d.]+", "", path.split("?", 1)[0]).strip("/").split("/")
+    for i in range(1, len(segments)):
+        if segments[i - 1] in DOCKER_ID_COLLECTIONS and segments[i] not in DOCKER_STATIC_SEGMENTS:
+            segments[i] = "{id}"
+    return "/" + "/".join(segments)
+
+def instrument_docker(docker_client):
+    def observe(response, *args, **kwargs):
+        call = f"{response.request.method} {normalize_docker_path(response.request.path_url)}"
+        DOCKER_API_DURATION.observe(response.elapsed.total_seconds(), call=call, status=response.status_code)
+
+    docker_client.api.hooks["response"].append(observe)
+    return docker_client
@@ -0,0 +1,121 @@
+from fastapi.responses import JSONResponse
+from common import upstream
+import logging
+import asyncio
+import random
+import httpx
+import time
+import os
+
+READY_TIMEOUT = float(os.getenv("READY_TIMEOUT", 2))
+STARTUP_DEADLINE = float(os.getenv("STARTUP_DEADLINE", 30))
+STARTUP_BACKOFF_INITIAL = float(os.getenv("STARTUP_BACKOFF_INITIAL", 0.25))
+STARTUP_BACKOFF_MAX = float(os.getenv("STARTUP_BACKOFF_MAX", 5))
+
+logger = logging.getLogger("uvicorn.error")
+
+async def check_service(client: httpx.AsyncClient | None, service_address: str):
+    if client is None:
+        async with upstream.client() as client:
+            return await check_service(client, service_address)
+
+    response = await client.get(f"{service_address}/health", timeout=READY_TIMEOUT)
+    response.raise_for_status()
+
+def ping_mongodb(client):
+    import pymongo
+
+    #? Bounds server selection too, which otherwise waits 30 seconds for an unreachable server
+    with pymongo.timeout(READY_TIMEOUT):
+        client.admin.command("ping")
+
+def check_mongodb(client, writable: bool = False):
+    #? Uses the state kept by the driver's own server monitoring, no round trip to the server
+    topology = client.topology_description
+    if not (topology.has_writable_server() if writable else topology.has_readable_server()):
+        raise RuntimeError(f"No {'writable' if writable else 'readable'} server available")
+
+async def run_check(check):
+    try:
+        result = check()
+        if asyncio.iscoroutine(result):
+            await asyncio.wait_for(result, READY_TIMEOUT)
+        return "ok"
+    except Exception as e:
+        return f"{type(e).__name__}: {e}" if str(e) else type(e).__name__
+
+async def readiness(checks: dict):
+    names = list(checks)
+    results = await asyncio.gather(*(run_check(checks[name]) for name in names))
+    dependencies = dict(zip(names, results))
+
+    if all(result == "ok" for result in results):
+        return JSONResponse(status_code=200, content={"message": "ready", "dependencies": dependencies})
+    return JSONResponse(status_code=503, content={"message": "not ready", "dependencies": dependencies})
+
+############################! Startup ############################
+
+class StartupProbes:
+
+    def __init__(self, checks: dict, deadline: float = STARTUP_DEADLINE, backoff_initial: float = STARTUP_BACKOFF_INITIAL,
+                 backoff_max: float = STARTUP_BACKOFF_MAX):
+        self.checks = checks
+        self.deadline = deadline
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.started = False
+        self.tasks = []
+        self.dependencies = {name: {"status": "pending", "attempts": 0, "error": None, "ready_after": None}
+                             for name in checks}
+
+    async def attempt(self, check):
+        #? Blocking checks (pymongo) run on a thread so every dependency is probed at the same time
+        if asyncio.iscoroutinefunction(check):
+            return await asyncio.wait_for(check(), READY_TIMEOUT)
+        result = await asyncio.to_thread(check)
+        if asyncio.iscoroutine(result):
+            await asyncio.wait_for(result, READY_TIMEOUT)
+
+    async def probe(self, name: str, start: float):
+        state = self.dependencies[name]
+        backoff = self.backoff_initial
+        while True:
+            state["attempts"] += 1
+            try:
+                await self.attempt(self.checks[name])
+                state.update(status="ok", error=None, ready_after=round(time.monotonic() - start, 3))
+                logger.info(f"Dependency '{name}' ready after {state['ready_after']}s ({state['attempts']} attempts)")
+                return
+            except Exception as e:
+                state.update(status="failed", error=f"{type(e).__name__}: {e}" if str(e) else type(e).__name__)
+                logger.debug(f"Dependency '{name}' not ready (attempt {state['attempts']}): {state['error']}")
+
+            await asyncio.sleep(backoff / 2 + random.uniform(0, backoff / 2))
+            backoff = min(backoff * 2, self.backoff_max)
+
+    async def run(self):
+        start = time.monotonic()
+        self.tasks = [asyncio.create_task(self.probe(name, start)) for name in self.checks]
+        if self.tasks:
+            await asyncio.wait(self.tasks, timeout=self.deadline)
+        self.started = True
+
+        #? Dependencies still missing keep being probed in the background, the service starts degraded meanwhile
+        missing = [name for name, state in self.dependencies.items() if state["status"] != "ok"]
+        if missing:
+            logger.warning(f"Starting degraded, {missing} not ready after {self.deadline}s: "
+                           + "; ".join(f"{name}: {self.dependencies[name]['error']}" for name in missing))
+        return not missing
+
+    def status(self):
+        if all(state["status"] == "ok" for state in self.dependencies.values()):
+            return "ok"
+        return "degraded" if self.started else "starting"
+
+    def summary(self):
+        return {"status": self.status(), "dependencies": self.dependencies}
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
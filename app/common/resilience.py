@@ -0,0 +1,206 @@
+from contextlib import asynccontextmanager
+from collections import deque
+from fastapi.responses import JSONResponse
+from common.metrics import UPSTREAM_REJECTIONS, UPSTREAM_QUEUED, CIRCUIT_BREAKER_STATE
+import asyncio
+import math
+import time
+import os
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+STATE_VALUES = {CLOSED: 0, OPEN: 1, HALF_OPEN: 2}
+
+class Rejected(Exception):
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class Overloaded(Rejected):
+    pass
+
+class CircuitOpen(Rejected):
+    pass
+
+def rejection_response(error: Rejected):
+    return JSONResponse(status_code=503, content={"message": str(error)},
+                        headers={"Retry-After": str(max(1, math.ceil(error.retry_after)))})
+
+############################! Concurrency limiter ############################
+
+class ConcurrencyLimiter:
+
+    def __init__(self, name: str, max_concurrency: int, max_queue: int, queue_timeout: float):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.semaphore = asyncio.Semaphore(max_concurrency) if max_concurrency > 0 else None
+        self.active = 0
+        self.waiting = 0
+
+    @asynccontextmanager
+    async def slot(self):
+        if self.semaphore is None:
+            self.active += 1
+            try:
+                yield
+            finally:
+                self.active -= 1
+            return
+
+        if self.semaphore.locked():
+            #? A full queue rejects at once, waiting would only add latency to a request that will time out anyway
+            if self.waiting >= self.max_queue:
+                UPSTREAM_REJECTIONS.inc(target=self.name, reason="queue_full")
+                raise Overloaded(f"Too many requests waiting for '{self.name}'", self.queue_timeout)
+
+            self.waiting += 1
+            UPSTREAM_QUEUED.set(self.waiting, target=self.name)
+            try:
+                await asyncio.wait_for(self.semaphore.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                UPSTREAM_REJECTIONS.inc(target=self.name, reason="queue_timeout")
+                raise Overloaded(f"Timed out waiting for '{self.name}'", self.queue_timeout)
+            finally:
+                self.waiting -= 1
+                UPSTREAM_QUEUED.set(self.waiting, target=self.name)
+        else:
+            await self.semaphore.acquire()
+
+        self.active += 1
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self.semaphore.release()
+
+############################! Circuit breaker ############################
+
+class CircuitBreaker:
+
+    def __init__(self, name: str, window: int = 50, min_requests: int = 20, error_rate: float = 0.5,
+                 slow_call_seconds: float = 0, slow_call_rate: float = 0.8, open_seconds: float = 10,
+                 half_open_requests: int = 1):
+        self.name = name
+        self.outcomes = deque(maxlen=window)
+        self.min_requests = min_requests
+        self.error_rate = error_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.open_seconds = open_seconds
+        self.half_open_requests = half_open_requests
+
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.probes = 0
+        CIRCUIT_BREAKER_STATE.set(STATE_VALUES[CLOSED], target=name)
+
+    def set_state(self, state: str):
+        self.state = state
+        self.probes = 0
+        if state == OPEN:
+            self.opened_at = time.monotonic()
+        self.outcomes.clear()
+        CIRCUIT_BREAKER_STATE.set(STATE_VALUES[state], target=self.name)
+
+    def before_call(self):
+        if self.state == OPEN:
+            remaining = self.opened_at + self.open_seconds - time.monotonic()
+            if remaining > 0:
+                UPSTREAM_REJECTIONS.inc(target=self.name, reason="circuit_open")
+                raise CircuitOpen(f"Circuit to '{self.name}' is open", remaining)
+            self.set_state(HALF_OPEN)
+
+        if self.state == HALF_OPEN:
+            if self.probes >= self.half_open_requests:
+                UPSTREAM_REJECTIONS.inc(target=self.name, reason="circuit_half_open")
+                raise CircuitOpen(f"Circuit to '{self.name}' is half open", 1)
+            self.probes += 1
+
+    def record(self, duration: float, error: bool | None):
+        #? An abandoned call (the client went away) says nothing about the upstream, only its probe slot is given back
+        if error is None:
+            if self.state == HALF_OPEN:
+                self.probes = max(0, self.probes - 1)
+            return
+
+        slow = self.slow_call_seconds > 0 and duration > self.slow_call_seconds
+
+        if self.state == HALF_OPEN:
+            if error or slow:
+                self.set_state(OPEN)
+            else:
+                self.outcomes.append((False, False))
+                if len(self.outcomes) >= self.half_open_requests:
+                    self.set_state(CLOSED)
+            return
+
+        if self.state == OPEN:
+            return
+
+        self.outcomes.append((error, slow))
+        if len(self.outcomes) < self.min_requests:
+            return
+
+        errors = sum(1 for e, _ in self.outcomes if e)
+        slows = sum(1 for _, s in self.outcomes if s)
+        if errors >= self.error_rate * len(self.outcomes) or (self.slow_call_seconds > 0 and slows >= self.slow_call_rate * len(self.outcomes)):
+            self.set_state(OPEN)
+
+############################! Guard ############################
+
+class Call:
+
+    def __init__(self):
+        self.error = False
+
+    def record(self, status_code: int):
+        self.error = status_code >= 500
+
+class Guard:
+
+    def __init__(self, limiter: ConcurrencyLimiter, breaker: CircuitBreaker):
+        self.limiter = limiter
+        self.breaker = breaker
+
+    @asynccontextmanager
+    async def call(self):
+        self.breaker.before_call()
+        async with self.limiter.slot():
+            call = Call()
+            start = time.perf_counter()
+            try:
+                yield call
+            except asyncio.CancelledError:
+                self.breaker.record(time.perf_counter() - start, error=None)
+                raise
+            except Exception:
+                self.breaker.record(time.perf_counter() - start, error=True)
+                raise
+            self.breaker.record(time.perf_counter() - start, error=call.error)
+
+    def summary(self):
+        return {"state": self.breaker.state, "active": self.limiter.active, "waiting": self.limiter.waiting}
+
+def load_guard(name: str, prefix: str, defaults: dict = None):
+    defaults = defaults or {}
+    setting = lambda key, default: os.getenv(f"{prefix}_{key}", defaults.get(key.lower(), default))
+
+    limiter = ConcurrencyLimiter(
+        name,
+        max_concurrency=int(setting("MAX_CONCURRENCY", 100)),
+        max_queue=int(setting("MAX_QUEUE", 100)),
+        queue_timeout=float(setting("QUEUE_TIMEOUT", 1)),
+    )
+    breaker = CircuitBreaker(
+        name,
+        window=int(setting("BREAKER_WINDOW", 50)),
+        min_requests=int(setting("BREAKER_MIN_REQUESTS", 20)),
+        error_rate=float(setting("BREAKER_ERROR_RATE", 0.5)),
+        slow_call_seconds=float(setting("BREAKER_SLOW_CALL_SECONDS", 0)),
+        slow_call_rate=float(setting("BREAKER_SLOW_CALL_RATE", 0.8)),
+        open_seconds=float(setting("BREAKER_OPEN_SECONDS", 10)),
+        half_open_requests=int(setting("BREAKER_HALF_OPEN_REQUESTS", 1)),
+    )
+    return Guard(limiter, breaker)
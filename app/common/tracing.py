@@ -0,0 +1,259 @@
+from contextlib import contextmanager
+from collections import deque
+from fastapi import FastAPI
+import contextvars
+import threading
+import random
+import json
+import time
+import os
+import re
+
+RESPONSE_HEADERS = {b"server-timing", b"traceresponse"}
+TRACEPARENT_PATTERN = re.compile(r"^([0-9a-f]{2})-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+class Span:
+
+    def __init__(self, name: str, trace_id: str, parent_id: str = None, kind: str = "internal",
+                 attributes: dict = None, start: float = None, service: str = None):
+        self.name = name
+        self.service = service or SERVICE
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.kind = kind
+        self.attributes = attributes or {}
+        self.status = "ok"
+        self.start = start if start is not None else time.time()
+        self.duration = None
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def end(self, duration: float = None):
+        self.duration = duration if duration is not None else time.time() - self.start
+
+    def traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "kind": self.kind,
+            "service": self.service,
+            "start": self.start,
+            "duration_ms": round(self.duration * 1000, 3) if self.duration is not None else None,
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+############################! Sinks ############################
+
+class NullSink:
+
+    def export(self, span: Span):
+        pass
+
+class InMemorySink:
+
+    def __init__(self, max_spans: int = 10000):
+        self.spans = deque(maxlen=max_spans)
+
+    def export(self, span: Span):
+        self.spans.append(span.to_dict())
+
+    def get_trace(self, trace_id: str):
+        return [s for s in self.spans if s["trace_id"] == trace_id]
+
+    def clear(self):
+        self.spans.clear()
+
+class FileSink:
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = open(path, "a", buffering=1)
+
+    def export(self, span: Span):
+        line = json.dumps(span.to_dict(), default=str)
+        with self.lock:
+            self.file.write(line + "\n")
+
+def create_sink(value: str):
+    if not value or value == "none":
+        return NullSink()
+    if value == "memory":
+        return InMemorySink()
+    if value.startswith("file:"):
+        return FileSink(value[len("file:"):])
+    raise ValueError(f"Unknown trace sink '{value}'")
+
+SERVICE = None
+SINK = create_sink(os.getenv("TRACE_SINK", "none"))
+
+def set_sink(sink):
+    global SINK
+    SINK = sink
+    return sink
+
+############################! Context ############################
+
+current_span: contextvars.ContextVar[Span | None] = contextvars.ContextVar("current_span", default=None)
+#? Server-Timing entries of the request being served: own components plus the ones reported by upstreams
+server_timings: contextvars.ContextVar[dict | None] = contextvars.ContextVar("server_timings", default=None)
+
+def parse_traceparent(value: str):
+    match = TRACEPARENT_PATTERN.match(value.strip().lower()) if value else None
+    if not match or match.group(1) == "ff":
+        return None
+
+    trace_id, parent_id = match.group(2), match.group(3)
+    if trace_id == "0" * 32 or parent_id == "0" * 16:
+        return None
+    return trace_id, parent_id
+
+def new_trace_id():
+    return f"{random.getrandbits(128):032x}"
+
+@contextmanager
+def start_span(name: str, kind: str = "internal", attributes: dict = None, trace_id: str = None, parent_id: str = None,
+               service: str = None):
+    parent = current_span.get()
+    if trace_id is None:
+        trace_id = parent.trace_id if parent is not None else new_trace_id()
+        parent_id = parent.span_id if parent is not None else None
+    if service is None and parent is not None:
+        service = parent.service
+
+    span = Span(name, trace_id, parent_id, kind, attributes, service=service)
+    token = current_span.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.status = "error"
+        span.set_attribute("error", repr(e))
+        raise
+    finally:
+        current_span.reset(token)
+        span.end()
+        SINK.export(span)
+
+def record_span(name: str, duration: float, kind: str = "client", attributes: dict = None, error: bool = False):
+    parent = current_span.get()
+    if parent is None:
+        return
+
+    span = Span(name, parent.trace_id, parent.span_id, kind, attributes, start=time.time() - duration, service=parent.service)
+    if error:
+        span.status = "error"
+    span.end(duration)
+    SINK.export(span)
+
+def record_timing(component: str, duration: float):
+    timings = server_timings.get()
+    if timings is not None:
+        timings["local"][component] = timings["local"].get(component, 0) + duration
+
+def record_upstream_timing(header: str):
+    timings = server_timings.get()
+    if timings is not None and header:
+        timings["upstream"].append(header)
+
+def format_server_timing(service: str, duration: float, timings: dict):
+    entries = [f"{service};dur={duration * 1000:.2f}"]
+    entries.extend(f"{component};dur={value * 1000:.2f}" for component, value in timings["local"].items())
+    entries.extend(timings["upstream"])
+    return ", ".join(entries)
+
+############################! FastAPI instrumentation ############################
+
+class TracingMiddleware:
+
+    def __init__(self, app, service: str):
+        self.app = app
+        self.service = service
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        incoming = None
+        for key, value in scope.get("headers", []):
+            if key == b"traceparent":
+                incoming = parse_traceparent(value.decode("latin-1"))
+                break
+
+        trace_id, parent_id = incoming if incoming else (new_trace_id(), None)
+        start = time.perf_counter()
+        timings = {"local": {}, "upstream": []}
+        timings_token = server_timings.set(timings)
+
+        with start_span(f"{scope['method']} {scope['path']}", kind="server", trace_id=trace_id, parent_id=parent_id,
+                        service=self.service) as span:
+            async def send_wrapper(message):
+                if message["type"] == "http.response.start":
+                    span.set_attribute("http.status_code", message["status"])
+                    header = format_server_timing(self.service, time.perf_counter() - start, timings)
+                    #? Proxied responses carry the upstream headers, those entries are already in the timings
+                    headers = [(k, v) for k, v in message.get("headers", []) if k.lower() not in RESPONSE_HEADERS]
+                    headers.append((b"server-timing", header.encode("latin-1")))
+                    headers.append((b"traceresponse", span.traceparent().encode("latin-1")))
+                    message = {**message, "headers": headers}
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                route = getattr(scope.get("route"), "path", None)
+                if route is not None:
+                    span.name = f"{scope['method']} {route}"
+                server_timings.reset(timings_token)
+
+def instrument_app(app: FastAPI, service: str):
+    global SERVICE
+    SERVICE = service
+    app.add_middleware(TracingMiddleware, service=service)
+    return app
+
+############################! Mongo instrumentation ############################
+
+def mongo_listeners():
+    from pymongo import monitoring
+
+    class CommandTracing(monitoring.CommandListener):
+
+        def started(self, event):
+            pass
+
+        def succeeded(self, event):
+            duration = event.duration_micros / 1e6
+            record_span(f"mongo.{event.command_name}", duration,
+                        attributes={"db.name": event.database_name, "db.address": f"{event.connection_id[0]}:{event.connection_id[1]}"})
+            record_timing("mongo", duration)
+
+        def failed(self, event):
+            duration = event.duration_micros / 1e6
+            record_span(f"mongo.{event.command_name}", duration, error=True,
+                        attributes={"db.name": event.database_name, "error": str(event.failure)})
+            record_timing("mongo", duration)
+
+    return [CommandTracing()]
+
+############################! Docker instrumentation ############################
+
+def instrument_docker(docker_client):
+    from common.metrics import normalize_docker_path
+
+    def trace(response, *args, **kwargs):
+        duration = response.elapsed.total_seconds()
+        call = f"{response.request.method} {normalize_docker_path(response.request.path_url)}"
+        record_span(f"docker {call}", duration, attributes={"http.status_code": response.status_code},
+                    error=response.status_code >= 500)
+        record_timing("docker", duration)
+
+    docker_client.api.hooks["response"].append(trace)
+    return docker_client
@@ -0,0 +1,42 @@
+from common.metrics import UPSTREAM_REQUEST_DURATION, UPSTREAM_REQUESTS_IN_FLIGHT
+from common import tracing
+import httpx
+import time
+
+class UpstreamTransport(httpx.AsyncBaseTransport):
+
+    def __init__(self, transport: httpx.AsyncBaseTransport):
+        self.transport = transport
+
+    async def handle_async_request(self, request: httpx.Request):
+        target = request.url.host
+        start = time.perf_counter()
+        outcome = "error"
+
+        UPSTREAM_REQUESTS_IN_FLIGHT.inc(target=target)
+        try:
+            with tracing.start_span(f"{request.method} {target}{request.url.path}", kind="client") as span:
+                request.headers["traceparent"] = span.traceparent()
+                response = await self.transport.handle_async_request(request)
+                span.set_attribute("http.status_code", response.status_code)
+                tracing.record_upstream_timing(response.headers.get("server-timing"))
+            outcome = "ok" if response.status_code < 500 else "error"
+            return response
+        finally:
+            UPSTREAM_REQUESTS_IN_FLIGHT.dec(target=target)
+            UPSTREAM_REQUEST_DURATION.observe(time.perf_counter() - start, target=target, method=request.method,
+                                              outcome=outcome)
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+#? Address -> transport overrides, used to run the services in-process (see benchmarks/harness.py)
+MOUNTS: dict[str, httpx.AsyncBaseTransport] = {}
+
+#? Loading the CA bundle takes tens of milliseconds, every client reuses the same context
+SSL_CONTEXT = httpx.create_ssl_context()
+
+def client(limits: httpx.Limits = None, **kwargs):
+    transport = httpx.AsyncHTTPTransport(verify=SSL_CONTEXT, limits=limits or httpx.Limits())
+    mounts = {address: UpstreamTransport(mount) for address, mount in MOUNTS.items()}
+    return httpx.AsyncClient(transport=UpstreamTransport(transport), mounts=mounts or None, **kwargs)
@@ -1,19 +1,23 @@
 import docker.errors
 from fastapi import FastAPI, UploadFile, File
 from fastapi.responses import JSONResponse
-from pymongo import MongoClient
 from dotenv import load_dotenv, find_dotenv
 from pydantic import BaseModel
 from typing import Optional, Annotated
+from ports import PortAllocator
+from resources import ResourceProfile, ResourceLedger, load_manager_profile, resolve_profile, container_run_kwargs, parse_memory
+from drivers import DRIVERS
+from common import metrics, probes, upstream, tracing
 import docker
 import logging
 import httpx
 import asyncio
+import time
 import os
 
 class ConnectionData(BaseModel):
     ip: Optional[str] = None
-    port: int
+    port: Optional[int] = None
     manager: str
     external: Optional[bool] = False
 
@@ -21,9 +25,17 @@ class DeployRequest(BaseModel):
     id: str
     tags: dict
     connection: ConnectionData
+    resources: Optional[ResourceProfile] = None
+
+class DeployBatchRequest(BaseModel):
+    databases: list[DeployRequest]
+    parallelism: Optional[int] = None
 
 class DeleteRequest(BaseModel):
     id: str
+
+class WakeRequest(BaseModel):
+    id: str
     
 ON_CONATAINER = True
 
@@ -36,24 +48,29 @@ PROXIER_ADDRESS = f"http://{PROXIER_IP}:{PROXIER_PORT}"
 NETWORK_NAME = os.getenv("NETWORK_NAME", "bsm_db_service")
 DOCKER_SOCK = os.getenv("DOCKER_SOCK", "/var/run/docker.sock")
 
-SUPPORTED_MANAGERS = ["mongodb"]
+DEPLOY_BATCH_PARALLELISM = int(os.getenv("DEPLOY_BATCH_PARALLELISM", 4))
+DEPLOY_BATCH_MAX_PARALLELISM = int(os.getenv("DEPLOY_BATCH_MAX_PARALLELISM", 16))
 
+PORT_RANGE_START = int(os.getenv("PORT_RANGE_START", 50000))
+PORT_RANGE_END = int(os.getenv("PORT_RANGE_END", 50999))
+PORT_ALLOCATION_RETRIES = int(os.getenv("PORT_ALLOCATION_RETRIES", 3))
 
-async def connect_to_service(service_name: str, service_address: str, retries: int = None):
-    logger.info(f"Connecting to '{service_name}' at {service_address}")
-    async with httpx.AsyncClient() as client:
-        attempt = 0
-        while retries is None or attempt < retries:
-            try:
-                response = await client.get(f"{service_address}/health")
-                response.raise_for_status()
-                logger.info(f"Successfully connected to '{service_name}' at {service_address}")
-                break
-            except Exception as e:
-                attempt += 1
-                logger.error(f"Failed to connect to '{service_name}' at {service_address} (attempt {attempt}): {e}")
-                await asyncio.sleep(2)
-    return None
+HOST_MEMORY_CAPACITY = os.getenv("HOST_MEMORY_CAPACITY")
+HOST_CPU_CAPACITY = os.getenv("HOST_CPU_CAPACITY")
+HOST_RESERVED_MEMORY = os.getenv("HOST_RESERVED_MEMORY", "1g")
+HOST_RESERVED_CPUS = float(os.getenv("HOST_RESERVED_CPUS", 1))
+
+MANAGED_LABEL = "bsm_db_service.managed"
+
+HIBERNATION_IDLE_SECONDS = float(os.getenv("HIBERNATION_IDLE_SECONDS", 0))
+HIBERNATION_CHECK_INTERVAL = float(os.getenv("HIBERNATION_CHECK_INTERVAL", 60))
+
+SUPPORTED_MANAGERS = list(DRIVERS)
+
+MANAGER_PROFILES = {name: load_manager_profile(name, driver.default_resources) for name, driver in DRIVERS.items()}
+
+
+startup = probes.StartupProbes({"proxier": lambda: probes.check_service(None, PROXIER_ADDRESS)})
 
 async def lifespan(app: FastAPI):
     logger.info("Starting service 'DEPLOYER'")
@@ -68,120 +85,286 @@ async def lifespan(app: FastAPI):
     
     logger.info("Docker socket found with read/write access")
     
-    await connect_to_service("PROXIER", PROXIER_ADDRESS)
+    #? Ports, resources and hibernation are tracked in memory, more than one worker would hand out the same ones
+    if int(os.getenv("WEB_CONCURRENCY", 1)) > 1:
+        logger.error("Service 'DEPLOYER' can not run with more than one worker")
+        raise RuntimeError("WEB_CONCURRENCY must be 1 for 'DEPLOYER'")
+    
+    existing_containers = get_docker_client().containers.list(all=True)
+    port_allocator.reconcile(get_used_host_ports(existing_containers))
+    logger.info(f"Port allocator reconciled, {port_allocator.free_count()} free ports in range {PORT_RANGE_START}-{PORT_RANGE_END}")
+    
+    global resource_ledger
+    resource_ledger = create_resource_ledger(get_docker_client())
+    logger.info(f"Resource ledger reconciled: {resource_ledger.summary()}")
+    
+    await startup.run()
+    
+    hibernation_task = None
+    if HIBERNATION_IDLE_SECONDS > 0:
+        hibernation_task = asyncio.create_task(hibernation_loop())
+        logger.info(f"Hibernation enabled for databases idle more than {HIBERNATION_IDLE_SECONDS} seconds")
     
-    logger.info("Service 'DEPLOYER' started succesfully")
+    logger.info(f"Service 'DEPLOYER' started ({startup.status()})")
     
     yield
     
+    if hibernation_task is not None:
+        hibernation_task.cancel()
+    await startup.stop()
+    
     logger.info("Shutting down service 'DEPLOYER'")
 
 app = FastAPI(lifespan=lifespan)
+metrics.instrument_app(app, "deployer")
+tracing.instrument_app(app, "deployer")
 logger = logging.getLogger("uvicorn.error")
+port_allocator = PortAllocator(PORT_RANGE_START, PORT_RANGE_END)
+docker_client: docker.DockerClient | None = None
+resource_ledger: ResourceLedger | None = None
+last_access: dict[str, float] = {}
+activity_counters: dict[str, int] = {}
+wake_locks: dict[str, asyncio.Lock] = {}
 
 @app.get("/health")
 async def health():
-    return JSONResponse(content={"message": "ok"})
+    return JSONResponse(content={"message": "ok", **startup.summary()})
+
+@app.get("/ready")
+async def ready():
+    async with upstream.client() as client:
+        return await probes.readiness({
+            "docker": lambda: asyncio.to_thread(get_docker_client().ping),
+            "proxier": lambda: probes.check_service(client, PROXIER_ADDRESS),
+        })
+
+@app.get("/capacity")
+async def capacity():
+    return JSONResponse(content={"message": "ok", "capacity": resource_ledger.summary()})
+
+def get_docker_client():
+    #? Creating a client costs a round trip to the daemon to negotiate the API version, it is done once
+    global docker_client
+    if docker_client is None:
+        docker_client = tracing.instrument_docker(metrics.instrument_docker(docker.DockerClient(base_url=f"unix:/{DOCKER_SOCK}")))
+    return docker_client
+
+def create_resource_ledger(docker_client: docker.DockerClient):
+    info = docker_client.info()
+    
+    memory_capacity = parse_memory(HOST_MEMORY_CAPACITY) if HOST_MEMORY_CAPACITY else info["MemTotal"]
+    cpu_capacity = float(HOST_CPU_CAPACITY) if HOST_CPU_CAPACITY else info["NCPU"]
+    
+    #? Room left for 'dbindex' and the service containers
+    memory_capacity -= parse_memory(HOST_RESERVED_MEMORY)
+    cpu_capacity -= HOST_RESERVED_CPUS
+    
+    ledger = ResourceLedger(max(memory_capacity, 0), max(int(cpu_capacity * 1e9), 0))
+    
+    allocations = {}
+    for c in docker_client.containers.list(filters={"label": f"{MANAGED_LABEL}=true"}):
+        host_config = c.attrs.get("HostConfig", {})
+        allocations[c.name] = (host_config.get("Memory") or 0, host_config.get("NanoCpus") or 0)
+    ledger.reconcile(allocations)
+    
+    return ledger
+
+def validate_deploy_request(request: DeployRequest):
+    if request.connection.ip:
+        return "'ip' parameter can not be specified"
+    if request.connection.external != False:
+        return "'external' parameter can not be True"
+    if request.connection.manager not in SUPPORTED_MANAGERS:
+        return f"Manager '{request.connection.manager}' not supported"
+    return None
+
+def container_name_taken(existing_containers: list, name: str):
+    return any(name in c.name or name == c.name for c in existing_containers)
+
+def get_used_host_ports(existing_containers: list):
+    used_ports = set()
+    for c in existing_containers:
+        port_bindings = c.attrs.get("HostConfig", {}).get("PortBindings") or {}
+        for bindings in port_bindings.values():
+            for binding in bindings or []:
+                if binding.get("HostPort"):
+                    used_ports.add(int(binding["HostPort"]))
+    return used_ports
+
+def reserve_port(request: DeployRequest):
+    if request.connection.port is None:
+        port = port_allocator.allocate()
+        if port is None:
+            return None, f"No free ports left in range {PORT_RANGE_START}-{PORT_RANGE_END}"
+        request.connection.port = port
+        return True, None
+    
+    if not port_allocator.reserve(request.connection.port):
+        return None, f"Port {request.connection.port} is already in use"
+    return False, None
+
+def reserve_resources(request: DeployRequest):
+    try:
+        profile = resolve_profile(MANAGER_PROFILES[request.connection.manager], request.resources)
+    except ValueError as e:
+        return str(e)
+    
+    request.resources = DRIVERS[request.connection.manager].tune(profile)
+    return resource_ledger.reserve(request.id, profile)
+
+def is_port_conflict(error: docker.errors.APIError):
+    message = str(error).lower()
+    return "port is already allocated" in message or "address already in use" in message
+
+def run_container(docker_client: docker.DockerClient, request: DeployRequest, allocated_port: bool = False):
+    driver = DRIVERS[request.connection.manager]
+    profile = request.resources
+    
+    attempts = PORT_ALLOCATION_RETRIES if allocated_port else 1
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            container = docker_client.containers.run(
+                image=driver.image,
+                name=request.id,
+                detach=True,
+                ports={f"{driver.internal_port}/tcp": request.connection.port},
+                network=NETWORK_NAME,
+                command=driver.command(profile),
+                environment=driver.environment(profile),
+                labels={MANAGED_LABEL: "true", "bsm_db_service.manager": request.connection.manager},
+                **container_run_kwargs(profile),
+                **driver.run_kwargs(profile),
+            )
+            break
+        except docker.errors.APIError as e:
+            if attempt >= attempts or not is_port_conflict(e):
+                raise
+            
+            #? The port is bound outside of docker, it stays marked as used on the allocator
+            logger.warning(f"Port {request.connection.port} is taken outside the service, allocating a new one for '{request.id}'")
+            remove_container(docker_client, None, request.id)
+            
+            port = port_allocator.allocate()
+            if port is None:
+                raise RuntimeError(f"No free ports left in range {PORT_RANGE_START}-{PORT_RANGE_END}")
+            request.connection.port = port
+    
+    container.reload()
+
+    if container.status != "running":
+        logs = container.logs().decode()
+        raise RuntimeError(f"Database created but failed to start. Logs:\n{logs}")
+    
+    logger.info(f"Database '{request.id}' started successfully")
+    return container
+
+async def wait_for_database(container, manager: str):
+    driver = DRIVERS[manager]
+    logger.info(f"Verifying database '{container.name}' connection...")
+    
+    with tracing.start_span("wait_for_database", attributes={"database.id": container.name, "database.manager": manager}) as span:
+        attempt = 0
+        while attempt < driver.ready_retries:
+            attempt += 1
+            try:
+                await asyncio.to_thread(driver.probe, container)
+                break
+            except Exception as e:
+                if attempt >= driver.ready_retries:
+                    raise RuntimeError(f"Database '{container.name}' deployed but can not be reached")
+                
+                logger.info(f"Attempt {attempt}: Database '{container.name}' not ready yet, retrying in {driver.ready_interval} seconds...")
+                await asyncio.sleep(driver.ready_interval)
+        
+        span.set_attribute("attempts", attempt)
+    
+    logger.info(f"Database '{container.name}' is ready")
+
+def remove_container(docker_client: docker.DockerClient, container, name: str):
+    if container is not None:
+        try:
+            container.remove(force=True)
+            logger.info(f"Container '{name}' removed due to failure")
+        except docker.errors.NotFound:
+            logger.warning(f"Container '{name}' not found during cleanup")
+        except Exception as cleanup_err:
+            logger.error(f"Failed to cleanup container '{name}': {cleanup_err}")
+    else:
+        try:
+            c = docker_client.containers.get(name)
+            c.remove(force=True)
+            logger.info(f"Container '{name}' removed by name during failure cleanup")
+        except docker.errors.NotFound:
+            logger.warning(f"Container '{name}' not found by name during cleanup")
+        except Exception as cleanup_err:
+            logger.error(f"Failed to cleanup container '{name}': {cleanup_err}")
+
+def build_index_data(request: DeployRequest):
+    return {
+        "id": request.id,
+        "tags": request.tags,
+        "connection": {
+            "manager": request.connection.manager,
+            "ip": request.id,
+            "port": request.connection.port,
+            "external": False        
+        },
+        "state": "running",
+        "resources": request.resources.model_dump(exclude_none=True)
+    }
 
-#TODO: Clean route code
 @app.post("/deploy")
 async def deploy_database(
     request: DeployRequest,
     #image_file: Optional[UploadFile] = File(None)
 ):
     
-    
-    if request.connection.ip:
-        return JSONResponse(status_code=400, content={"message": "'ip' parameter can not be specified"})
-    
-    if request.connection.external != False:
-        return JSONResponse(status_code=400, content={"message": "'external' parameter can not be True"})
-    
     logger.info(f"Deploy request received with id '{request.id}' and manager '{request.connection.manager}'")
     
-    if request.connection.manager not in SUPPORTED_MANAGERS:
-        return JSONResponse(status_code=400, content={"message": f"Manager '{request.connection.manager}' not supported",
-                                                      "managers": SUPPORTED_MANAGERS})
+    #? Same checks as every item of a batch
+    error = validate_deploy_request(request)
+    if error is not None:
+        return JSONResponse(status_code=400, content={"message": error, "managers": SUPPORTED_MANAGERS})
         
     ############################! Container deploynment ############################
     
-    docker_client = docker.DockerClient(base_url=f"unix:/{DOCKER_SOCK}")
+    docker_client = get_docker_client()
     
-    container_image = None
-    container_port = None
-
-    if request.connection.manager == "mongodb": 
-        container_image= "mongo:latest"
-        container_port = "27017/tcp"
-    else:
-        return JSONResponse(status_code=400, content={"message": f"Manager '{request.connection.manager}' not supported",
-                                                      "managers": SUPPORTED_MANAGERS})
     container = None
+    allocated_port = None
     try:
         
         existing_containers = docker_client.containers.list(all=True)
         
-        for c in existing_containers:
-            if request.id in c.name or request.id == c.name:
-                return JSONResponse(
-                    status_code=400,
-                    content={"message": f"A container with name '{request.id}' already exists, rename the id"}
-                )
+        if container_name_taken(existing_containers, request.id):
+            return JSONResponse(
+                status_code=400,
+                content={"message": f"A container with name '{request.id}' already exists, rename the id"}
+            )
         
-        container = docker_client.containers.run(
-            image=container_image,
-            name=request.id,
-            detach=True,
-            ports={container_port: request.connection.port},
-            network=NETWORK_NAME,
-        )
+        allocated_port, error = reserve_port(request)
+        if error is not None:
+            return JSONResponse(status_code=400, content={"message": error})
         
-        container.reload()
-    
-        if container.status != "running":
-            logs = container.logs().decode()
-            raise RuntimeError(f"Database created but failed to start. Logs:\n{logs}")
+        error = reserve_resources(request)
+        if error is not None:
+            port_allocator.release(request.connection.port)
+            return JSONResponse(status_code=409, content={"message": error, "capacity": resource_ledger.summary()})
         
-        logger.info(f"Database '{request.id}' started successfully")
+        with tracing.start_span("run_container", attributes={"database.id": request.id}):
+            container = await asyncio.to_thread(run_container, docker_client, request, allocated_port)
     
         ############################! Database connection verification ############################
-        logger.info(f"Verifying database '{request.id}' connection...")
+        await wait_for_database(container, request.connection.manager)
         
-        attempt = 0
-        retries = 60
-        while True and attempt < retries:
-            attempt += 1
-            try:
-                if request.connection.manager == "mongodb": 
-                    client = MongoClient(request.id, 27017)
-                    client.admin.command("ping")
-                    client.close()
-                    break
-                else:
-                    return JSONResponse(status_code=400, content={"message": f"Manager '{request.connection.manager}' not supported",                                           "managers": SUPPORTED_MANAGERS})
-            except Exception as e:
-                if attempt >= retries:
-                    raise RuntimeError(f"Database '{request.id}' deployed but can not be reached")
-                
-                logger.info(f"Attempt {attempt}: Database '{request.id}' not ready yet, retrying in 2 seconds...")
-                await asyncio.sleep(2)             
-        
-        logger.info(f"Database '{request.id}' is ready")
         ############################! Database indexing ############################
         logger.info(f"Indexing database '{request.id}'...")
         
-        index_data = {
-            "id": request.id,
-            "tags": request.tags,
-            "connection": {
-                "manager": request.connection.manager,
-                "ip": request.id,
-                "port": request.connection.port,
-                "external": False        
-            }
-        }
+        index_data = build_index_data(request)
         
-        async with httpx.AsyncClient() as client:
+        async with upstream.client() as client:
             response = await client.post(f"{PROXIER_ADDRESS}/indexer/index", json=index_data)
             
             if response.status_code == 400:
@@ -189,52 +372,178 @@ async def deploy_database(
                 raise RuntimeError(f"Server error indexing database: {response.json()}")
             elif response.status_code != 200:
                 raise RuntimeError(f"Server error indexing database: {response.text}")
+            consistency_token = response.json().get("consistency_token")
     except Exception as e:
         logger.error(f"Deployment error for database '{request.id}': {e}")
-     
-        if container is not None:
-            try:
-                container.remove(force=True)
-                logger.info(f"Container '{request.id}' removed due to failure")
-            except docker.errors.NotFound:
-                logger.warning(f"Container '{request.id}' not found during cleanup")
-            except Exception as cleanup_err:
-                logger.error(f"Failed to cleanup container '{request.id}': {cleanup_err}")
-        else:
-            try:
-                c = docker_client.containers.get(request.id)
-                c.remove(force=True)
-                logger.info(f"Container '{request.id}' removed by name during failure cleanup")
-            except docker.errors.NotFound:
-                logger.warning(f"Container '{request.id}' not found by name during cleanup")
-            except Exception as cleanup_err:
-                logger.error(f"Failed to cleanup container '{request.id}': {cleanup_err}")
-
+        remove_container(docker_client, container, request.id)
+        if allocated_port is not None:
+            port_allocator.release(request.connection.port)
+            resource_ledger.release(request.id)
         return JSONResponse(status_code=500, content={"message": f"Deployment aborted: {e}"})
         
+    last_access[request.id] = time.time()
     logger.info(f"Database '{request.id}' ready an indexed")
     
     return JSONResponse(
         status_code=200,
-        content={"message": f"Database '{request.id}' is indexed and ready"}
+        content={"message": f"Database '{request.id}' is indexed and ready", "document": index_data,
+                 "consistency_token": consistency_token}
+    )
+
+@app.post("/deploy_batch")
+async def deploy_database_batch(request: DeployBatchRequest):
+    
+    if not request.databases:
+        return JSONResponse(status_code=400, content={"message": "Databases list is empty"})
+    
+    parallelism = DEPLOY_BATCH_PARALLELISM if request.parallelism is None else request.parallelism
+    if parallelism < 1:
+        return JSONResponse(status_code=400, content={"message": "'parallelism' must be greater than 0"})
+    parallelism = min(parallelism, DEPLOY_BATCH_MAX_PARALLELISM)
+    
+    logger.info(f"Batch deploy request received with {len(request.databases)} databases (parallelism {parallelism})")
+    
+    docker_client = get_docker_client()
+    results = [None] * len(request.databases)
+    
+    ############################! Batch validation and port reservation ############################
+    
+    try:
+        existing_containers = await asyncio.to_thread(docker_client.containers.list, all=True)
+    except Exception as e:
+        logger.error(f"Could not list existing containers: {e}")
+        return JSONResponse(status_code=500, content={"message": f"Deployment aborted: {e}"})
+    
+    batch_ids = set()
+    allocated_ports = {}
+    pending = []
+    
+    for i, item in enumerate(request.databases):
+        error = validate_deploy_request(item)
+        
+        if error is None and item.id in batch_ids:
+            error = f"Id '{item.id}' is repeated in the batch"
+        if error is None and container_name_taken(existing_containers, item.id):
+            error = f"A container with name '{item.id}' already exists, rename the id"
+        if error is None:
+            allocated_ports[i], error = reserve_port(item)
+        if error is None:
+            error = reserve_resources(item)
+            if error is not None:
+                port_allocator.release(item.connection.port)
+        
+        if error is not None:
+            results[i] = {"id": item.id, "status": "failed", "message": error}
+            continue
+        
+        batch_ids.add(item.id)
+        pending.append(i)
+    
+    ############################! Concurrent container deploynment ############################
+    
+    semaphore = asyncio.Semaphore(parallelism)
+    containers = {}
+    
+    async def deploy_item(i: int):
+        item = request.databases[i]
+        async with semaphore:
+            container = None
+            try:
+                with tracing.start_span("run_container", attributes={"database.id": item.id}):
+                    container = await asyncio.to_thread(run_container, docker_client, item, allocated_ports[i])
+                await wait_for_database(container, item.connection.manager)
+                containers[i] = container
+            except Exception as e:
+                logger.error(f"Deployment error for database '{item.id}': {e}")
+                await asyncio.to_thread(remove_container, docker_client, container, item.id)
+                port_allocator.release(item.connection.port)
+                resource_ledger.release(item.id)
+                results[i] = {"id": item.id, "status": "failed", "message": f"Deployment aborted: {e}"}
+    
+    await asyncio.gather(*(deploy_item(i) for i in pending))
+    
+    ############################! Bulk database indexing ############################
+    
+    ready = sorted(containers)
+    
+    if ready:
+        logger.info(f"Indexing {len(ready)} databases...")
+        
+        index_results = {}
+        index_error = None
+        consistency_token = None
+        try:
+            async with upstream.client() as client:
+                response = await client.post(
+                    f"{PROXIER_ADDRESS}/indexer/index_batch",
+                    json={"databases": [build_index_data(request.databases[i]) for i in ready]}
+                )
+            
+            if response.status_code != 200:
+                raise RuntimeError(f"Server error indexing databases: {response.text}")
+            
+            index_results = {r["id"]: r for r in response.json()["results"]}
+            consistency_token = response.json().get("consistency_token")
+        except Exception as e:
+            logger.error(f"Bulk indexing error: {e}")
+            index_error = str(e)
+        
+        for i in ready:
+            item = request.databases[i]
+            outcome = index_results.get(item.id)
+            
+            if outcome is not None and outcome["status"] == "indexed":
+                last_access[item.id] = time.time()
+                results[i] = {"id": item.id, "status": "deployed", "message": f"Database '{item.id}' is indexed and ready",
+                              "port": item.connection.port, "consistency_token": consistency_token}
+                continue
+            
+            message = outcome["message"] if outcome is not None else index_error
+            logger.error(f"Indexing error for database '{item.id}': {message}")
+            await asyncio.to_thread(remove_container, docker_client, containers[i], item.id)
+            port_allocator.release(item.connection.port)
+            resource_ledger.release(item.id)
+            results[i] = {"id": item.id, "status": "failed", "message": f"Deployment aborted: {message}"}
+    
+    deployed = sum(1 for r in results if r["status"] == "deployed")
+    
+    if deployed == len(results):
+        status_code = 200
+    elif deployed == 0:
+        status_code = 500
+    else:
+        status_code = 207
+    
+    logger.info(f"Batch deploy finished, {deployed} of {len(results)} databases ready and indexed")
+    
+    return JSONResponse(
+        status_code=status_code,
+        content={"message": f"{deployed} of {len(results)} databases are indexed and ready", "results": results}
     )
 
 @app.post("/delete")
 async def delete_database(request: DeleteRequest):
-    docker_client = docker.DockerClient(base_url=f"unix:/{DOCKER_SOCK}")
+    docker_client = get_docker_client()
     
-    async with httpx.AsyncClient() as client:
+    async with upstream.client() as client:
             response = await client.post(f"{PROXIER_ADDRESS}/indexer/delete", json=request.model_dump())
             if response.status_code != 200:
                 return JSONResponse(status_code=response.status_code, content=response.json())
+            consistency_token = response.json().get("consistency_token")
     
     try:
         container = docker_client.containers.get(request.id)
         container.remove(force=True)
+        for port in get_used_host_ports([container]):
+            port_allocator.release(port)
+        resource_ledger.release(request.id)
+        last_access.pop(request.id, None)
+        activity_counters.pop(request.id, None)
+        wake_locks.pop(request.id, None)
         logger.info(f"Container '{request.id}' deleted successfully")
         return JSONResponse(
             status_code=200,
-            content={"message": f"Database '{request.id}' deleted successfully"}
+            content={"message": f"Database '{request.id}' deleted successfully", "consistency_token": consistency_token}
         )
     except docker.errors.NotFound:
         logger.warning(f"Container '{request.id}' not found")
@@ -254,5 +563,112 @@ async def delete_database(request: DeleteRequest):
             status_code=500,
             content={"message": f"Unexpected error: {e}"}
         )
-           
-        
\ No newline at end of file
+
+############################! Hibernation ############################
+
+def find_idle_containers(docker_client: docker.DockerClient):
+    now = time.time()
+    idle = []
+    
+    for c in docker_client.containers.list(filters={"label": f"{MANAGED_LABEL}=true"}):
+        try:
+            counter = DRIVERS[c.labels.get("bsm_db_service.manager", "mongodb")].activity(c)
+        except Exception as e:
+            logger.warning(f"Could not read activity of container '{c.name}': {e}")
+            continue
+        
+        #? Counted by the database itself, the probes of 'monitor' are not part of it
+        previous = activity_counters.get(c.name)
+        activity_counters[c.name] = counter
+        if previous is None or counter != previous:
+            last_access[c.name] = now
+        
+        if now - last_access.setdefault(c.name, now) > HIBERNATION_IDLE_SECONDS:
+            idle.append(c)
+    
+    return idle
+
+async def set_index_state(name: str, state: str):
+    async with upstream.client() as client:
+        response = await client.post(f"{PROXIER_ADDRESS}/indexer/state", json={"id": name, "state": state})
+    if response.status_code != 200:
+        raise RuntimeError(f"Server error updating state of database '{name}': {response.text}")
+    return response.json().get("consistency_token")
+
+async def hibernate_container(container):
+    name = container.name
+    async with wake_locks.setdefault(name, asyncio.Lock()):
+        #? It could have been woken up while waiting for the lock
+        if time.time() - last_access.get(name, 0) <= HIBERNATION_IDLE_SECONDS:
+            return
+        
+        logger.info(f"Hibernating idle database '{name}'")
+        await set_index_state(name, "hibernated")
+        try:
+            await asyncio.to_thread(container.stop)
+        except Exception:
+            await set_index_state(name, "running")
+            raise
+        
+        resource_ledger.release(name)
+        activity_counters.pop(name, None)
+        logger.info(f"Database '{name}' hibernated")
+
+async def hibernation_loop():
+    docker_client = get_docker_client()
+    while True:
+        await asyncio.sleep(HIBERNATION_CHECK_INTERVAL)
+        try:
+            idle = await asyncio.to_thread(find_idle_containers, docker_client)
+        except Exception as e:
+            logger.error(f"Hibernation check failed: {e}")
+            continue
+        
+        for container in idle:
+            try:
+                await hibernate_container(container)
+            except Exception as e:
+                logger.error(f"Failed to hibernate database '{container.name}': {e}")
+
+@app.post("/wake")
+async def wake_database(request: WakeRequest):
+    docker_client = get_docker_client()
+    
+    async with wake_locks.setdefault(request.id, asyncio.Lock()):
+        try:
+            container = await asyncio.to_thread(docker_client.containers.get, request.id)
+        except docker.errors.NotFound:
+            return JSONResponse(status_code=404, content={"message": f"Container '{request.id}' not found"})
+        
+        last_access[request.id] = time.time()
+        
+        if container.status == "running":
+            return JSONResponse(status_code=200, content={"message": f"Database '{request.id}' is already running", "state": "running"})
+        
+        host_config = container.attrs.get("HostConfig", {})
+        profile = ResourceProfile(mem_limit=host_config.get("Memory") or None, nano_cpus=host_config.get("NanoCpus") or None)
+        error = resource_ledger.reserve(request.id, profile)
+        if error is not None:
+            return JSONResponse(status_code=409, content={"message": error, "capacity": resource_ledger.summary()})
+        
+        manager = container.labels.get("bsm_db_service.manager", "mongodb")
+        
+        try:
+            logger.info(f"Waking up database '{request.id}'")
+            await asyncio.to_thread(container.start)
+            await wait_for_database(container, manager)
+            consistency_token = await set_index_state(request.id, "running")
+        except Exception as e:
+            logger.error(f"Failed to wake up database '{request.id}': {e}")
+            try:
+                await asyncio.to_thread(container.stop)
+            except Exception as stop_err:
+                logger.error(f"Failed to stop database '{request.id}' after wake up failure: {stop_err}")
+            resource_ledger.release(request.id)
+            return JSONResponse(status_code=500, content={"message": f"Wake up aborted: {e}"})
+        
+        last_access[request.id] = time.time()
+        logger.info(f"Database '{request.id}' is awake")
+    
+    return JSONResponse(status_code=200, content={"message": f"Database '{request.id}' is awake and ready", "state": "running",
+                                                  "consistency_token": consistency_token})
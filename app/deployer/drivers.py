@@ -0,0 +1,220 @@
+from abc import ABC, abstractmethod
+from pymongo import MongoClient
+from resources import ResourceProfile
+import socket
+import os
+
+MIB = 1024 ** 2
+GIB = 1024 ** 3
+
+class DatabaseDriver(ABC):
+    name: str = None
+    image: str = None
+    internal_port: int = None
+    default_resources: dict = {"mem_limit": "1g", "nano_cpus": 1_000_000_000}
+    ready_retries: int = 60
+    ready_interval: float = 2
+
+    def __init__(self):
+        self.image = os.getenv(f"{self.name.upper()}_IMAGE", self.image)
+
+    def tune(self, profile: ResourceProfile):
+        return profile
+
+    def command(self, profile: ResourceProfile):
+        return None
+
+    def environment(self, profile: ResourceProfile):
+        return {}
+
+    def run_kwargs(self, profile: ResourceProfile):
+        return {}
+
+    @abstractmethod
+    def probe(self, container):
+        pass
+
+    @abstractmethod
+    def activity(self, container):
+        #? A counter of the operations sent by clients, the checks of 'monitor', the readiness probes and the reading itself left out
+        pass
+
+    def exec_probe(self, container, command: list):
+        exit_code, output = container.exec_run(command)
+        if exit_code != 0:
+            raise RuntimeError(f"Readiness probe failed with exit code {exit_code}: {output.decode(errors='replace')}")
+
+    def exec_output(self, container, command: list):
+        exit_code, output = container.exec_run(command, stderr=False)
+        if exit_code != 0:
+            raise RuntimeError(f"'{command[0]}' failed with exit code {exit_code}: {output.decode(errors='replace')}")
+        return output.decode(errors="replace").strip()
+
+class MongoDBDriver(DatabaseDriver):
+    name = "mongodb"
+    image = "mongo:latest"
+    internal_port = 27017
+
+    def tune(self, profile: ResourceProfile):
+        if profile.wiredtiger_cache_gb is None and profile.mem_limit:
+            #? Same rule mongod applies to the host memory: 50% of (RAM - 1 GB), at least 0.25 GB
+            profile.wiredtiger_cache_gb = max(0.25, round((profile.mem_limit / GIB - 1) * 0.5, 2))
+        return profile
+
+    def command(self, profile: ResourceProfile):
+        if profile.wiredtiger_cache_gb:
+            return ["--wiredTigerCacheSizeGB", str(profile.wiredtiger_cache_gb)]
+        return None
+
+    def probe(self, container):
+        client = MongoClient(container.name, self.internal_port, serverSelectionTimeoutMS=2000)
+        try:
+            client.admin.command("ping")
+        finally:
+            client.close()
+
+    def activity(self, container):
+        client = MongoClient(container.name, self.internal_port, serverSelectionTimeoutMS=2000)
+        try:
+            totals = client.admin.command("top")["totals"]
+        finally:
+            client.close()
+        #? Only operations on collections count, 'hello' and 'ping' touch none and sessions are kept in 'config'
+        return sum(
+            usage["total"]["count"] for namespace, usage in totals.items()
+            if isinstance(usage, dict) and namespace.split(".")[0] not in ("admin", "config", "local")
+        )
+
+class PostgreSQLDriver(DatabaseDriver):
+    name = "postgresql"
+    image = "postgres:latest"
+    internal_port = 5432
+
+    def command(self, profile: ResourceProfile):
+        settings = {
+            "max_connections": 200,
+            "checkpoint_completion_target": 0.9,
+            "wal_buffers": "16MB",
+            "random_page_cost": 1.1,
+            "effective_io_concurrency": 200,
+        }
+        if profile.mem_limit:
+            memory_mb = profile.mem_limit // MIB
+            settings["shared_buffers"] = f"{max(memory_mb // 4, 32)}MB"
+            settings["effective_cache_size"] = f"{max(memory_mb * 3 // 4, 64)}MB"
+            settings["maintenance_work_mem"] = f"{min(max(memory_mb // 16, 16), 2048)}MB"
+            settings["work_mem"] = f"{max(memory_mb // 4 // settings['max_connections'], 4)}MB"
+        if profile.nano_cpus:
+            cpus = max(profile.nano_cpus // 1_000_000_000, 1)
+            settings["max_worker_processes"] = max(cpus, 8)
+            settings["max_parallel_workers"] = cpus
+            settings["max_parallel_workers_per_gather"] = max(cpus // 2, 1)
+
+        command = ["postgres"]
+        for key, value in settings.items():
+            command.extend(["-c", f"{key}={value}"])
+        return command
+
+    def environment(self, profile: ResourceProfile):
+        return {"POSTGRES_HOST_AUTH_METHOD": "trust"}
+
+    def run_kwargs(self, profile: ResourceProfile):
+        #? Docker default /dev/shm (64MB) is too small once shared_buffers grows
+        if profile.mem_limit:
+            return {"shm_size": max(profile.mem_limit // 4, 64 * MIB)}
+        return {}
+
+    def probe(self, container):
+        self.exec_probe(container, ["pg_isready", "-U", "postgres", "-h", "127.0.0.1"])
+
+    def activity(self, container):
+        #? Read from 'template1' so the transaction of the reading is not counted
+        output = self.exec_output(container, [
+            "psql", "-U", "postgres", "-h", "127.0.0.1", "-d", "template1", "-tAc",
+            "SELECT coalesce(sum(xact_commit + xact_rollback), 0) FROM pg_stat_database WHERE datname NOT IN ('template0', 'template1')",
+        ])
+        return int(output)
+
+#? Sent by 'monitor', the readiness probes, this reading and client libraries when connecting
+IGNORED_REDIS_COMMANDS = {"ping", "info", "hello", "command", "client"}
+
+class RedisDriver(DatabaseDriver):
+    name = "redis"
+    image = "redis:latest"
+    internal_port = 6379
+    default_resources = {"mem_limit": "512m", "nano_cpus": 1_000_000_000}
+    ready_retries = 30
+    ready_interval = 1
+
+    def command(self, profile: ResourceProfile):
+        command = ["redis-server", "--maxmemory-policy", "noeviction", "--tcp-keepalive", "60"]
+        if profile.mem_limit:
+            #? Headroom for the copy-on-write pages of background saves
+            command.extend(["--maxmemory", str(profile.mem_limit * 3 // 4)])
+        if profile.nano_cpus and profile.nano_cpus >= 2_000_000_000:
+            command.extend(["--io-threads", str(min(profile.nano_cpus // 1_000_000_000, 4))])
+        return command
+
+    def probe(self, container):
+        with socket.create_connection((container.name, self.internal_port), timeout=2) as connection:
+            connection.sendall(b"PING\r\n")
+            reply = connection.recv(64)
+        if not reply.startswith(b"+PONG"):
+            raise RuntimeError(f"Unexpected reply to PING: {reply!r}")
+
+    def activity(self, container):
+        with socket.create_connection((container.name, self.internal_port), timeout=2) as connection:
+            connection.sendall(b"INFO commandstats\r\n")
+            reply = connection.makefile("rb")
+            header = reply.readline()
+            if not header.startswith(b"$"):
+                raise RuntimeError(f"Unexpected reply to INFO: {header!r}")
+            stats = reply.read(int(header[1:]) + 2).decode(errors="replace")
+
+        calls = 0
+        for line in stats.splitlines():
+            if not line.startswith("cmdstat_"):
+                continue
+            command, _, values = line[len("cmdstat_"):].partition(":")
+            if command.split("|")[0] in IGNORED_REDIS_COMMANDS:
+                continue
+            calls += int(dict(value.split("=") for value in values.split(","))["calls"])
+        return calls
+
+class MySQLDriver(DatabaseDriver):
+    name = "mysql"
+    image = "mysql:latest"
+    internal_port = 3306
+    ready_retries = 90
+
+    def command(self, profile: ResourceProfile):
+        command = ["--skip-name-resolve", "--max-connections=200", "--innodb-flush-method=O_DIRECT"]
+        if profile.mem_limit:
+            buffer_pool_mb = max(profile.mem_limit * 6 // 10 // MIB, 128)
+            command.append(f"--innodb-buffer-pool-size={buffer_pool_mb}M")
+        return command
+
+    def environment(self, profile: ResourceProfile):
+        return {"MYSQL_ALLOW_EMPTY_PASSWORD": "yes"}
+
+    def probe(self, container):
+        #? Only succeeds once the final server listens on TCP, not the temporary one used on initialization
+        self.exec_probe(container, ["mysqladmin", "ping", "-h", "127.0.0.1", "--silent"])
+
+    def activity(self, container):
+        #? Statements of every connection but the reading's, the greeting read by 'monitor' runs none
+        output = self.exec_output(container, [
+            "mysql", "-h", "127.0.0.1", "-u", "root", "-N", "-B", "-e",
+            "SELECT coalesce(sum(count_star), 0) FROM performance_schema.events_statements_summary_by_thread_by_event_name "
+            "WHERE thread_id <> ps_current_thread_id()",
+        ])
+        return int(output)
+
+DRIVERS: dict[str, DatabaseDriver] = {}
+
+def register_driver(driver: DatabaseDriver):
+    DRIVERS[driver.name] = driver
+    return driver
+
+for driver_class in [MongoDBDriver, PostgreSQLDriver, RedisDriver, MySQLDriver]:
+    register_driver(driver_class())
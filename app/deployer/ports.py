@@ -0,0 +1,78 @@
+import threading
+
+class PortAllocator:
+
+    def __init__(self, start: int, end: int):
+        if start > end:
+            raise ValueError(f"Invalid port range {start}-{end}")
+
+        self.start = start
+        self.end = end
+        self.size = end - start + 1
+        self.bitmap = bytearray((self.size + 7) // 8)
+        self.outside = set()
+        self.cursor = 0
+        self.lock = threading.Lock()
+
+    def _in_range(self, port: int):
+        return self.start <= port <= self.end
+
+    def _get(self, offset: int):
+        return self.bitmap[offset >> 3] & (1 << (offset & 7))
+
+    def _set(self, offset: int):
+        self.bitmap[offset >> 3] |= 1 << (offset & 7)
+
+    def _clear(self, offset: int):
+        self.bitmap[offset >> 3] &= ~(1 << (offset & 7)) & 0xFF
+
+    def reconcile(self, used_ports: set):
+        with self.lock:
+            self.bitmap = bytearray(len(self.bitmap))
+            self.outside = set()
+            for port in used_ports:
+                if self._in_range(port):
+                    self._set(port - self.start)
+                else:
+                    self.outside.add(port)
+
+    def is_used(self, port: int):
+        with self.lock:
+            if self._in_range(port):
+                return bool(self._get(port - self.start))
+            return port in self.outside
+
+    def reserve(self, port: int):
+        with self.lock:
+            if self._in_range(port):
+                if self._get(port - self.start):
+                    return False
+                self._set(port - self.start)
+                return True
+
+            if port in self.outside:
+                return False
+            self.outside.add(port)
+            return True
+
+    def allocate(self):
+        with self.lock:
+            for i in range(self.size):
+                offset = (self.cursor + i) % self.size
+                if not self._get(offset):
+                    self._set(offset)
+                    self.cursor = (offset + 1) % self.size
+                    return self.start + offset
+            return None
+
+    def release(self, port: int):
+        with self.lock:
+            if self._in_range(port):
+                self._clear(port - self.start)
+            else:
+                self.outside.discard(port)
+
+    def free_count(self):
+        with self.lock:
+            used = sum(bin(byte).count("1") for byte in self.bitmap)
+            return self.size - used
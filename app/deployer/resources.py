@@ -0,0 +1,107 @@
+from pydantic import BaseModel
+from typing import Optional, Union
+import threading
+import os
+
+MEMORY_UNITS = {"b": 1, "k": 1024, "m": 1024 ** 2, "g": 1024 ** 3}
+
+class ResourceProfile(BaseModel):
+    mem_limit: Optional[Union[int, str]] = None
+    nano_cpus: Optional[int] = None
+    cpuset_cpus: Optional[str] = None
+    blkio_weight: Optional[int] = None
+    wiredtiger_cache_gb: Optional[float] = None
+
+def parse_memory(value):
+    if value is None:
+        return None
+    if isinstance(value, int):
+        return value
+
+    value = value.strip().lower()
+    if value[-1:] in MEMORY_UNITS:
+        return int(float(value[:-1]) * MEMORY_UNITS[value[-1]])
+    return int(value)
+
+def load_manager_profile(manager: str, defaults: dict):
+    prefix = manager.upper()
+    profile = {
+        "mem_limit": os.getenv(f"{prefix}_MEM_LIMIT", defaults.get("mem_limit")),
+        "nano_cpus": os.getenv(f"{prefix}_NANO_CPUS", defaults.get("nano_cpus")),
+        "cpuset_cpus": os.getenv(f"{prefix}_CPUSET_CPUS", defaults.get("cpuset_cpus")),
+        "blkio_weight": os.getenv(f"{prefix}_BLKIO_WEIGHT", defaults.get("blkio_weight")),
+        "wiredtiger_cache_gb": os.getenv(f"{prefix}_WIREDTIGER_CACHE_GB", defaults.get("wiredtiger_cache_gb")),
+    }
+    return ResourceProfile(**{k: v for k, v in profile.items() if v not in (None, "")})
+
+def resolve_profile(default: ResourceProfile, requested: Optional[ResourceProfile]):
+    profile = default.model_copy()
+    if requested is not None:
+        profile = profile.model_copy(update=requested.model_dump(exclude_none=True))
+
+    profile.mem_limit = parse_memory(profile.mem_limit)
+
+    if profile.blkio_weight is not None and not 10 <= profile.blkio_weight <= 1000:
+        raise ValueError("'blkio_weight' must be between 10 and 1000")
+    if profile.nano_cpus is not None and profile.nano_cpus <= 0:
+        raise ValueError("'nano_cpus' must be greater than 0")
+    if profile.mem_limit is not None and profile.mem_limit <= 0:
+        raise ValueError("'mem_limit' must be greater than 0")
+
+    return profile
+
+def container_run_kwargs(profile: ResourceProfile):
+    kwargs = {
+        "mem_limit": profile.mem_limit,
+        "nano_cpus": profile.nano_cpus,
+        "cpuset_cpus": profile.cpuset_cpus,
+        "blkio_weight": profile.blkio_weight,
+    }
+    return {k: v for k, v in kwargs.items() if v is not None}
+
+class ResourceLedger:
+
+    def __init__(self, memory_capacity: int, nano_cpus_capacity: int):
+        self.memory_capacity = memory_capacity
+        self.nano_cpus_capacity = nano_cpus_capacity
+        self.allocations = {}
+        self.lock = threading.Lock()
+
+    def _used(self):
+        memory = sum(m for m, _ in self.allocations.values())
+        nano_cpus = sum(c for _, c in self.allocations.values())
+        return memory, nano_cpus
+
+    def reconcile(self, allocations: dict):
+        with self.lock:
+            self.allocations = dict(allocations)
+
+    def reserve(self, name: str, profile: ResourceProfile):
+        memory = profile.mem_limit or 0
+        nano_cpus = profile.nano_cpus or 0
+
+        with self.lock:
+            used_memory, used_nano_cpus = self._used()
+
+            if used_memory + memory > self.memory_capacity:
+                free = max(self.memory_capacity - used_memory, 0)
+                return f"Not enough host memory, requested {memory} bytes but only {free} bytes are free"
+            if used_nano_cpus + nano_cpus > self.nano_cpus_capacity:
+                free = max(self.nano_cpus_capacity - used_nano_cpus, 0)
+                return f"Not enough host CPU, requested {nano_cpus} nano CPUs but only {free} nano CPUs are free"
+
+            self.allocations[name] = (memory, nano_cpus)
+            return None
+
+    def release(self, name: str):
+        with self.lock:
+            self.allocations.pop(name, None)
+
+    def summary(self):
+        with self.lock:
+            used_memory, used_nano_cpus = self._used()
+            return {
+                "memory": {"capacity": self.memory_capacity, "used": used_memory},
+                "nano_cpus": {"capacity": self.nano_cpus_capacity, "used": used_nano_cpus},
+                "containers": len(self.allocations),
+            }
@@ -2,11 +2,11 @@ from fastapi import FastAPI
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 from pymongo import MongoClient
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 from dotenv import load_dotenv, find_dotenv
+from common import dbindex, metrics, probes, tracing
 from typing import Optional
-import asyncio
 import logging
-import httpx
 import os
 
 class ConnectionData(BaseModel):
@@ -19,10 +19,21 @@ class IndexRequest(BaseModel):
     id: str
     tags: dict
     connection: ConnectionData
+    state: Optional[str] = None
+    resources: Optional[dict] = None
     
+class IndexBatchRequest(BaseModel):
+    databases: list[IndexRequest]
+
 class DeleteRequest(BaseModel):
     id: str
 
+class StateRequest(BaseModel):
+    id: str
+    state: str
+
+SUPPORTED_STATES = ["running", "hibernated"]
+
 ON_CONATAINER = True
 
 if not ON_CONATAINER:
@@ -30,7 +41,7 @@ if not ON_CONATAINER:
 
 DBINDEX_IP = os.getenv("DBINDEX_IP", "dbindex")
 DBINDEX_PORT = os.getenv("DBINDEX_PORT", 27017)
-DBINDEX_ADDRESS = f"mongodb://{DBINDEX_IP}:{DBINDEX_PORT}"
+DBINDEX_ADDRESS = dbindex.address(DBINDEX_IP, DBINDEX_PORT)
 
 SEARCHER_IP = os.getenv("SEARCHER_IP", "searcher")
 SEARCHER_PORT = os.getenv("SEARCHER_PORT", 46000)
@@ -42,50 +53,48 @@ DBINDEX_COLLECTION_NAME = os.getenv("DBINDEX_COLLECTION_NAME", "databases")
 logger = logging.getLogger("uvicorn.error")
 client: MongoClient | None = None
 
-async def connect_to_service(service_name: str, service_address: str, retries: int = None):
-    logger.info(f"Connecting to '{service_name}' at {service_address}")
-    async with httpx.AsyncClient() as client:
-        attempt = 0
-        while retries is None or attempt < retries:
-            try:
-                response = await client.get(f"{service_address}/health")
-                response.raise_for_status()
-                logger.info(f"Successfully connected to '{service_name}' at {service_address}")
-                break
-            except Exception as e:
-                attempt += 1
-                logger.error(f"Failed to connect to '{service_name}' at {service_address} (attempt {attempt}): {e}")
-                await asyncio.sleep(2)
-    return None
-
-async def connect_to_mongodb(service_name: str, service_address: str, client: MongoClient, retries: int = None):
-    logger.info(f"Connecting to '{service_name}' at {service_address}")
-    attempt = 0
-    while retries is None or attempt < retries:
-        try:
-            client.server_info()
-            logger.info(f"Successfully connected to '{service_name}' at {service_address}")
-            break
-        except Exception as e:
-            attempt += 1
-            logger.error(f"Failed to connect to '{service_name}' at {service_address} (attempt {attempt}): {e}")
-            await asyncio.sleep(2)
-    return None
+#? Server error code of a write rejected by a unique index
+DUPLICATE_KEY = 11000
+
+def prepare_dbindex():
+    probes.ping_mongodb(client)
+    collection = get_collection()
+    #? Earlier versions created it without 'unique', an index with the same name and other options can not be created
+    index = collection.index_information().get("id_1")
+    if index is not None and not index.get("unique"):
+        collection.drop_index("id_1")
+    collection.create_index("id", unique=True)
+
+startup = probes.StartupProbes({
+    "searcher": lambda: probes.check_service(None, SEARCHER_ADDRESS),
+    "dbindex": prepare_dbindex,
+})
 
 async def lifespan(app: FastAPI):
     logger.info(f"Starting service INDEXER")
-    await connect_to_service('SEARCHER', SEARCHER_ADDRESS)
     logger.info(f"Connecting to 'DBIndex' at {DBINDEX_ADDRESS}")
-    client = MongoClient(DBINDEX_ADDRESS)
-    await connect_to_mongodb("DBINDEX", DBINDEX_ADDRESS, client)
+    global client
+    client = MongoClient(DBINDEX_ADDRESS, event_listeners=metrics.mongo_listeners() + tracing.mongo_listeners())
+    await startup.run()
     yield
+    await startup.stop()
+    client.close()
     logger.info("Shutting down service INDEXER")
     
 app = FastAPI(lifespan=lifespan)
+metrics.instrument_app(app, "indexer")
+tracing.instrument_app(app, "indexer")
+
+def get_collection():
+    return client[DBINDEX_DB_NAME][DBINDEX_COLLECTION_NAME]
 
 @app.get("/health")
 async def health_check():
-    return {"status": "ok"}
+    return startup.summary()
+
+@app.get("/ready")
+async def ready():
+    return await probes.readiness({"dbindex": lambda: probes.check_mongodb(client, writable=True)})
 
 @app.post("/index")
 async def index_database(request: IndexRequest):
@@ -99,45 +108,156 @@ async def index_database(request: IndexRequest):
     if not request.tags:
         return JSONResponse(status_code=400, content={"message": "Tags dictionary is empty"})
     
-    client = MongoClient(DBINDEX_ADDRESS)
-    db = client[DBINDEX_DB_NAME]
-    collection = db[DBINDEX_COLLECTION_NAME]
+    collection = get_collection()
     
-    result = collection.find_one({"id": request.id})
-    if result:
-        return JSONResponse(status_code=400, content={"message": f"Database with ID {request.id} already indexed"})
+    with dbindex.write_session(client) as session:
+        result = collection.find_one({"id": request.id}, session=session)
+        if result:
+            return JSONResponse(status_code=409, content={"message": f"Database with ID {request.id} already indexed"})
+        
+        document = {
+            "id": request.id,
+            "tags": request.tags,
+            "connection": request.connection.model_dump()
+        }
+        if request.state is not None:
+            document["state"] = request.state
+        if request.resources is not None:
+            document["resources"] = request.resources
+        
+        #? Two requests with the same id can both pass the check above, the unique index lets only one in
+        try:
+            collection.insert_one(document, session=session)
+        except DuplicateKeyError:
+            return JSONResponse(status_code=409, content={"message": f"Database with ID {request.id} already indexed"})
+        document.pop("_id", None)
+        token = dbindex.encode_token(session)
+    
+    return JSONResponse(
+        status_code=200,
+        content={"message": f"Database with ID {request.id} indexed successfully", "document": document,
+                 "consistency_token": token}
+    )
     
-    document = {
-        "id": request.id,
-        "tags": request.tags,
-        "connection": request.connection.model_dump()
-    }
+@app.post("/index_batch")
+async def index_database_batch(request: IndexBatchRequest):
     
-    collection.insert_one(document)
-    document.pop("_id", None)
+    if not request.databases:
+        return JSONResponse(status_code=400, content={"message": "Databases list is empty"})
+    
+    collection = get_collection()
+    
+    ids = [item.id for item in request.databases]
+    with dbindex.write_session(client) as session:
+        existing_ids = {doc["id"] for doc in collection.find({"id": {"$in": ids}}, {"_id": 0, "id": 1}, session=session)}
+        results, token = insert_batch(collection, request, existing_ids, session)
+    
+    indexed = sum(1 for r in results if r["status"] == "indexed")
     
     return JSONResponse(
         status_code=200,
-        content={"message": f"Database with ID {request.id} indexed successfully", "document": document}
+        content={"message": f"{indexed} of {len(results)} databases indexed successfully", "results": results,
+                 "consistency_token": token}
     )
+
+def insert_batch(collection, request: IndexBatchRequest, existing_ids: set, session):
+    
+    results = [None] * len(request.databases)
+    documents = []
+    positions = []
+    batch_ids = set()
+    
+    for i, item in enumerate(request.databases):
+        error = None
+        if item.connection.external:
+            error = "Indexing external databases is not supported yet"
+        elif not item.id:
+            error = "ID is empty"
+        elif not item.tags:
+            error = "Tags dictionary is empty"
+        elif item.id in existing_ids:
+            error = f"Database with ID {item.id} already indexed"
+        elif item.id in batch_ids:
+            error = f"Database with ID {item.id} is repeated in the batch"
+        
+        if error is not None:
+            results[i] = {"id": item.id, "status": "failed", "message": error}
+            continue
+        
+        batch_ids.add(item.id)
+        positions.append(i)
+        document = {
+            "id": item.id,
+            "tags": item.tags,
+            "connection": item.connection.model_dump()
+        }
+        if item.state is not None:
+            document["state"] = item.state
+        if item.resources is not None:
+            document["resources"] = item.resources
+        documents.append(document)
+    
+    failed_positions = {}
+    if documents:
+        try:
+            collection.insert_many(documents, ordered=False, session=session)
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                if error.get("code") == DUPLICATE_KEY:
+                    failed_positions[error["index"]] = f"Database with ID {documents[error['index']]['id']} already indexed"
+                else:
+                    failed_positions[error["index"]] = error.get("errmsg", "Write error")
+    
+    for position, (i, document) in enumerate(zip(positions, documents)):
+        document.pop("_id", None)
+        if position in failed_positions:
+            results[i] = {"id": document["id"], "status": "failed", "message": failed_positions[position]}
+        else:
+            results[i] = {"id": document["id"], "status": "indexed",
+                          "message": f"Database with ID {document['id']} indexed successfully", "document": document}
+    
+    return results, dbindex.encode_token(session)
     
 @app.post("/delete")
 async def delete_database(request: DeleteRequest):  
     if not request.id:
         return JSONResponse(status_code=400, content={"message": "ID is empty"})
     
-    client = MongoClient(DBINDEX_ADDRESS)
-    db = client[DBINDEX_DB_NAME]
-    collection = db[DBINDEX_COLLECTION_NAME]
+    collection = get_collection()
     
-    result = collection.find_one({"id": request.id})
-    if not result:
-        return JSONResponse(status_code=404, content={"message": f"No database found with ID {request.id}"})
+    with dbindex.write_session(client) as session:
+        result = collection.find_one({"id": request.id}, session=session)
+        if not result:
+            return JSONResponse(status_code=404, content={"message": f"No database found with ID {request.id}"})
+        
+        collection.delete_one({"id": request.id}, session=session)
+        result.pop("_id", None)
+        token = dbindex.encode_token(session)
     
-    collection.delete_one({"id": request.id})
-    result.pop("_id", None)
+    return JSONResponse(
+        status_code=200,
+        content={"message": f"Database with ID {request.id} deleted successfully", "document": result,
+                 "consistency_token": token}
+    )
+
+@app.post("/state")
+async def update_state(request: StateRequest):
+    if not request.id:
+        return JSONResponse(status_code=400, content={"message": "ID is empty"})
+    
+    if request.state not in SUPPORTED_STATES:
+        return JSONResponse(status_code=400, content={"message": f"State '{request.state}' not supported",
+                                                      "states": SUPPORTED_STATES})
+    
+    collection = get_collection()
+    
+    with dbindex.write_session(client) as session:
+        result = collection.update_one({"id": request.id}, {"$set": {"state": request.state}}, session=session)
+        token = dbindex.encode_token(session)
+    if result.matched_count == 0:
+        return JSONResponse(status_code=404, content={"message": f"No database found with ID {request.id}"})
     
     return JSONResponse(
         status_code=200,
-        content={"message": f"Database with ID {request.id} deleted successfully", "document": result}
+        content={"message": f"Database with ID {request.id} is now {request.state}", "consistency_token": token}
     )
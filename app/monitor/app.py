@@ -0,0 +1,258 @@
+from fastapi import FastAPI
+from pymongo import MongoClient, UpdateOne
+from dotenv import load_dotenv, find_dotenv
+from common import dbindex, metrics, probes, tracing
+from datetime import datetime, timezone
+import asyncio
+import logging
+import struct
+import math
+import bson
+import time
+import os
+
+ON_CONATAINER = True
+
+if not ON_CONATAINER:
+    load_dotenv(find_dotenv())
+
+DBINDEX_IP = os.getenv("DBINDEX_IP", "dbindex")
+DBINDEX_PORT = os.getenv("DBINDEX_PORT", 27017)
+DBINDEX_ADDRESS = dbindex.address(DBINDEX_IP, DBINDEX_PORT)
+DBINDEX_DB_NAME = os.getenv("DBINDEX_DB_NAME", "dbindex")
+DBINDEX_COLLECTION_NAME = os.getenv("DBINDEX_COLLECTION_NAME", "databases")
+
+MONITOR_INTERVAL = float(os.getenv("MONITOR_INTERVAL", 30))
+MONITOR_MAX_IN_FLIGHT = int(os.getenv("MONITOR_MAX_IN_FLIGHT", 50))
+MONITOR_PROBE_TIMEOUT = float(os.getenv("MONITOR_PROBE_TIMEOUT", 2))
+MONITOR_FAILURE_THRESHOLD = int(os.getenv("MONITOR_FAILURE_THRESHOLD", 2))
+MONITOR_LATENCY_WINDOW = int(os.getenv("MONITOR_LATENCY_WINDOW", 20))
+
+#? Deployed databases are reached by container name on the shared network, so on the port inside the container
+INTERNAL_PORTS = {
+    manager: int(os.getenv(f"{manager.upper()}_INTERNAL_PORT", port))
+    for manager, port in {"mongodb": 27017, "postgresql": 5432, "redis": 6379, "mysql": 3306}.items()
+}
+
+logger = logging.getLogger("uvicorn.error")
+client: MongoClient | None = None
+last_cycle: dict = {}
+
+def prepare_dbindex():
+    probes.ping_mongodb(client)
+    get_collection().create_index("health.status")
+
+startup = probes.StartupProbes({"dbindex": prepare_dbindex})
+
+async def lifespan(app: FastAPI):
+    logger.info("Starting service 'MONITOR'")
+
+    #? Every worker would probe the whole fleet again and overwrite the others' latency windows
+    if int(os.getenv("WEB_CONCURRENCY", 1)) > 1:
+        logger.error("Service 'MONITOR' can not run with more than one worker")
+        raise RuntimeError("WEB_CONCURRENCY must be 1 for 'MONITOR'")
+
+    global client
+    client = MongoClient(DBINDEX_ADDRESS, event_listeners=metrics.mongo_listeners() + tracing.mongo_listeners())
+    await startup.run()
+
+    monitor_task = asyncio.create_task(monitor_loop())
+    logger.info(f"Probing indexed databases every {MONITOR_INTERVAL} seconds, {MONITOR_MAX_IN_FLIGHT} at once")
+
+    yield
+
+    monitor_task.cancel()
+    await startup.stop()
+    client.close()
+    logger.info("Shutting down service 'MONITOR'")
+
+app = FastAPI(lifespan=lifespan)
+metrics.instrument_app(app, "monitor")
+tracing.instrument_app(app, "monitor")
+
+def get_collection():
+    return client[DBINDEX_DB_NAME][DBINDEX_COLLECTION_NAME]
+
+@app.get("/health")
+async def health_check():
+    return startup.summary()
+
+@app.get("/ready")
+async def ready():
+    return await probes.readiness({"dbindex": lambda: probes.check_mongodb(client, writable=True)})
+
+@app.get("/status")
+async def status():
+    return {"interval": MONITOR_INTERVAL, "max_in_flight": MONITOR_MAX_IN_FLIGHT, "last_cycle": last_cycle}
+
+############################! Probes ############################
+
+async def exchange(host: str, port: int, request: bytes | None, read):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        if request:
+            writer.write(request)
+            await writer.drain()
+        return await read(reader)
+    finally:
+        writer.close()
+
+async def probe_mongodb(host: str, port: int):
+    #? A 'hello' OP_MSG, the same round trip drivers use for their own monitoring
+    document = bson.encode({"hello": 1, "$db": "admin"})
+    body = struct.pack("<I", 0) + b"\x00" + document
+    request = struct.pack("<iiii", 16 + len(body), 1, 0, 2013) + body
+
+    async def read(reader):
+        length, = struct.unpack("<i", await reader.readexactly(4))
+        reply = bson.decode((await reader.readexactly(length - 4))[17:])
+        if not reply.get("ok"):
+            raise RuntimeError(f"'hello' failed: {reply.get('errmsg')}")
+
+    await exchange(host, port, request, read)
+
+async def probe_postgresql(host: str, port: int):
+    #? An SSLRequest is answered with a single byte before any authentication
+    async def read(reader):
+        if await reader.readexactly(1) not in (b"S", b"N"):
+            raise RuntimeError("Unexpected reply to SSLRequest")
+
+    await exchange(host, port, struct.pack("!ii", 8, 80877103), read)
+
+async def probe_redis(host: str, port: int):
+    async def read(reader):
+        reply = await reader.readline()
+        if not reply.startswith(b"+PONG"):
+            raise RuntimeError(f"Unexpected reply to PING: {reply!r}")
+
+    await exchange(host, port, b"PING\r\n", read)
+
+async def probe_mysql(host: str, port: int):
+    #? The server speaks first with its handshake packet
+    async def read(reader):
+        header = await reader.readexactly(4)
+        payload = await reader.readexactly(int.from_bytes(header[:3], "little"))
+        if payload[:1] == b"\xff":
+            raise RuntimeError(f"Handshake refused: {payload[3:].decode(errors='replace')}")
+
+    await exchange(host, port, None, read)
+
+PROBES = {"mongodb": probe_mongodb, "postgresql": probe_postgresql, "redis": probe_redis, "mysql": probe_mysql}
+
+def probe_target(connection: dict):
+    manager = connection.get("manager")
+    if connection.get("external") or manager not in INTERNAL_PORTS:
+        return connection.get("ip"), int(connection.get("port"))
+    return connection.get("ip"), INTERNAL_PORTS[manager]
+
+############################! Health ############################
+
+def percentile(values: list, q: float):
+    if not values:
+        return None
+    values = sorted(values)
+    #? Nearest rank, 'round' would round half to even and land one rank off on exact ranks
+    index = min(len(values) - 1, max(0, math.ceil(q * len(values) / 100) - 1))
+    return values[index]
+
+def next_health(previous: dict, latency: float | None, error: str | None):
+    samples = list(previous.get("samples_ms", []))
+    failures = previous.get("consecutive_failures", 0)
+
+    if error is None:
+        samples = (samples + [round(latency * 1000, 3)])[-MONITOR_LATENCY_WINDOW:]
+        failures = 0
+        status = "up"
+    else:
+        failures += 1
+        #? A single lost probe does not take a database down, MONITOR_FAILURE_THRESHOLD in a row do
+        status = "down" if failures >= MONITOR_FAILURE_THRESHOLD else previous.get("status", "unknown")
+        if status == "hibernated":
+            status = "unknown"
+        #? Latencies of a database that went down say nothing about it once it is back, the window starts over
+        if status == "down":
+            samples = []
+
+    return {
+        "status": status,
+        "checked_at": datetime.now(timezone.utc).isoformat(),
+        "latency_ms": samples[-1] if error is None else None,
+        "p50_ms": percentile(samples, 50),
+        "p95_ms": percentile(samples, 95),
+        "p99_ms": percentile(samples, 99),
+        "samples_ms": samples,
+        "consecutive_failures": failures,
+        "error": error,
+    }
+
+async def probe_database(document: dict, semaphore: asyncio.Semaphore):
+    previous = document.get("health") or {}
+
+    #? Hibernated containers are stopped on purpose, probing them would only report them down
+    if document.get("state") == "hibernated":
+        if previous.get("status") == "hibernated":
+            return None
+        return {**previous, "status": "hibernated", "checked_at": datetime.now(timezone.utc).isoformat()}
+
+    connection = document.get("connection") or {}
+    manager = connection.get("manager")
+
+    async with semaphore:
+        start = time.perf_counter()
+        try:
+            if manager not in PROBES:
+                raise RuntimeError(f"No probe for manager '{manager}'")
+            await asyncio.wait_for(PROBES[manager](*probe_target(connection)), MONITOR_PROBE_TIMEOUT)
+            latency, error = time.perf_counter() - start, None
+        except Exception as e:
+            latency, error = None, f"{type(e).__name__}: {e}" if str(e) else type(e).__name__
+
+    metrics.DATABASE_PROBE_DURATION.observe(time.perf_counter() - start, manager=manager,
+                                            outcome="up" if error is None else "down")
+    return next_health(previous, latency, error)
+
+def load_documents():
+    return list(get_collection().find({}, {"_id": 0, "id": 1, "connection": 1, "state": 1, "health": 1}))
+
+def write_health(updates: list):
+    return get_collection().bulk_write(updates, ordered=False)
+
+async def run_cycle():
+    start = time.perf_counter()
+    documents = await asyncio.to_thread(load_documents)
+
+    semaphore = asyncio.Semaphore(MONITOR_MAX_IN_FLIGHT)
+    results = await asyncio.gather(*(probe_database(document, semaphore) for document in documents))
+
+    #? Only written if the state did not change meanwhile, a database hibernated or woken up mid cycle waits for the next one
+    updates = [
+        UpdateOne({"id": document["id"], "state": document.get("state")}, {"$set": {"health": health}})
+        for document, health in zip(documents, results) if health is not None
+    ]
+    if updates:
+        await asyncio.to_thread(write_health, updates)
+
+    counts = {}
+    for document, health in zip(documents, results):
+        status = (health or document.get("health") or {}).get("status", "unknown")
+        counts[status] = counts.get(status, 0) + 1
+    for status in ("up", "down", "unknown", "hibernated"):
+        metrics.DATABASES_BY_HEALTH.set(counts.get(status, 0), status=status)
+
+    duration = time.perf_counter() - start
+    metrics.MONITOR_CYCLE_DURATION.observe(duration)
+    last_cycle.update(finished_at=datetime.now(timezone.utc).isoformat(), duration=round(duration, 3),
+                      databases=len(documents), written=len(updates), statuses=counts)
+    return duration
+
+async def monitor_loop():
+    while True:
+        try:
+            duration = await run_cycle()
+        except Exception as e:
+            logger.error(f"Monitor cycle failed: {e}")
+            duration = 0
+
+        if duration > MONITOR_INTERVAL:
+            logger.warning(f"Monitor cycle took {duration:.1f}s, longer than the {MONITOR_INTERVAL}s interval")
+        await asyncio.sleep(max(MONITOR_INTERVAL - duration, 0))
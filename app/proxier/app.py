@@ -1,5 +1,8 @@
 from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import JSONResponse
 from dotenv import load_dotenv, find_dotenv
+from routing import create_routing_table, load_routes
+from common import metrics, probes, resilience, upstream, tracing
 import asyncio
 import logging
 import httpx
@@ -18,79 +21,163 @@ INDEXER_IP = os.getenv("INDEXER_IP", "indexer")
 INDEXER_PORT = os.getenv("INDEXER_PORT", 47000)
 INDEXER_ADDRESS = f"http://{INDEXER_IP}:{INDEXER_PORT}"
 
-async def connect_to_service(service_name: str, service_address: str, retries: int = None):
+#? Comma separated addresses of every replica, a single one on default
+SEARCHER_ADDRESSES = os.getenv("SEARCHER_ADDRESSES", SEARCHER_ADDRESS)
+INDEXER_ADDRESSES = os.getenv("INDEXER_ADDRESSES", INDEXER_ADDRESS)
+#? JSON file with the upstreams of every route, replaces the addresses above when set
+ROUTES_FILE = os.getenv("ROUTES_FILE")
 
-    logger.info(f"Connecting to '{service_name}' at {service_address}")
-    
-    async with httpx.AsyncClient() as client:
-        attempt = 0
-        while retries is None or attempt < retries:
-            try:
-                response = await client.get(f"{service_address}/health")
-                response.raise_for_status()
-                logger.info(f"Successfully connected to '{service_name}' at {service_address}")
-                break
-            except Exception as e:
-                attempt += 1
-                logger.error(f"Failed to connect to '{service_name}' at {service_address} (attempt {attempt}): {e}")
-                await asyncio.sleep(2)
-        
-        return None
-    
+LOAD_BALANCING_STRATEGY = os.getenv("LOAD_BALANCING_STRATEGY", "p2c")
+#? '/health' only reports how the replica started, '/ready' checks that its dependencies answer now
+HEALTH_CHECK_PATH = os.getenv("HEALTH_CHECK_PATH", "/ready")
+HEALTH_CHECK_INTERVAL = float(os.getenv("HEALTH_CHECK_INTERVAL", 5))
+HEALTH_CHECK_TIMEOUT = float(os.getenv("HEALTH_CHECK_TIMEOUT", 2))
+HEALTHY_THRESHOLD = int(os.getenv("HEALTHY_THRESHOLD", 1))
+UNHEALTHY_THRESHOLD = int(os.getenv("UNHEALTHY_THRESHOLD", 2))
+EJECTION_FAILURES = int(os.getenv("EJECTION_FAILURES", 5))
+EJECTION_SECONDS = float(os.getenv("EJECTION_SECONDS", 30))
+MAX_EJECTION_PERCENT = float(os.getenv("MAX_EJECTION_PERCENT", 50))
+PROXY_RETRIES = int(os.getenv("PROXY_RETRIES", 1))
+
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", 100))
+UPSTREAM_MAX_KEEPALIVE = int(os.getenv("UPSTREAM_MAX_KEEPALIVE", 20))
+
+#? Statuses returned by an upstream (or a proxy in front of it) that count as a failure of that replica
+FAILURE_STATUSES = {502, 503, 504}
+
+routing_table = create_routing_table(
+    load_routes(ROUTES_FILE, {"searcher": SEARCHER_ADDRESSES, "indexer": INDEXER_ADDRESSES}),
+    LOAD_BALANCING_STRATEGY, EJECTION_FAILURES, EJECTION_SECONDS, MAX_EJECTION_PERCENT,
+    health_check_path=HEALTH_CHECK_PATH, health_check_timeout=HEALTH_CHECK_TIMEOUT,
+    healthy_threshold=HEALTHY_THRESHOLD, unhealthy_threshold=UNHEALTHY_THRESHOLD,
+)
+#? Concurrency limit, wait queue and circuit breaker of every route, set with [ROUTE]_MAX_CONCURRENCY, [ROUTE]_MAX_QUEUE...
+guards = {route: resilience.load_guard(route, route.upper(), {"breaker_slow_call_seconds": 2})
+          for route in routing_table.pools}
+http_client: httpx.AsyncClient | None = None
+
+async def probe_route(pool):
+    passed = await asyncio.gather(*(routing_table.check_upstream(http_client, u) for u in pool.upstreams))
+    if not any(passed):
+        raise RuntimeError(f"No upstream of '{pool.route}' reachable")
+
+startup = probes.StartupProbes({route: (lambda pool=pool: probe_route(pool)) for route, pool in routing_table.pools.items()})
+
+async def health_check_loop():
+    while True:
+        await asyncio.sleep(HEALTH_CHECK_INTERVAL)
+        try:
+            await routing_table.check_health(http_client)
+        except Exception as e:
+            logger.error(f"Health check round failed: {e}")
     
 async def lifespan(app: FastAPI):
     logger.info(f"Starting service 'INDEX_ACCESS'")
     
-    await connect_to_service("SEARCHER", SEARCHER_ADDRESS)
-    await connect_to_service("INDEXER", INDEXER_ADDRESS)
+    global http_client
+    http_client = upstream.client(limits=httpx.Limits(max_connections=UPSTREAM_MAX_CONNECTIONS,
+                                                      max_keepalive_connections=UPSTREAM_MAX_KEEPALIVE))
+    
+    await startup.run()
+    health_check_task = asyncio.create_task(health_check_loop())
     
     yield
+    
+    health_check_task.cancel()
+    await startup.stop()
+    await http_client.aclose()
     logger.info("Shutting down service 'INDEX_ACCESS'")
 
 app = FastAPI(lifespan=lifespan)
+metrics.instrument_app(app, "proxier")
+tracing.instrument_app(app, "proxier")
 logger = logging.getLogger("uvicorn.error")
 
 @app.get("/health")
 async def health_check():
-    return {"status": "ok"}
+    return startup.summary()
+
+def check_route(pool):
+    if pool.available_count() == 0:
+        raise RuntimeError(f"No upstream of '{pool.route}' available")
+
+@app.get("/ready")
+async def ready():
+    return await probes.readiness({route: (lambda pool=pool: check_route(pool)) for route, pool in routing_table.pools.items()})
+
+@app.get("/routes")
+async def routes():
+    summary = routing_table.summary()
+    for route, guard in guards.items():
+        summary[route]["guard"] = guard.summary()
+    return JSONResponse(content={"message": "ok", "routes": summary})
 
 @app.api_route("/{full_path:path}", methods=["GET", "POST", "PUT", "DELETE", "PATCH"])
 async def proxy_request(full_path: str, request: Request):
  
-    if full_path.startswith("searcher"):
-        target_address = SEARCHER_ADDRESS
-        full_path = full_path.replace("searcher/", "")
-    elif full_path.startswith("indexer"):
-        target_address = INDEXER_ADDRESS
-        full_path = full_path.replace("indexer/", "")
-    else:
+    pool, full_path = routing_table.resolve(full_path)
+    if pool is None:
         raise HTTPException(status_code=404, detail="Service not found")
-    
-    logger.info(f"Request to serivice '{target_address}' within the route '/{full_path}' received")
 
-    url = f"{target_address}/{full_path}"
+    metrics.set_route(request.scope, f"/{pool.route}/{full_path.split('/')[0]}")
 
     body = await request.body()
     headers = dict(request.headers)
     params = dict(request.query_params)
 
-    async with httpx.AsyncClient() as client:
+    try:
+        async with guards[pool.route].call() as call:
+            response = await forward_request(pool, full_path, request.method, body, headers, params)
+            call.record(response.status_code)
+            #? Paths the upstream does not serve share a label, otherwise any path would add one
+            if response.status_code == 404:
+                metrics.set_route(request.scope, f"/{pool.route}/unmatched")
+            return response
+    except resilience.Rejected as e:
+        logger.warning(f"Request to '{pool.route}' rejected: {e}")
+        return resilience.rejection_response(e)
+
+async def forward_request(pool, full_path: str, method: str, body: bytes, headers: dict, params: dict):
+    tried = []
+    for attempt in range(PROXY_RETRIES + 1):
+        target = pool.choose(exclude=tried)
+        if target is None:
+            break
+        
+        url = f"{target.address}/{full_path}"
+        logger.debug(f"Request to serivice '{target.address}' within the route '/{full_path}' received")
+        
+        target.outstanding += 1
         try:
-            resp = await client.request(
-                method=request.method,
+            resp = await http_client.request(
+                method=method,
                 url=url,
                 content=body,
                 headers=headers,
                 params=params,
             )
-            
-            logger.info(f"Successful reponse from '{url}'!")
-            
-            return Response(
-                content=resp.content,
-                status_code=resp.status_code,
-                headers=resp.headers,
-            )
         except httpx.RequestError as e:
+            pool.report_failure(target)
             logger.error(f"Error proxying request to {url}: {e}")
-            raise HTTPException(status_code=502, detail="Bad Gateway")
\ No newline at end of file
+            #? Only a connection that could not be opened is retried, the request never reached the upstream
+            if not isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout)):
+                break
+            tried.append(target)
+            continue
+        finally:
+            target.outstanding -= 1
+        
+        if resp.status_code in FAILURE_STATUSES:
+            pool.report_failure(target)
+        else:
+            pool.report_success(target)
+        
+        logger.debug(f"Successful reponse from '{url}'!")
+        
+        return Response(
+            content=resp.content,
+            status_code=resp.status_code,
+            headers=resp.headers,
+        )
+    
+    raise HTTPException(status_code=502, detail="Bad Gateway")
@@ -0,0 +1,169 @@
+from common.metrics import UPSTREAM_AVAILABLE, UPSTREAM_EJECTIONS
+import asyncio
+import random
+import json
+import time
+
+STRATEGIES = ["p2c", "least_outstanding"]
+
+class Upstream:
+
+    def __init__(self, route: str, address: str):
+        self.route = route
+        self.address = address.rstrip("/")
+        self.outstanding = 0
+        self.healthy = True
+        self.check_failures = 0
+        self.check_successes = 0
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.ejections = 0
+
+    def ejected(self, now: float):
+        return now < self.ejected_until
+
+    def available(self, now: float):
+        return self.healthy and not self.ejected(now)
+
+    def to_dict(self, now: float):
+        return {
+            "address": self.address,
+            "healthy": self.healthy,
+            "ejected": self.ejected(now),
+            "outstanding": self.outstanding,
+            "consecutive_failures": self.consecutive_failures,
+        }
+
+class UpstreamPool:
+
+    def __init__(self, route: str, addresses: list, strategy: str = "p2c", ejection_failures: int = 5,
+                 ejection_seconds: float = 30, max_ejection_percent: float = 50):
+        if not addresses:
+            raise ValueError(f"Route '{route}' has no upstreams")
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown load balancing strategy '{strategy}', use one of {STRATEGIES}")
+
+        self.route = route
+        self.upstreams = [Upstream(route, address) for address in addresses]
+        self.strategy = strategy
+        self.ejection_failures = ejection_failures
+        self.ejection_seconds = ejection_seconds
+        self.max_ejection_percent = max_ejection_percent
+
+    def candidates(self, exclude: tuple = ()):
+        now = time.monotonic()
+        upstreams = [u for u in self.upstreams if u not in exclude]
+        available = [u for u in upstreams if u.available(now)]
+        #? With every upstream down, trying one of them is better than failing every request without trying
+        return available or upstreams
+
+    def choose(self, exclude: tuple = ()):
+        candidates = self.candidates(exclude)
+        if not candidates:
+            return None
+        if len(candidates) == 1:
+            return candidates[0]
+
+        if self.strategy == "p2c":
+            first, second = random.sample(candidates, 2)
+            return first if first.outstanding <= second.outstanding else second
+
+        fewest = min(u.outstanding for u in candidates)
+        return random.choice([u for u in candidates if u.outstanding == fewest])
+
+    def report_success(self, upstream: Upstream):
+        upstream.consecutive_failures = 0
+
+    def report_failure(self, upstream: Upstream):
+        upstream.consecutive_failures += 1
+        if upstream.consecutive_failures < self.ejection_failures:
+            return
+
+        now = time.monotonic()
+        if upstream.ejected(now):
+            return
+
+        #? No more than max_ejection_percent of the upstreams are ejected at once, but at least one can be
+        ejected = sum(1 for u in self.upstreams if u.ejected(now))
+        if (ejected + 1) * 100 > self.max_ejection_percent * len(self.upstreams) and ejected > 0:
+            return
+
+        #? Upstreams ejected repeatedly stay out longer, up to ten times the base time
+        upstream.ejections += 1
+        upstream.ejected_until = now + self.ejection_seconds * min(upstream.ejections, 10)
+        upstream.consecutive_failures = 0
+        UPSTREAM_EJECTIONS.inc(route=self.route, upstream=upstream.address)
+        UPSTREAM_AVAILABLE.set(0, route=self.route, upstream=upstream.address)
+
+    def available_count(self):
+        now = time.monotonic()
+        return sum(1 for u in self.upstreams if u.available(now))
+
+class RoutingTable:
+
+    def __init__(self, pools: dict, health_check_path: str = "/ready", health_check_timeout: float = 2,
+                 healthy_threshold: int = 1, unhealthy_threshold: int = 2):
+        self.pools = pools
+        self.health_check_path = health_check_path
+        self.health_check_timeout = health_check_timeout
+        self.healthy_threshold = healthy_threshold
+        self.unhealthy_threshold = unhealthy_threshold
+
+    def resolve(self, path: str):
+        route, _, rest = path.partition("/")
+        return self.pools.get(route), rest
+
+    def upstreams(self):
+        return [upstream for pool in self.pools.values() for upstream in pool.upstreams]
+
+    async def check_upstream(self, client, upstream: Upstream):
+        try:
+            response = await client.get(f"{upstream.address}{self.health_check_path}", timeout=self.health_check_timeout)
+            passed = response.status_code == 200
+        except Exception:
+            passed = False
+
+        if passed:
+            upstream.check_failures = 0
+            upstream.check_successes += 1
+            if not upstream.healthy and upstream.check_successes >= self.healthy_threshold:
+                upstream.healthy = True
+        else:
+            upstream.check_successes = 0
+            upstream.check_failures += 1
+            if upstream.healthy and upstream.check_failures >= self.unhealthy_threshold:
+                upstream.healthy = False
+
+        UPSTREAM_AVAILABLE.set(int(upstream.available(time.monotonic())), route=upstream.route, upstream=upstream.address)
+        return passed
+
+    async def check_health(self, client):
+        upstreams = self.upstreams()
+        results = await asyncio.gather(*(self.check_upstream(client, upstream) for upstream in upstreams))
+        return dict(zip((upstream.address for upstream in upstreams), results))
+
+    def summary(self):
+        now = time.monotonic()
+        return {route: {"strategy": pool.strategy, "upstreams": [u.to_dict(now) for u in pool.upstreams]}
+                for route, pool in self.pools.items()}
+
+def parse_addresses(value: str):
+    return [address.strip() for address in value.split(",") if address.strip()]
+
+def load_routes(routes_file: str = None, env_routes: dict = None):
+    if routes_file:
+        with open(routes_file) as file:
+            routes = json.load(file)
+        #? {"searcher": ["http://searcher-1:46000", ...]} or {"searcher": {"upstreams": [...], "strategy": "p2c"}}
+        return {route: value if isinstance(value, dict) else {"upstreams": value} for route, value in routes.items()}
+
+    return {route: {"upstreams": parse_addresses(addresses)} for route, addresses in (env_routes or {}).items()}
+
+def create_routing_table(routes: dict, strategy: str, ejection_failures: int, ejection_seconds: float,
+                         max_ejection_percent: float, **health_check):
+    pools = {
+        route: UpstreamPool(route, config["upstreams"], config.get("strategy", strategy), ejection_failures,
+                            ejection_seconds, max_ejection_percent)
+        for route, config in routes.items()
+    }
+    return RoutingTable(pools, **health_check)
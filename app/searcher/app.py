@@ -4,17 +4,30 @@ from pydantic import BaseModel
 from pymongo import MongoClient
 from pymongo.errors import OperationFailure
 from dotenv import load_dotenv, find_dotenv
-import httpx
-import asyncio
+from common import dbindex, metrics, probes, tracing
+from typing import Optional
+from collections import OrderedDict
 import logging
+import json
+import time
 import os
 import re
 
 class TagsSearchRequest(BaseModel):
     tags: dict
+    health: Optional[dict] = None
+    sort: Optional[str] = None
+    consistency_token: Optional[str] = None
     
 class IDSearchRequest(BaseModel):
     id: str
+    consistency_token: Optional[str] = None
+
+class FacetsSearchRequest(BaseModel):
+    facets: list[str]
+    tags: dict = {}
+    limit: Optional[int] = None
+    consistency_token: Optional[str] = None
 
 ON_CONATAINER = True
 
@@ -23,47 +36,34 @@ if not ON_CONATAINER:
 
 DBINDEX_IP = os.getenv("DBINDEX_IP", "dbindex")
 DBINDEX_PORT = os.getenv("DBINDEX_PORT", 27017)
-DBINDEX_ADDRESS = f"mongodb://{DBINDEX_IP}:{DBINDEX_PORT}"
+DBINDEX_ADDRESS = dbindex.address(DBINDEX_IP, DBINDEX_PORT)
 DBINDEX_DB_NAME = os.getenv("DBINDEX_DB_NAME", "dbindex")
 DBINDEX_COLLECTION_NAME = os.getenv("DBINDEX_COLLECTION_NAME", "databases")
 
-async def connect_to_service(service_name: str, service_address: str, retries: int = None):
-
-    logger.info(f"Connecting to '{service_name}' at {service_address}")
-    
-    async with httpx.AsyncClient() as client:
-        attempt = 0
-        while retries is None or attempt < retries:
-            try:
-                response = await client.get(f"{service_address}/health")
-                response.raise_for_status()
-                logger.info(f"Successfully connected to '{service_name}' at {service_address}")
-                break
-            except Exception as e:
-                attempt += 1
-                logger.error(f"Failed to connect to '{service_name}' at {service_address} (attempt {attempt}): {e}")
-                await asyncio.sleep(2)
-        
-        return None
-
-async def connect_to_mongodb(service_name: str, service_address: str, client: MongoClient, retries: int = None):
-
-    logger.info(f"Connecting to '{service_name}' at {service_address}")
-
-    while retries is None or attempt < retries:
-        attempt = 0
-        try:
-            client.server_info()
-            logger.info(f"Successfully connected to '{service_name}' at {service_address}")
-            break
-        except Exception as e:
-            attempt += 1
-            logger.error(
-                f"Failed to connect to '{service_name}' at {service_address} (attempt {attempt}): {e}"
-            )
-            await asyncio.sleep(2)
+#? Secondaries only take reads with a replica set 'DBINDEX_URI', '/tags' can be given a looser preference than '/id'
+DBINDEX_READ_PREFERENCE = os.getenv("DBINDEX_READ_PREFERENCE", "primary")
+DBINDEX_MAX_STALENESS_SECONDS = dbindex.optional_float(os.getenv("DBINDEX_MAX_STALENESS_SECONDS"))
+DBINDEX_TAGS_READ_PREFERENCE = os.getenv("DBINDEX_TAGS_READ_PREFERENCE", DBINDEX_READ_PREFERENCE)
+DBINDEX_TAGS_MAX_STALENESS_SECONDS = dbindex.optional_float(os.getenv("DBINDEX_TAGS_MAX_STALENESS_SECONDS")) \
+    or DBINDEX_MAX_STALENESS_SECONDS
 
-    return None
+READ_PREFERENCE = dbindex.read_preference(DBINDEX_READ_PREFERENCE, DBINDEX_MAX_STALENESS_SECONDS)
+TAGS_READ_PREFERENCE = dbindex.read_preference(DBINDEX_TAGS_READ_PREFERENCE, DBINDEX_TAGS_MAX_STALENESS_SECONDS)
+
+#? Written by 'monitor', see 'sorted_pipeline' for databases without a latency
+SORTS = {
+    "latency": "health.p50_ms",
+    "latency_p95": "health.p95_ms",
+    "latency_p99": "health.p99_ms",
+}
+
+#? Kept by 'monitor' to compute the percentiles, of no use to clients
+PROJECTION = {"_id": 0, "health.samples_ms": 0}
+
+FACETS_MAX_PATHS = int(os.getenv("FACETS_MAX_PATHS", 20))
+FACETS_MAX_VALUES = int(os.getenv("FACETS_MAX_VALUES", 100))
+FACETS_CACHE_TTL = float(os.getenv("FACETS_CACHE_TTL", 0)) # <-- 0 disables the cache
+FACETS_CACHE_SIZE = int(os.getenv("FACETS_CACHE_SIZE", 256))
 
 def flatten_dict(d: dict, parent_key: str = "", sep: str = ".") -> dict:
     items = []
@@ -80,25 +80,96 @@ def flatten_dict(d: dict, parent_key: str = "", sep: str = ".") -> dict:
 
     return dict(items)
 
+def facets_pipeline(match: dict, paths: list, limit: int):
+    #? '$facet' names cannot hold dots, every path gets a positional name and is mapped back afterwards
+    facets = {
+        f"facet_{i}": [
+            #? Array values count once per element, documents without the path are left out
+            {"$unwind": f"$tags.{path}"},
+            {"$group": {"_id": f"$tags.{path}", "count": {"$sum": 1}}},
+            {"$sort": {"count": -1, "_id": 1}},
+            {"$limit": limit},
+        ]
+        for i, path in enumerate(paths)
+    }
+    facets["total"] = [{"$count": "count"}]
+    return [{"$match": match}, {"$facet": facets}]
+
+def sorted_pipeline(match: dict, field: str):
+    #? Databases not up or never probed go last whatever latency they still hold, a plain sort would put missing values first
+    ranked = {"$and": [{"$eq": ["$health.status", "up"]}, {"$ne": [{"$ifNull": [f"${field}", None]}, None]}]}
+    return [
+        {"$match": match},
+        {"$addFields": {"_unranked": {"$cond": [ranked, 0, 1]}}},
+        {"$sort": {"_unranked": 1, field: 1, "id": 1}},
+        {"$project": {**PROJECTION, "_unranked": 0}},
+    ]
+
+def validate_facet(path: str):
+    if not path or any(not segment or segment.startswith("$") for segment in path.split(".")):
+        return f"Facet '{path}' is not a valid tag path"
+    return None
+
+class FacetsCache:
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+
+    def get(self, key: str):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires < time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    def put(self, key: str, value: dict):
+        self.entries[key] = (time.monotonic() + self.ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+facets_cache = FacetsCache(FACETS_CACHE_TTL, FACETS_CACHE_SIZE)
+
 logger = logging.getLogger("uvicorn.error")
 client: MongoClient | None = None
 
+startup = probes.StartupProbes({"dbindex": lambda: probes.ping_mongodb(client)})
+
 async def lifespan(app: FastAPI):
     logger.info(f"Starting service 'SEARCHER'")
+    logger.info(f"Reading from 'DBIndex' with '{READ_PREFERENCE.mongos_mode}', '/tags' with '{TAGS_READ_PREFERENCE.mongos_mode}'")
     
-    client = MongoClient(DBINDEX_ADDRESS)
+    global client
+    client = MongoClient(DBINDEX_ADDRESS, event_listeners=metrics.mongo_listeners() + tracing.mongo_listeners())
     
-    await connect_to_mongodb("DBINDEX", DBINDEX_ADDRESS, client)
+    await startup.run()
     
     yield 
     
+    await startup.stop()
+    client.close()
     logger.info("Shutting down service SEARCHER")
     
 app = FastAPI(lifespan=lifespan)
+metrics.instrument_app(app, "searcher")
+tracing.instrument_app(app, "searcher")
+
+def get_collection(read_preference=READ_PREFERENCE):
+    return client[DBINDEX_DB_NAME].get_collection(DBINDEX_COLLECTION_NAME, read_preference=read_preference)
 
 @app.get("/health")
 async def health_check():
-    return {"status": "ok"}
+    return startup.summary()
+
+@app.get("/ready")
+async def ready():
+    return await probes.readiness({"dbindex": lambda: probes.check_mongodb(client)})
 
 @app.post("/tags")
 async def search_tags(request: TagsSearchRequest):
@@ -106,20 +177,28 @@ async def search_tags(request: TagsSearchRequest):
     if not request.tags:
         return JSONResponse(status_code=400, content={"message": "Tags dictionary is empty"})
     
-    client = MongoClient(DBINDEX_ADDRESS)
-    db = client[DBINDEX_DB_NAME]
-    collection = db[DBINDEX_COLLECTION_NAME]
+    if request.sort is not None and request.sort not in SORTS:
+        return JSONResponse(status_code=400, content={"message": f"Sort '{request.sort}' not supported",
+                                                      "sorts": list(SORTS)})
+    
+    collection = get_collection(TAGS_READ_PREFERENCE)
     
     normalized_tags = flatten_dict(request.tags, parent_key="tags")
     
     #? Interperter
     
-    mongo_query = normalized_tags
+    mongo_query = {**normalized_tags, **flatten_dict(request.health or {}, parent_key="health")}
     
-    logger.info(mongo_query)
+    logger.debug(mongo_query)
     
     try:
-        results = list(collection.find(mongo_query, {"_id": 0}))
+        with dbindex.read_session(client, request.consistency_token) as session:
+            if request.sort is not None:
+                results = list(collection.aggregate(sorted_pipeline(mongo_query, SORTS[request.sort]), session=session))
+            else:
+                results = list(collection.find(mongo_query, PROJECTION, session=session))
+    except dbindex.InvalidToken as e:
+        return JSONResponse(status_code=400, content={"message": str(e)})
     except OperationFailure as e:
         return JSONResponse(status_code=400, content={"message": f"{e.details.get('codeName')}: {e.details.get('errmsg')}"})
 
@@ -139,11 +218,13 @@ async def search_by_id(request: IDSearchRequest):
     if not request.id:
         return JSONResponse(status_code=400, content={"message":"ID is empty"})
     
-    client = MongoClient(DBINDEX_ADDRESS)
-    db = client[DBINDEX_DB_NAME]
-    collection = db[DBINDEX_COLLECTION_NAME]
+    collection = get_collection()
     
-    result = collection.find_one({"id": request.id}, {"_id": 0})
+    try:
+        with dbindex.read_session(client, request.consistency_token) as session:
+            result = collection.find_one({"id": request.id}, PROJECTION, session=session)
+    except dbindex.InvalidToken as e:
+        return JSONResponse(status_code=400, content={"message": str(e)})
     
     if not result:
         return {"message": f"No result found for ID {request.id}", 
@@ -151,3 +232,58 @@ async def search_by_id(request: IDSearchRequest):
     
     return {"message": f"Found result for ID {request.id}", 
             "result": result}
+
+
+@app.post("/facets")
+async def search_facets(request: FacetsSearchRequest):
+    
+    if not request.facets:
+        return JSONResponse(status_code=400, content={"message": "Facets list is empty"})
+    
+    if len(request.facets) > FACETS_MAX_PATHS:
+        return JSONResponse(status_code=400, content={"message": f"At most {FACETS_MAX_PATHS} facets can be counted at once"})
+    
+    for path in request.facets:
+        error = validate_facet(path)
+        if error:
+            return JSONResponse(status_code=400, content={"message": error})
+    
+    limit = min(request.limit or FACETS_MAX_VALUES, FACETS_MAX_VALUES)
+    if limit < 1:
+        return JSONResponse(status_code=400, content={"message": "Limit must be a positive number"})
+    
+    paths = list(dict.fromkeys(request.facets))
+    match = flatten_dict(request.tags, parent_key="tags")
+    
+    #? A token asks to see a given write, a cached result could predate it
+    cacheable = FACETS_CACHE_TTL > 0 and not request.consistency_token
+    key = json.dumps({"match": match, "paths": paths, "limit": limit}, sort_keys=True, default=str)
+    if cacheable:
+        cached = facets_cache.get(key)
+        metrics.FACETS_CACHE_LOOKUPS.inc(result="hit" if cached is not None else "miss")
+        if cached is not None:
+            return {**cached, "cached": True}
+    
+    collection = get_collection(TAGS_READ_PREFERENCE)
+    
+    logger.debug(match)
+    
+    try:
+        with dbindex.read_session(client, request.consistency_token) as session:
+            result = next(collection.aggregate(facets_pipeline(match, paths, limit), session=session), {})
+    except dbindex.InvalidToken as e:
+        return JSONResponse(status_code=400, content={"message": str(e)})
+    except OperationFailure as e:
+        return JSONResponse(status_code=400, content={"message": f"{e.details.get('codeName')}: {e.details.get('errmsg')}"})
+    
+    total = result["total"][0]["count"] if result.get("total") else 0
+    facets = {
+        path: [{"value": group["_id"], "count": group["count"]} for group in result.get(f"facet_{i}", [])]
+        for i, path in enumerate(paths)
+    }
+    
+    content = {"message": f"Counted {len(paths)} facets over {total} databases", "total": total, "facets": facets}
+    if cacheable:
+        facets_cache.put(key, content)
+    
+    return {**content, "cached": False}
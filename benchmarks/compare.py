@@ -0,0 +1,72 @@
+import argparse
+import json
+import pathlib
+import sys
+
+METRICS = ["throughput", "p50_ms", "p95_ms", "p99_ms"]
+
+def load_report(path: str):
+    return json.loads(pathlib.Path(path).read_text())
+
+def delta(before, after):
+    if before is None or after is None:
+        return None
+    if before == 0:
+        return 0.0 if after == 0 else None
+    return (after - before) / before * 100
+
+def compare(baseline: dict, candidate: dict, threshold: float):
+    rows = []
+    regressions = []
+    names = list(baseline["operations"]) + [n for n in candidate["operations"] if n not in baseline["operations"]]
+    for name in names + ["total"]:
+        before = baseline["total"] if name == "total" else baseline["operations"].get(name)
+        after = candidate["total"] if name == "total" else candidate["operations"].get(name)
+        if before is None or after is None:
+            continue
+
+        for metric in METRICS:
+            change = delta(before[metric], after[metric])
+            rows.append((name, metric, before[metric], after[metric], change))
+
+            #? Lower is better for latencies, higher is better for throughput
+            worse = change is not None and (change < -threshold if metric == "throughput" else change > threshold)
+            if worse:
+                regressions.append((name, metric, change))
+
+        if after["errors"] > before["errors"]:
+            regressions.append((name, "errors", after["errors"] - before["errors"]))
+    return rows, regressions
+
+def print_comparison(baseline: dict, candidate: dict, rows: list):
+    label = lambda report: report["meta"].get("label") or report["meta"].get("revision") or "-"
+    print(f"baseline: {label(baseline)}    candidate: {label(candidate)}")
+    print(f"{'operation':<14}{'metric':<12}{'baseline':>12}{'candidate':>12}{'change':>10}")
+    for name, metric, before, after, change in rows:
+        fmt = lambda v: f"{v:>12.2f}" if v is not None else f"{'-':>12}"
+        change = f"{change:>+9.1f}%" if change is not None else f"{'-':>10}"
+        print(f"{name:<14}{metric:<12}{fmt(before)}{fmt(after)}{change}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two reports written by benchmarks/harness.py")
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=10, help="percentage change reported as a regression")
+    args = parser.parse_args()
+
+    baseline, candidate = load_report(args.baseline), load_report(args.candidate)
+    for key in ("target", "mongo", "dataset_size", "mix", "concurrency"):
+        if baseline["meta"].get(key) != candidate["meta"].get(key):
+            print(f"Warning: '{key}' differs between reports ({baseline['meta'].get(key)} != {candidate['meta'].get(key)})")
+
+    rows, regressions = compare(baseline, candidate, args.threshold)
+    print_comparison(baseline, candidate, rows)
+
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) above {args.threshold}%:")
+        for name, metric, change in regressions:
+            print(f"  {name} {metric}: {change:+.1f}{'%' if metric != 'errors' else ''}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
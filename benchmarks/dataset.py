@@ -0,0 +1,57 @@
+import random
+
+GENDERS = ["woman", "man"]
+METHODS = ["poisoning", "hanging", "drowning", "firearms", "jumping", "overdose", "cutting"]
+MANAGERS = ["mongodb", "postgresql", "redis", "mysql"]
+
+def generate_document(i: int, rng: random.Random):
+    return {
+        "id": str(i),
+        "tags": {
+            "demography": {
+                "age": rng.randint(18, 80),
+                "gender": rng.choice(GENDERS)
+            },
+            "method": rng.choice(METHODS)
+        },
+        "connection": {
+            "ip": f"10.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}",
+            "port": rng.choice([27017, 27018, 27019]),
+            "manager": "mongodb",
+            "external": False
+        }
+    }
+
+def generate_documents(size: int, seed: int = 0, start: int = 1):
+    rng = random.Random(seed)
+    for i in range(start, start + size):
+        yield generate_document(i, rng)
+
+def random_tags_query(rng: random.Random):
+    choice = rng.randint(0, 3)
+    if choice == 0:
+        return {"method": rng.choice(METHODS)}
+    if choice == 1:
+        return {"demography": {"gender": rng.choice(GENDERS)}, "method": rng.choice(METHODS)}
+    if choice == 2:
+        low = rng.randint(18, 75)
+        return {"demography": {"age": {"$gte": low, "$lt": low + 2}}}
+    return {"demography": {"gender": {"$in": GENDERS}, "age": rng.randint(18, 80)}}
+
+def random_facets_query(rng: random.Random):
+    #? What a dashboard asks for: counts per gender and method, over everything or one gender
+    tags = {"demography": {"gender": rng.choice(GENDERS)}} if rng.random() < 0.5 else {}
+    return {"facets": ["demography.gender", "method"], "tags": tags}
+
+def load_dataset(collection, size: int, seed: int = 0, chunk_size: int = 10000):
+    collection.delete_many({})
+    collection.create_index("id", unique=True)
+
+    chunk = []
+    for document in generate_documents(size, seed):
+        chunk.append(document)
+        if len(chunk) >= chunk_size:
+            collection.insert_many(chunk, ordered=False)
+            chunk = []
+    if chunk:
+        collection.insert_many(chunk, ordered=False)
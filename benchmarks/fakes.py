@@ -0,0 +1,118 @@
+import docker.errors
+import threading
+import asyncio
+import httpx
+import time
+
+class FakeContainer:
+
+    def __init__(self, client, name: str, ports: dict = None, labels: dict = None, memory: int = 0, nano_cpus: int = 0):
+        self.client = client
+        self.name = name
+        self.id = name
+        self.status = "running"
+        self.labels = labels or {}
+        self.operations = 0
+
+        port_bindings = {}
+        for container_port, host_port in (ports or {}).items():
+            port_bindings[container_port] = [{"HostIp": "", "HostPort": str(host_port)}]
+        self.attrs = {"HostConfig": {"PortBindings": port_bindings, "Memory": memory, "NanoCpus": nano_cpus}}
+
+    def reload(self):
+        pass
+
+    def logs(self):
+        return b""
+
+    def start(self):
+        self.client.sleep()
+        self.status = "running"
+
+    def stop(self):
+        self.client.sleep()
+        self.status = "exited"
+
+    def remove(self, force: bool = False):
+        self.client.sleep()
+        with self.client.lock:
+            if self.client.containers_by_name.pop(self.name, None) is None:
+                raise docker.errors.NotFound(f"No such container: {self.name}")
+
+    def exec_run(self, command, **kwargs):
+        return 0, b""
+
+class FakeContainers:
+
+    def __init__(self, client):
+        self.client = client
+
+    def run(self, image: str, name: str, ports: dict = None, labels: dict = None, mem_limit: int = 0,
+            nano_cpus: int = 0, **kwargs):
+        self.client.sleep()
+        with self.client.lock:
+            if name in self.client.containers_by_name:
+                raise docker.errors.APIError(f"Conflict. The container name '/{name}' is already in use")
+            container = FakeContainer(self.client, name, ports, labels, mem_limit or 0, nano_cpus or 0)
+            self.client.containers_by_name[name] = container
+        return container
+
+    def get(self, name: str):
+        container = self.client.containers_by_name.get(name)
+        if container is None:
+            raise docker.errors.NotFound(f"No such container: {name}")
+        return container
+
+    def list(self, all: bool = False, filters: dict = None):
+        with self.client.lock:
+            containers = list(self.client.containers_by_name.values())
+        if not all:
+            containers = [c for c in containers if c.status == "running"]
+        label = (filters or {}).get("label")
+        if label:
+            key, _, value = label.partition("=")
+            containers = [c for c in containers if c.labels.get(key) == value]
+        return containers
+
+class FakeAPI:
+
+    def __init__(self):
+        self.hooks = {"response": []}
+
+class FakeDockerClient:
+
+    def __init__(self, latency: float = 0, memory: int = 1024 ** 4, cpus: int = 1024):
+        self.latency = latency
+        self.memory = memory
+        self.cpus = cpus
+        self.lock = threading.Lock()
+        self.containers_by_name = {}
+        self.containers = FakeContainers(self)
+        self.api = FakeAPI()
+
+    def sleep(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def ping(self):
+        return True
+
+    def info(self):
+        return {"MemTotal": self.memory, "NCPU": self.cpus}
+
+    def adopt(self, name: str):
+        with self.lock:
+            self.containers_by_name.setdefault(name, FakeContainer(self, name, labels={"bsm_db_service.managed": "true"}))
+
+#? Upstream that serves `capacity` requests at a time taking `delay` seconds each, like a saturated database
+class CapacityTransport(httpx.AsyncBaseTransport):
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, capacity: int, delay: float):
+        self.transport = transport
+        self.delay = delay
+        self.semaphore = asyncio.Semaphore(capacity)
+
+    async def handle_async_request(self, request: httpx.Request):
+        async with self.semaphore:
+            await asyncio.sleep(self.delay)
+            return await self.transport.handle_async_request(request)
@@ -0,0 +1,338 @@
+import argparse
+import asyncio
+import importlib.util
+import json
+import math
+import pathlib
+import platform
+import random
+import subprocess
+import sys
+import time
+from collections import deque
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+APP_DIR = ROOT / "app"
+sys.path.insert(0, str(APP_DIR))
+sys.path.insert(0, str(ROOT / "benchmarks"))
+
+from common import dbindex, metrics, tracing, upstream
+from dataset import generate_document, load_dataset, random_facets_query, random_tags_query
+from fakes import CapacityTransport, FakeDockerClient
+import httpx
+
+SERVICES = ["accessor", "proxier", "searcher", "indexer", "deployer"]
+DEFAULT_MIX = "search_id=70,search_tags=20,index=5,delete=5"
+
+def load_service(service: str, alias: str = None):
+    service_dir = APP_DIR / service
+    sys.path.insert(0, str(service_dir))
+    try:
+        spec = importlib.util.spec_from_file_location(f"bench_{alias or service}", service_dir / "app.py")
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    finally:
+        sys.path.remove(str(service_dir))
+    return module
+
+def create_mongo_client(mongo_uri: str = None):
+    if mongo_uri:
+        from pymongo import MongoClient
+        return MongoClient(mongo_uri, event_listeners=metrics.mongo_listeners() + tracing.mongo_listeners())
+
+    import mongomock
+    return mongomock.MongoClient()
+
+############################! Clusters ############################
+
+class InProcessCluster:
+
+    def __init__(self, mongo_uri: str = None, docker_latency: float = 0, searcher_capacity: int = 0,
+                 searcher_delay: float = 0):
+        self.mongo_uri = mongo_uri
+        self.docker_latency = docker_latency
+        self.searcher_capacity = searcher_capacity
+        self.searcher_delay = searcher_delay
+        self.services = {}
+
+    async def start(self):
+        self.services = {service: load_service(service) for service in SERVICES}
+        accessor, proxier, searcher, indexer, deployer = (self.services[s] for s in SERVICES)
+
+        upstream.MOUNTS.update({
+            accessor.PROXIER_ADDRESS: httpx.ASGITransport(app=proxier.app),
+            accessor.DEPLOYER_ADDRESS: httpx.ASGITransport(app=deployer.app),
+        })
+        route_apps = {"searcher": searcher.app, "indexer": indexer.app}
+        for route, pool in proxier.routing_table.pools.items():
+            for replica in pool.upstreams:
+                transport = httpx.ASGITransport(app=route_apps[route])
+                if route == "searcher" and self.searcher_capacity:
+                    transport = CapacityTransport(transport, self.searcher_capacity, self.searcher_delay)
+                upstream.MOUNTS[replica.address] = transport
+
+        #? Lifespans are not run, every service gets its dependencies wired here instead of probing the others
+        self.mongo = create_mongo_client(self.mongo_uri)
+        dbindex.CONSISTENCY_TOKENS = self.mongo_uri is not None
+        searcher.client = self.mongo
+        indexer.client = self.mongo
+        proxier.http_client = upstream.client()
+        accessor.http_client = upstream.client()
+
+        self.docker = FakeDockerClient(latency=self.docker_latency)
+        deployer.get_docker_client = lambda: self.docker
+        for driver in deployer.DRIVERS.values():
+            driver.probe = lambda container: None
+            driver.activity = lambda container: container.operations
+        deployer.resource_ledger = deployer.create_resource_ledger(self.docker)
+
+        self.client = httpx.AsyncClient(transport=httpx.ASGITransport(app=accessor.app), base_url="http://accessor",
+                                        timeout=None)
+
+    @property
+    def collection(self):
+        indexer = self.services["indexer"]
+        return self.mongo[indexer.DBINDEX_DB_NAME][indexer.DBINDEX_COLLECTION_NAME]
+
+    def adopt(self, name: str):
+        self.docker.adopt(name)
+
+    async def stop(self):
+        await self.client.aclose()
+        await self.services["proxier"].http_client.aclose()
+        await self.services["accessor"].http_client.aclose()
+        upstream.MOUNTS.clear()
+
+class RemoteCluster:
+
+    def __init__(self, target: str, mongo_uri: str = None):
+        self.target = target
+        self.mongo_uri = mongo_uri
+
+    async def start(self):
+        self.mongo = create_mongo_client(self.mongo_uri) if self.mongo_uri else None
+        self.client = httpx.AsyncClient(base_url=self.target, timeout=None,
+                                        limits=httpx.Limits(max_connections=1000, max_keepalive_connections=1000))
+
+    @property
+    def collection(self):
+        if self.mongo is None:
+            raise RuntimeError("'--mongo-uri' is needed to load a dataset on a remote target")
+        return self.mongo["dbindex"]["databases"]
+
+    def adopt(self, name: str):
+        pass
+
+    async def stop(self):
+        await self.client.aclose()
+
+############################! Workload ############################
+
+class Workload:
+
+    def __init__(self, cluster, dataset_size: int, seed: int):
+        self.cluster = cluster
+        self.dataset_size = dataset_size
+        self.rng = random.Random(seed)
+        self.sequence = 0
+        self.created = deque()
+
+    def new_id(self, prefix: str):
+        self.sequence += 1
+        return f"bench-{prefix}-{self.sequence}"
+
+    async def operation(self, operation: str, parameters: dict):
+        return await self.cluster.client.post("/operation", json={"operation": operation, "parameters": parameters})
+
+    async def search_id(self):
+        return await self.operation("search", {"id": str(self.rng.randint(1, max(self.dataset_size, 1)))})
+
+    async def search_tags(self):
+        return await self.operation("search", {"tags": random_tags_query(self.rng)})
+
+    async def search_facets(self):
+        return await self.operation("search", random_facets_query(self.rng))
+
+    async def index(self):
+        document = generate_document(0, self.rng)
+        document["id"] = self.new_id("index")
+        self.cluster.adopt(document["id"])
+
+        response = await self.operation("index", document)
+        if response.status_code == 200:
+            self.created.append(document["id"])
+        return response
+
+    async def delete(self):
+        if not self.created:
+            return await self.search_id()
+        return await self.operation("delete", {"id": self.created.popleft()})
+
+    async def deploy(self):
+        database_id = self.new_id("deploy")
+        document = generate_document(0, self.rng)
+        response = await self.operation("deploy", {"id": database_id, "tags": document["tags"],
+                                                   "connection": {"manager": "mongodb"}})
+        if response.status_code == 200:
+            self.created.append(database_id)
+        return response
+
+def parse_mix(value: str):
+    mix = {}
+    for item in value.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if name not in ("search_id", "search_tags", "search_facets", "index", "delete", "deploy"):
+            raise ValueError(f"Unknown operation '{name}' in mix")
+        mix[name] = float(weight or 1)
+    return mix
+
+def percentile(values: list, q: float):
+    if not values:
+        return None
+    #? Nearest rank, 'round' would round half to even and land one rank off on exact ranks
+    index = min(len(values) - 1, max(0, math.ceil(q * len(values) / 100) - 1))
+    return values[index]
+
+def summarize(latencies: list, errors: int, elapsed: float):
+    values = sorted(latencies)
+    to_ms = lambda v: round(v * 1000, 3) if v is not None else None
+    return {
+        "count": len(values),
+        "errors": errors,
+        "throughput": round(len(values) / elapsed, 2) if elapsed else 0,
+        "mean_ms": to_ms(sum(values) / len(values)) if values else None,
+        "p50_ms": to_ms(percentile(values, 50)),
+        "p95_ms": to_ms(percentile(values, 95)),
+        "p99_ms": to_ms(percentile(values, 99)),
+        "max_ms": to_ms(values[-1]) if values else None,
+    }
+
+async def run_load(workload: Workload, mix: dict, concurrency: int, duration: float, requests: int, warmup: float):
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    latencies = {name: [] for name in names}
+    errors = {name: 0 for name in names}
+    statuses = {}
+    issued = 0
+
+    measure_from = time.perf_counter() + warmup
+    deadline = measure_from + duration if duration else None
+
+    async def worker():
+        nonlocal issued
+        while True:
+            now = time.perf_counter()
+            if deadline is not None and now >= deadline:
+                return
+            if requests and issued >= requests:
+                return
+            if now >= measure_from:
+                issued += 1
+
+            name = workload.rng.choices(names, weights)[0]
+            start = time.perf_counter()
+            try:
+                response = await getattr(workload, name)()
+                status = response.status_code
+            except Exception:
+                status = "exception"
+            elapsed = time.perf_counter() - start
+
+            if start < measure_from:
+                continue
+            statuses[f"{name}:{status}"] = statuses.get(f"{name}:{status}", 0) + 1
+            if isinstance(status, int) and 200 <= status < 300:
+                latencies[name].append(elapsed)
+            else:
+                errors[name] += 1
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - measure_from
+
+    all_latencies = [v for values in latencies.values() for v in values]
+    return {
+        "elapsed": round(elapsed, 3),
+        "total": summarize(all_latencies, sum(errors.values()), elapsed),
+        "operations": {name: summarize(latencies[name], errors[name], elapsed) for name in names},
+        "statuses": statuses,
+    }
+
+############################! Report ############################
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except Exception:
+        return None
+
+def print_report(report: dict):
+    print(f"{'operation':<14}{'count':>9}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    rows = list(report["operations"].items()) + [("total", report["total"])]
+    for name, stats in rows:
+        fmt = lambda v: f"{v:>10.2f}" if v is not None else f"{'-':>10}"
+        print(f"{name:<14}{stats['count']:>9}{stats['errors']:>8}{stats['throughput']:>10.1f}"
+              f"{fmt(stats['p50_ms'])}{fmt(stats['p95_ms'])}{fmt(stats['p99_ms'])}")
+
+async def main():
+    parser = argparse.ArgumentParser(description="Load test of the whole service")
+    parser.add_argument("--target", default=None, help="accessor address, the services run in-process if missing")
+    parser.add_argument("--mongo-uri", default=None, help="mongod to use as dbindex, an in-memory stand-in if missing")
+    parser.add_argument("--dataset-size", type=int, default=10000)
+    parser.add_argument("--skip-load", action="store_true", help="reuse the dataset already stored in dbindex")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--mix", default=DEFAULT_MIX)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--requests", type=int, default=0, help="stop after this many requests instead of --duration")
+    parser.add_argument("--warmup", type=float, default=2)
+    parser.add_argument("--docker-latency", type=float, default=0, help="seconds added to every fake docker call")
+    parser.add_argument("--searcher-capacity", type=int, default=0, help="requests each searcher serves at once, unlimited if 0")
+    parser.add_argument("--searcher-delay", type=float, default=0, help="seconds taken by each request when --searcher-capacity is set")
+    parser.add_argument("--label", default=None)
+    parser.add_argument("--output", default=None, help="write the report as JSON to compare it with benchmarks/compare.py")
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+
+    if args.target:
+        cluster = RemoteCluster(args.target, args.mongo_uri)
+    else:
+        cluster = InProcessCluster(args.mongo_uri, args.docker_latency, args.searcher_capacity, args.searcher_delay)
+    await cluster.start()
+
+    try:
+        if not args.skip_load:
+            start = time.perf_counter()
+            load_dataset(cluster.collection, args.dataset_size, args.seed)
+            print(f"Loaded {args.dataset_size} documents in {time.perf_counter() - start:.1f}s")
+
+        workload = Workload(cluster, args.dataset_size, args.seed)
+        results = await run_load(workload, mix, args.concurrency, None if args.requests else args.duration,
+                                 args.requests, args.warmup)
+    finally:
+        await cluster.stop()
+
+    report = {
+        "meta": {
+            "label": args.label,
+            "revision": git_revision(),
+            "target": args.target or "in-process",
+            "mongo": "mongod" if args.mongo_uri else "in-memory",
+            "dataset_size": args.dataset_size,
+            "mix": mix,
+            "concurrency": args.concurrency,
+            "python": platform.python_version(),
+            "timestamp": time.time(),
+        },
+        **results,
+    }
+
+    print_report(report)
+    if args.output:
+        pathlib.Path(args.output).write_text(json.dumps(report, indent=2))
+        print(f"Report written to {args.output}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
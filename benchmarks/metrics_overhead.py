@@ -0,0 +1,105 @@
+import argparse
+import asyncio
+import datetime
+import pathlib
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1] / "app"))
+
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+from common import metrics, tracing
+import httpx
+
+CONFIGURATIONS = {
+    "baseline": (),
+    "metrics": ("metrics",),
+    "tracing": ("tracing",),
+    "metrics+tracing": ("metrics", "tracing"),
+}
+
+#? The events pymongo and the docker SDK hand to the listeners and hooks, only the fields they read
+MONGO_ADDRESS = ("dbindex", 27017)
+MONGO_EVENT = SimpleNamespace(command_name="find", database_name="dbindex", duration_micros=800, connection_id=MONGO_ADDRESS,
+                              address=MONGO_ADDRESS, reply={"cursor": {"firstBatch": [{"id": "1"}]}})
+DOCKER_RESPONSE = SimpleNamespace(request=SimpleNamespace(method="GET", path_url="/v1.43/containers/bench/json"),
+                                  elapsed=datetime.timedelta(microseconds=1500), status_code=200)
+
+def build_app(instrumentation: tuple, mongo_commands: int, docker_calls: int):
+    app = FastAPI()
+    listeners = []
+    docker_client = SimpleNamespace(api=SimpleNamespace(hooks={"response": []}))
+
+    if "metrics" in instrumentation:
+        metrics.instrument_app(app, "benchmark")
+        listeners += metrics.mongo_listeners()
+        metrics.instrument_docker(docker_client)
+    if "tracing" in instrumentation:
+        tracing.instrument_app(app, "benchmark")
+        listeners += tracing.mongo_listeners()
+        tracing.instrument_docker(docker_client)
+
+    command_listeners = [l for l in listeners if hasattr(l, "succeeded")]
+    pool_listeners = [l for l in listeners if hasattr(l, "connection_checked_out")]
+    hooks = docker_client.api.hooks["response"]
+
+    @app.post("/id")
+    async def search_by_id(payload: dict):
+        #? What the driver and the docker SDK would call around each command and API call
+        for _ in range(mongo_commands):
+            for listener in pool_listeners:
+                listener.connection_checked_out(MONGO_EVENT)
+            for listener in command_listeners:
+                listener.started(MONGO_EVENT)
+                listener.succeeded(MONGO_EVENT)
+            for listener in pool_listeners:
+                listener.connection_checked_in(MONGO_EVENT)
+        for _ in range(docker_calls):
+            for hook in hooks:
+                hook(DOCKER_RESPONSE)
+        return JSONResponse(content={"message": "ok", "result": payload})
+
+    return app
+
+async def run(app: FastAPI, requests: int, concurrency: int):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one():
+            async with semaphore:
+                await client.post("/id", json={"id": "1"})
+
+        for _ in range(min(requests // 10, 500)):
+            await one()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(requests)))
+        return time.perf_counter() - start
+
+async def main():
+    parser = argparse.ArgumentParser(description="Measures the overhead of common.metrics and common.tracing on a FastAPI route")
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--mongo-commands", type=int, default=1, help="dbindex commands observed by the listeners on each request")
+    parser.add_argument("--docker-calls", type=int, default=1, help="docker API calls observed by the hooks on each request")
+    args = parser.parse_args()
+
+    timings = {name: [] for name in CONFIGURATIONS}
+    for _ in range(args.rounds):
+        for name, instrumentation in CONFIGURATIONS.items():
+            app = build_app(instrumentation, args.mongo_commands, args.docker_calls)
+            timings[name].append(await run(app, args.requests, args.concurrency))
+
+    best_baseline = min(timings["baseline"])
+    for name in CONFIGURATIONS:
+        best = min(timings[name])
+        overhead = (best - best_baseline) / best_baseline * 100
+        print(f"{name + ':':17} {args.requests / best:10.1f} req/s ({best / args.requests * 1e6:.1f} us/req)"
+              + ("" if name == "baseline" else f"  overhead {overhead:6.2f} %"))
+
+if __name__ == "__main__":
+    asyncio.run(main())
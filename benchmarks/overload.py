@@ -0,0 +1,121 @@
+import argparse
+import asyncio
+import json
+import os
+import pathlib
+import time
+
+from harness import InProcessCluster, Workload, load_dataset, percentile
+
+#? Without limits the proxier forwards everything and the slow searcher queues it, the breaker is kept closed too
+SCENARIOS = {
+    "unprotected": lambda capacity: {
+        "SEARCHER_MAX_CONCURRENCY": "0",
+        "SEARCHER_BREAKER_ERROR_RATE": "2",
+        "SEARCHER_BREAKER_SLOW_CALL_SECONDS": "0",
+    },
+    "protected": lambda capacity: {
+        "SEARCHER_MAX_CONCURRENCY": str(capacity * 2),
+        "SEARCHER_MAX_QUEUE": str(capacity * 2),
+        "SEARCHER_QUEUE_TIMEOUT": "0.25",
+    },
+}
+
+async def timed(operation):
+    start = time.perf_counter()
+    try:
+        response = await operation()
+        status = response.status_code
+    except Exception:
+        status = "exception"
+    return status, time.perf_counter() - start
+
+async def open_loop(operation, rate: float, duration: float):
+    #? Requests arrive at a fixed rate whatever the latency is, like independent clients do
+    tasks = []
+    start = time.perf_counter()
+    for i in range(int(rate * duration)):
+        delay = start + i / rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(timed(operation)))
+    results = await asyncio.gather(*tasks)
+    return results, time.perf_counter() - start
+
+def summarize_step(results: list, rate: float, elapsed: float):
+    ok = sorted(latency for status, latency in results if status == 200)
+    shed = sorted(latency for status, latency in results if status == 503)
+    to_ms = lambda v: round(v * 1000, 2) if v is not None else None
+    return {
+        "offered_rps": rate,
+        "sent": len(results),
+        "ok": len(ok),
+        "shed": len(shed),
+        "errors": len(results) - len(ok) - len(shed),
+        #? Until the last response arrived, a backlog served after the step does not count as throughput
+        "goodput_rps": round(len(ok) / elapsed, 1),
+        "ok_p50_ms": to_ms(percentile(ok, 50)),
+        "ok_p99_ms": to_ms(percentile(ok, 99)),
+        "shed_p99_ms": to_ms(percentile(shed, 99)),
+    }
+
+async def run_scenario(name: str, args):
+    env = SCENARIOS[name](args.searcher_capacity)
+    previous = {key: os.environ.get(key) for key in env}
+    os.environ.update(env)
+    try:
+        cluster = InProcessCluster(searcher_capacity=args.searcher_capacity, searcher_delay=args.searcher_delay)
+        await cluster.start()
+    finally:
+        for key, value in previous.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+    try:
+        load_dataset(cluster.collection, args.dataset_size)
+        workload = Workload(cluster, args.dataset_size, seed=0)
+        capacity = args.searcher_capacity / args.searcher_delay
+
+        steps = []
+        for load in args.loads:
+            rate = capacity * load
+            results, elapsed = await open_loop(workload.search_id, rate, args.duration)
+            steps.append({"load": load, **summarize_step(results, rate, elapsed)})
+        return steps
+    finally:
+        await cluster.stop()
+
+def print_steps(name: str, steps: list):
+    print(f"\n{name}")
+    print(f"{'load':>6}{'offered':>9}{'ok':>7}{'shed':>7}{'errors':>8}{'goodput':>9}{'ok p50':>9}{'ok p99':>9}{'shed p99':>10}")
+    fmt = lambda v, width: f"{v:>{width}.1f}" if v is not None else f"{'-':>{width}}"
+    for step in steps:
+        print(f"{step['load']:>5.1f}x{step['offered_rps']:>9.0f}{step['ok']:>7}{step['shed']:>7}{step['errors']:>8}"
+              f"{step['goodput_rps']:>9.1f}{fmt(step['ok_p50_ms'], 9)}{fmt(step['ok_p99_ms'], 9)}{fmt(step['shed_p99_ms'], 10)}")
+
+async def main():
+    parser = argparse.ArgumentParser(description="Search latency with a saturated searcher, with and without load shedding")
+    parser.add_argument("--searcher-capacity", type=int, default=2, help="requests the searcher serves at once")
+    parser.add_argument("--searcher-delay", type=float, default=0.05, help="seconds taken by each search")
+    parser.add_argument("--loads", type=lambda v: [float(x) for x in v.split(",")], default=[0.5, 1, 1.5, 2],
+                        help="offered load as a fraction of the searcher capacity")
+    parser.add_argument("--duration", type=float, default=5, help="seconds of every load step")
+    parser.add_argument("--dataset-size", type=int, default=1000)
+    parser.add_argument("--scenarios", default="unprotected,protected")
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    print(f"Searcher capacity: {args.searcher_capacity / args.searcher_delay:.0f} requests/s")
+    report = {}
+    for name in args.scenarios.split(","):
+        report[name] = await run_scenario(name, args)
+        print_steps(name, report[name])
+
+    if args.output:
+        pathlib.Path(args.output).write_text(json.dumps(report, indent=2))
+        print(f"\nReport written to {args.output}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
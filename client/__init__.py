@@ -0,0 +1,2 @@
+from client.resolver import Resolver, ResolveError, NotFound
+from client.connectors import Connector, CONNECTORS, register_connector
@@ -0,0 +1,62 @@
+from abc import ABC, abstractmethod
+
+#? Each manager's client library is only needed when a database of that manager is opened
+
+class Connector(ABC):
+    name: str = None
+    default_options: dict = {}
+
+    @abstractmethod
+    def open(self, host: str, port: int, options: dict):
+        pass
+
+    def close(self, handle):
+        handle.close()
+
+class MongoDBConnector(Connector):
+    name = "mongodb"
+    #? Fewer heartbeats and idle sockets closed, less traffic to keep a database from hibernating
+    default_options = {"maxPoolSize": 10, "serverSelectionTimeoutMS": 5000, "heartbeatFrequencyMS": 60000,
+                       "maxIdleTimeMS": 30000}
+
+    def open(self, host: str, port: int, options: dict):
+        from pymongo import MongoClient
+        return MongoClient(host, port, **{**self.default_options, **options})
+
+class PostgreSQLConnector(Connector):
+    name = "postgresql"
+    #? Deployed containers trust every connection, see POSTGRES_HOST_AUTH_METHOD on the deployer driver
+    default_options = {"user": "postgres", "dbname": "postgres", "min_size": 1, "max_size": 10}
+
+    def open(self, host: str, port: int, options: dict):
+        from psycopg_pool import ConnectionPool
+        options = {**self.default_options, **options}
+        conninfo = f"host={host} port={port} user={options.pop('user')} dbname={options.pop('dbname')}"
+        return ConnectionPool(conninfo, open=True, **options)
+
+class RedisConnector(Connector):
+    name = "redis"
+    default_options = {"max_connections": 10, "socket_connect_timeout": 5}
+
+    def open(self, host: str, port: int, options: dict):
+        import redis
+        return redis.Redis(host=host, port=port, **{**self.default_options, **options})
+
+class MySQLConnector(Connector):
+    name = "mysql"
+    #? Deployed containers allow root without password, see MYSQL_ALLOW_EMPTY_PASSWORD on the deployer driver
+    default_options = {"user": "root", "maxconnections": 10, "blocking": True, "connect_timeout": 5}
+
+    def open(self, host: str, port: int, options: dict):
+        from dbutils.pooled_db import PooledDB
+        import pymysql
+        return PooledDB(pymysql, host=host, port=port, **{**self.default_options, **options})
+
+CONNECTORS: dict[str, Connector] = {}
+
+def register_connector(connector: Connector):
+    CONNECTORS[connector.name] = connector
+    return connector
+
+for connector_class in [MongoDBConnector, PostgreSQLConnector, RedisConnector, MySQLConnector]:
+    register_connector(connector_class())
@@ -0,0 +1,229 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+from client.connectors import CONNECTORS
+import threading
+import logging
+import httpx
+import time
+
+logger = logging.getLogger(__name__)
+
+class ResolveError(Exception):
+
+    def __init__(self, message: str, status_code: int = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+class NotFound(ResolveError):
+    pass
+
+############################! Caches ############################
+
+class ConnectionCache:
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+
+    def get(self, id: str):
+        entry = self.entries.get(id)
+        if entry is None:
+            return None
+        #? Expired entries stay until replaced or evicted, 'pop' still needs them to find the pool to close
+        if entry["expires"] < time.monotonic():
+            return None
+        self.entries.move_to_end(id)
+        return entry
+
+    def put(self, id: str, record: dict):
+        now = time.monotonic()
+        self.entries[id] = {"expires": now + self.ttl, "used_at": now, "record": record}
+        self.entries.move_to_end(id)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def touch(self, id: str):
+        entry = self.entries.get(id)
+        if entry is not None:
+            entry["used_at"] = time.monotonic()
+
+    def pop(self, id: str):
+        entry = self.entries.pop(id, None)
+        return entry["record"] if entry else None
+
+class Pool:
+
+    def __init__(self, target: tuple, handle):
+        self.target = target
+        self.handle = handle
+        self.leases = 0
+        self.released_at = time.monotonic()
+        self.retired = False
+
+class PoolCache:
+
+    def __init__(self, max_pools: int, idle_seconds: float):
+        self.max_pools = max_pools
+        self.idle_seconds = idle_seconds
+        self.pools = OrderedDict()
+
+    def acquire(self, target: tuple, open_handle):
+        pool = self.pools.get(target)
+        opened = pool is None
+        if opened:
+            pool = Pool(target, open_handle())
+            self.pools[target] = pool
+        self.pools.move_to_end(target)
+        pool.leases += 1
+
+        #? Least recently used pools leave the cache, the ones still leased are closed by their last release
+        while len(self.pools) > self.max_pools:
+            self.retire(next(iter(self.pools.values())))
+        return pool, opened
+
+    def release(self, pool: Pool):
+        pool.leases -= 1
+        pool.released_at = time.monotonic()
+        if pool.retired and pool.leases == 0:
+            close_pool(pool)
+
+    def retire(self, pool: Pool):
+        if self.pools.get(pool.target) is pool:
+            del self.pools[pool.target]
+        pool.retired = True
+        if pool.leases == 0:
+            close_pool(pool)
+
+    def pop(self, target: tuple):
+        pool = self.pools.get(target)
+        if pool is not None:
+            self.retire(pool)
+
+    def sweep(self):
+        #? An open pool keeps talking to its database (heartbeats, keepalives) and would keep it from hibernating
+        now = time.monotonic()
+        for pool in [p for p in self.pools.values() if p.leases == 0 and now - p.released_at > self.idle_seconds]:
+            self.retire(pool)
+
+    def clear(self):
+        for pool in list(self.pools.values()):
+            del self.pools[pool.target]
+            pool.retired = True
+            close_pool(pool)
+
+def close_pool(pool: Pool):
+    try:
+        CONNECTORS[pool.target[0]].close(pool.handle)
+    except Exception as e:
+        logger.warning(f"Could not close pool to {pool.target}: {e}")
+
+def usable(record: dict):
+    return record.get("state") != "hibernated" and (record.get("health") or {}).get("status") != "down"
+
+############################! Resolver ############################
+
+class Resolver:
+
+    def __init__(self, address: str = "http://localhost:44000", internal_host: str = "localhost",
+                 cache_ttl: float = 60, cache_size: int = 1024, revalidate_seconds: float = 30, max_pools: int = 16,
+                 pool_idle_seconds: float = 60, pool_options: dict = None, timeout: float = 450):
+        #? Internal databases are indexed with their container name and published port, reachable from the docker host
+        self.internal_host = internal_host
+        self.revalidate_seconds = revalidate_seconds
+        self.pool_options = pool_options or {}
+        self.http = httpx.Client(base_url=address, timeout=timeout)
+        self.connections = ConnectionCache(cache_ttl, cache_size)
+        self.pools = PoolCache(max_pools, pool_idle_seconds)
+        self.lock = threading.RLock()
+        self.stats = {"lookups": 0, "lookup_hits": 0, "pools_opened": 0, "pool_hits": 0}
+
+    def operation(self, operation: str, parameters: dict):
+        response = self.http.post("/operation", json={"operation": operation, "parameters": parameters})
+        try:
+            data = response.json()
+        except ValueError:
+            data = {"message": response.text}
+        if response.status_code != 200:
+            raise ResolveError(data.get("message", f"'{operation}' failed"), response.status_code)
+        return data
+
+    def resolve(self, id: str):
+        with self.lock:
+            self.stats["lookups"] += 1
+            entry = self.connections.get(id)
+            #? A database not used for a while could have been hibernated meanwhile, only the search wakes it up
+            if entry is not None and usable(entry["record"]) and time.monotonic() - entry["used_at"] <= self.revalidate_seconds:
+                self.stats["lookup_hits"] += 1
+                return entry["record"]
+            if entry is not None and not usable(entry["record"]):
+                self.pools.pop(self.target(entry["record"]["connection"]))
+
+        #? Searching through accessor also wakes up hibernated databases
+        data = self.operation("search", {"id": id})
+        result = data.get("result")
+        if result is None:
+            raise NotFound(data.get("message", f"No result found for ID {id}"), 404)
+
+        record = {"connection": result["connection"], "state": result.get("state"), "health": result.get("health")}
+        with self.lock:
+            self.connections.put(id, record)
+            #? A pool to a database reported down is not reused, the next lease opens a new one
+            if not usable(record):
+                self.pools.pop(self.target(record["connection"]))
+        return record
+
+    def target(self, connection: dict):
+        host = connection["ip"] if connection.get("external") else self.internal_host
+        return connection["manager"], host, int(connection["port"])
+
+    def acquire(self, id: str):
+        target = self.target(self.resolve(id)["connection"])
+        manager, host, port = target
+        if manager not in CONNECTORS:
+            raise ResolveError(f"Manager '{manager}' has no connector, use one of {list(CONNECTORS)}")
+
+        with self.lock:
+            self.pools.sweep()
+            pool, opened = self.pools.acquire(
+                target, lambda: CONNECTORS[manager].open(host, port, dict(self.pool_options.get(manager, {}))))
+            self.stats["pools_opened" if opened else "pool_hits"] += 1
+            return pool
+
+    def release(self, id: str, pool: Pool):
+        with self.lock:
+            self.pools.release(pool)
+            self.connections.touch(id)
+
+    @contextmanager
+    def connection(self, id: str):
+        pool = self.acquire(id)
+        try:
+            yield pool.handle
+        finally:
+            self.release(id, pool)
+
+    def invalidate(self, id: str):
+        #? Call it after a connection error, the next lease looks the database up again and opens a new pool
+        with self.lock:
+            record = self.connections.pop(id)
+            if record is not None:
+                self.pools.pop(self.target(record["connection"]))
+
+    def delete(self, id: str):
+        try:
+            return self.operation("delete", {"id": id})
+        finally:
+            self.invalidate(id)
+
+    def close(self):
+        with self.lock:
+            self.pools.clear()
+            self.connections.entries.clear()
+        self.http.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,28 @@
+import requests
+
+json = {
+    "operation": "deploy_batch",
+    "parameters": {
+        "parallelism": 4,
+        "databases": [
+            {
+                "id": f"my_batch_id_{i:02d}",
+                "tags": {
+                    "demography": {
+                    "age": 20 + i,
+                    "gender": "woman" if i % 2 else "man"
+                    },
+                    "method": "poisoning"
+                },
+                "connection": {
+                    "port": 45100 + i,
+                    "manager": "mongodb",
+                }
+            }
+            for i in range(10)
+        ]
+    }
+}
+
+response = requests.post("http://localhost:44000/operation", json=json)
+print(response.json())
@@ -0,0 +1,13 @@
+import pathlib
+import sys
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+from client import Resolver
+
+with Resolver("http://localhost:44000") as resolver:
+    #? The first call looks the database up and opens a pool, the next ones reuse both
+    for _ in range(3):
+        with resolver.connection("1") as client:
+            print(client.admin.command("ping"))
+    print(resolver.stats)
@@ -2,10 +2,23 @@
 
 NETWORK_NAME="bsm_db_service" # <-- Change it for custom name
 
+COMPOSE_FILES="-f compose.yml"
+COMPOSE_ARGS=""
+
+if [ "$1" = "prod" ]; then
+    COMPOSE_FILES="-f compose.prod.yml"
+    COMPOSE_ARGS="--build"
+
+    # 'dbindex' as a 3-node replica set, searcher reads from the secondaries
+    if [ "$2" = "replicaset" ]; then
+        COMPOSE_FILES="$COMPOSE_FILES -f compose.replicaset.yml"
+    fi
+fi
+
 if ! docker network ls --format '{{.Name}}' | grep -qx "$NETWORK_NAME"; then
     docker network create -d bridge "$NETWORK_NAME"
 else
     echo "Network '$NETWORK_NAME' already exists, skipping"
 fi
 
-docker compose -f compose.yml up -d
+docker compose $COMPOSE_FILES up -d $COMPOSE_ARGS
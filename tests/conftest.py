@@ -0,0 +1,31 @@
+import asyncio
+import pathlib
+import sys
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+
+#? Same layout the services run with: 'common' from app/, the helper modules next to each app.py
+for path in (ROOT, ROOT / "app", ROOT / "app" / "deployer", ROOT / "app" / "proxier", ROOT / "benchmarks"):
+    if str(path) not in sys.path:
+        sys.path.insert(0, str(path))
+
+import pytest
+from harness import InProcessCluster, load_service
+
+@pytest.fixture
+def run_in_cluster():
+    #? Every service in-process, with the fake docker client and mongomock as dbindex (see benchmarks/harness.py)
+    def run(scenario):
+        async def main():
+            cluster = InProcessCluster()
+            await cluster.start()
+            try:
+                return await scenario(cluster)
+            finally:
+                await cluster.stop()
+        return asyncio.run(main())
+    return run
+
+@pytest.fixture
+def service():
+    return load_service
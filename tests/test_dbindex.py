@@ -0,0 +1,112 @@
+from common import dbindex
+from bson import Timestamp
+from pymongo import read_preferences
+import httpx
+import mongomock
+import pytest
+
+class Session:
+
+    def __init__(self, operation_time=None, cluster_time=None):
+        self.operation_time = operation_time
+        self.cluster_time = cluster_time
+
+    def advance_operation_time(self, operation_time):
+        self.operation_time = operation_time
+
+    def advance_cluster_time(self, cluster_time):
+        self.cluster_time = cluster_time
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+class Client:
+
+    def __init__(self):
+        self.sessions = []
+
+    def start_session(self, causal_consistency: bool):
+        session = Session()
+        self.sessions.append(session)
+        return session
+
+OPERATION_TIME = Timestamp(1700000000, 3)
+CLUSTER_TIME = {"clusterTime": Timestamp(1700000000, 4), "signature": {"keyId": 7}}
+
+def test_token_round_trip():
+    token = dbindex.encode_token(Session(OPERATION_TIME, CLUSTER_TIME))
+    assert "=" not in token
+    assert dbindex.decode_token(token) == (OPERATION_TIME, CLUSTER_TIME)
+
+@pytest.mark.parametrize("session", [None, Session(), Session(OPERATION_TIME, None)])
+def test_no_token_without_operation_times(session):
+    assert dbindex.encode_token(session) is None
+
+@pytest.mark.parametrize("token", ["not a token", "e30", ""])
+def test_invalid_tokens(token):
+    with pytest.raises(dbindex.InvalidToken):
+        dbindex.decode_token(token)
+
+def test_reads_with_a_token_advance_the_session(monkeypatch):
+    monkeypatch.setattr(dbindex, "CONSISTENCY_TOKENS", True)
+    client = Client()
+    token = dbindex.encode_token(Session(OPERATION_TIME, CLUSTER_TIME))
+
+    with dbindex.read_session(client, token) as session:
+        assert session.operation_time == OPERATION_TIME
+        assert session.cluster_time == CLUSTER_TIME
+    with dbindex.read_session(client, None) as session:
+        assert session is None
+    assert len(client.sessions) == 1
+
+def test_read_preferences():
+    assert isinstance(dbindex.read_preference("primary", 120), read_preferences.Primary)
+    assert dbindex.read_preference("secondaryPreferred", 120).max_staleness == 120
+    with pytest.raises(ValueError):
+        dbindex.read_preference("tertiary")
+    with pytest.raises(ValueError):
+        dbindex.read_preference("secondary", dbindex.MIN_MAX_STALENESS - 1)
+
+def test_invalid_token_is_a_bad_request(run_in_cluster, monkeypatch):
+    async def scenario(cluster):
+        monkeypatch.setattr(dbindex, "CONSISTENCY_TOKENS", True)
+        response = await cluster.client.post("/operation", json={"operation": "search", "parameters": {
+            "id": "a", "consistency_token": "not a token"}})
+        assert response.status_code == 400
+
+    run_in_cluster(scenario)
+
+async def index(cluster, id: str):
+    transport = httpx.ASGITransport(app=cluster.services["indexer"].app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://indexer") as client:
+        return await client.post("/index", json={"id": id, "tags": {"team": "test"}, "connection": {
+            "manager": "mongodb", "ip": "10.0.0.1", "port": 27017, "external": False}})
+
+def test_duplicate_ids_are_conflicts(run_in_cluster, monkeypatch):
+    async def scenario(cluster):
+        indexer = cluster.services["indexer"]
+        indexer.prepare_dbindex()
+
+        first = await index(cluster, "a")
+        second = await index(cluster, "a")
+        assert first.status_code == 200
+        assert second.status_code == 409
+
+        #? Both requests of a race pass the lookup, the unique index turns the second insert away
+        monkeypatch.setattr(mongomock.collection.Collection, "find_one", lambda *args, **kwargs: None)
+        raced = await index(cluster, "a")
+        assert raced.status_code == 409
+        assert cluster.collection.count_documents({"id": "a"}) == 1
+
+    run_in_cluster(scenario)
+
+def test_non_unique_index_is_replaced(run_in_cluster):
+    async def scenario(cluster):
+        cluster.collection.create_index("id")
+        cluster.services["indexer"].prepare_dbindex()
+        assert cluster.collection.index_information()["id_1"].get("unique")
+
+    run_in_cluster(scenario)
@@ -0,0 +1,71 @@
+def item(id: str, manager: str = "mongodb", **connection):
+    return {"id": id, "tags": {"team": "test"}, "connection": {"manager": manager, **connection}}
+
+async def deploy_batch(cluster, databases: list, **parameters):
+    response = await cluster.client.post("/operation", json={"operation": "deploy_batch",
+                                                             "parameters": {"databases": databases, **parameters}})
+    return response.status_code, response.json()
+
+def fail_probe_of(monkeypatch, deployer, failing: set):
+    driver = deployer.DRIVERS["mongodb"]
+
+    def probe(container):
+        if container.name in failing:
+            raise RuntimeError("not ready")
+
+    monkeypatch.setattr(driver, "probe", probe)
+    monkeypatch.setattr(driver, "ready_retries", 1)
+
+def test_every_item_deployed(run_in_cluster):
+    async def scenario(cluster):
+        status, body = await deploy_batch(cluster, [item("a"), item("b"), item("c")], parallelism=2)
+        assert status == 200
+        assert [r["status"] for r in body["results"]] == ["deployed"] * 3
+        assert len({r["port"] for r in body["results"]}) == 3
+        assert {d["id"] for d in cluster.collection.find({}, {"id": 1})} == {"a", "b", "c"}
+
+    run_in_cluster(scenario)
+
+def test_failed_items_are_rolled_back_alone(run_in_cluster, monkeypatch):
+    async def scenario(cluster):
+        deployer = cluster.services["deployer"]
+        fail_probe_of(monkeypatch, deployer, {"b"})
+        free_ports = deployer.port_allocator.free_count()
+
+        status, body = await deploy_batch(cluster, [item("a"), item("b"), item("a")])
+
+        assert status == 207
+        assert [r["status"] for r in body["results"]] == ["deployed", "failed", "failed"]
+        assert "repeated" in body["results"][2]["message"]
+        assert set(cluster.docker.containers_by_name) == {"a"}
+        assert deployer.port_allocator.free_count() == free_ports - 1
+        assert set(deployer.resource_ledger.allocations) == {"a"}
+        assert cluster.collection.find_one({"id": "b"}) is None
+
+    run_in_cluster(scenario)
+
+def test_nothing_deployed_is_an_error(run_in_cluster):
+    async def scenario(cluster):
+        status, body = await deploy_batch(cluster, [item("a", manager="oracle"), item("b", external=True)])
+        assert status == 500
+        assert [r["status"] for r in body["results"]] == ["failed", "failed"]
+        assert not cluster.docker.containers_by_name
+
+    run_in_cluster(scenario)
+
+def test_port_taken_inside_the_batch(run_in_cluster):
+    async def scenario(cluster):
+        status, body = await deploy_batch(cluster, [item("a", port=50100), item("b", port=50100)])
+        assert status == 207
+        assert body["results"][0]["port"] == 50100
+        assert body["results"][1]["message"] == "Port 50100 is already in use"
+
+    run_in_cluster(scenario)
+
+def test_parallelism_below_one_is_rejected(run_in_cluster):
+    async def scenario(cluster):
+        status, body = await deploy_batch(cluster, [item("a")], parallelism=0)
+        assert status == 400
+        assert not cluster.docker.containers_by_name
+
+    run_in_cluster(scenario)
@@ -0,0 +1,80 @@
+import pytest
+
+def test_facets_pipeline(service):
+    searcher = service("searcher")
+    pipeline = searcher.facets_pipeline({"tags.team": "a"}, ["env", "owner.name"], 5)
+    assert pipeline[0] == {"$match": {"tags.team": "a"}}
+    facets = pipeline[1]["$facet"]
+    assert set(facets) == {"facet_0", "facet_1", "total"}
+    assert facets["facet_1"][0] == {"$unwind": "$tags.owner.name"}
+    assert facets["facet_1"][-1] == {"$limit": 5}
+
+@pytest.mark.parametrize("path", ["", "env.", ".env", "env..name", "$where", "owner.$name"])
+def test_invalid_facets(service, path):
+    assert service("searcher").validate_facet(path) is not None
+
+def test_cache_entries_expire(service, monkeypatch):
+    searcher = service("searcher")
+    now = [100.0]
+    monkeypatch.setattr(searcher.time, "monotonic", lambda: now[0])
+    cache = searcher.FacetsCache(ttl=10, max_entries=4)
+
+    cache.put("a", {"total": 1})
+    now[0] += 9
+    assert cache.get("a") == {"total": 1}
+    now[0] += 2
+    assert cache.get("a") is None
+    assert "a" not in cache.entries
+
+def test_cache_evicts_the_least_recently_used(service):
+    searcher = service("searcher")
+    cache = searcher.FacetsCache(ttl=60, max_entries=2)
+    cache.put("a", {})
+    cache.put("b", {})
+    cache.get("a")
+    cache.put("c", {})
+    assert list(cache.entries) == ["a", "c"]
+
+DOCUMENTS = [
+    {"id": "a", "tags": {"team": "search", "env": "prod", "langs": ["go", "python"]}},
+    {"id": "b", "tags": {"team": "search", "env": "dev", "langs": ["python"]}},
+    {"id": "c", "tags": {"team": "search", "env": "prod"}},
+    {"id": "d", "tags": {"team": "billing", "env": "prod", "langs": ["java"]}},
+]
+
+async def search_facets(cluster, **parameters):
+    response = await cluster.client.post("/operation", json={"operation": "search", "parameters": parameters})
+    return response.status_code, response.json()
+
+def test_facets_are_counted_over_the_matching_databases(run_in_cluster, monkeypatch):
+    async def scenario(cluster):
+        searcher = cluster.services["searcher"]
+        monkeypatch.setattr(searcher, "FACETS_CACHE_TTL", 60)
+        monkeypatch.setattr(searcher, "facets_cache", searcher.FacetsCache(60, 16))
+        cluster.collection.insert_many([dict(document) for document in DOCUMENTS])
+
+        status, body = await search_facets(cluster, facets=["env", "langs"], tags={"team": "search"})
+        assert status == 200
+        assert body["total"] == 3
+        assert body["facets"]["env"] == [{"value": "prod", "count": 2}, {"value": "dev", "count": 1}]
+        assert body["facets"]["langs"] == [{"value": "python", "count": 2}, {"value": "go", "count": 1}]
+        assert not body["cached"]
+
+        status, body = await search_facets(cluster, facets=["env", "langs"], tags={"team": "search"}, limit=1)
+        assert body["facets"]["env"] == [{"value": "prod", "count": 2}]
+
+        status, body = await search_facets(cluster, facets=["env", "langs"], tags={"team": "search"})
+        assert body["cached"]
+
+    run_in_cluster(scenario)
+
+def test_invalid_facet_requests(run_in_cluster):
+    async def scenario(cluster):
+        status, _ = await search_facets(cluster, facets=["$where"])
+        assert status == 400
+        status, _ = await search_facets(cluster, facets=["env"], id="a")
+        assert status == 400
+        status, _ = await search_facets(cluster, facets=[])
+        assert status == 400
+
+    run_in_cluster(scenario)
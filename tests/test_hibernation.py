@@ -0,0 +1,97 @@
+import socket
+import threading
+
+async def deploy(cluster, id: str):
+    response = await cluster.client.post("/operation", json={"operation": "deploy", "parameters": {
+        "id": id, "tags": {"team": "test"}, "connection": {"manager": "mongodb"}}})
+    assert response.status_code == 200
+
+def test_only_client_activity_keeps_a_database_awake(run_in_cluster, monkeypatch):
+    async def scenario(cluster):
+        deployer = cluster.services["deployer"]
+        monkeypatch.setattr(deployer, "HIBERNATION_IDLE_SECONDS", 10)
+        await deploy(cluster, "a")
+        container = cluster.docker.containers_by_name["a"]
+
+        assert deployer.find_idle_containers(cluster.docker) == []
+
+        deployer.last_access["a"] -= 60
+        assert deployer.find_idle_containers(cluster.docker) == [container]
+
+        container.operations += 1
+        assert deployer.find_idle_containers(cluster.docker) == []
+
+    run_in_cluster(scenario)
+
+def test_hibernated_database_is_woken_up_by_a_search(run_in_cluster):
+    async def scenario(cluster):
+        deployer = cluster.services["deployer"]
+        await deploy(cluster, "a")
+        container = cluster.docker.containers_by_name["a"]
+
+        deployer.last_access["a"] = 0
+        await deployer.hibernate_container(container)
+        assert container.status == "exited"
+        assert cluster.collection.find_one({"id": "a"})["state"] == "hibernated"
+        assert "a" not in deployer.resource_ledger.allocations
+
+        response = await cluster.client.post("/operation", json={"operation": "search", "parameters": {"id": "a"}})
+        assert response.status_code == 200
+        assert response.json()["result"]["state"] == "running"
+        assert container.status == "running"
+        assert cluster.collection.find_one({"id": "a"})["state"] == "running"
+        assert "a" in deployer.resource_ledger.allocations
+
+    run_in_cluster(scenario)
+
+def test_recently_accessed_database_is_not_hibernated(run_in_cluster, monkeypatch):
+    async def scenario(cluster):
+        deployer = cluster.services["deployer"]
+        monkeypatch.setattr(deployer, "HIBERNATION_IDLE_SECONDS", 10)
+        await deploy(cluster, "a")
+        container = cluster.docker.containers_by_name["a"]
+
+        await deployer.hibernate_container(container)
+        assert container.status == "running"
+
+    run_in_cluster(scenario)
+
+def test_wake_and_delete(run_in_cluster):
+    async def scenario(cluster):
+        deployer = cluster.services["deployer"]
+        await deploy(cluster, "a")
+
+        response = await cluster.client.post("/operation", json={"operation": "wake", "parameters": {"id": "a"}})
+        assert response.json()["message"] == "Database 'a' is already running"
+        assert "a" in deployer.wake_locks
+
+        response = await cluster.client.post("/operation", json={"operation": "delete", "parameters": {"id": "a"}})
+        assert response.status_code == 200
+        assert "a" not in deployer.wake_locks
+        assert "a" not in deployer.last_access
+
+    run_in_cluster(scenario)
+
+def test_redis_activity_leaves_out_monitoring_commands(service):
+    stats = (b"# Commandstats\r\ncmdstat_ping:calls=40,usec=10\r\ncmdstat_info:calls=9,usec=90\r\n"
+             b"cmdstat_client|setinfo:calls=2,usec=1\r\ncmdstat_get:calls=3,usec=6,usec_per_call=2.00\r\n"
+             b"cmdstat_set:calls=4,usec=8\r\n")
+    server = socket.create_server(("127.0.0.1", 0))
+
+    def serve():
+        connection, _ = server.accept()
+        with connection:
+            connection.recv(64)
+            connection.sendall(b"$%d\r\n%s\r\n" % (len(stats), stats))
+
+    threading.Thread(target=serve, daemon=True).start()
+    driver = type(service("deployer").DRIVERS["redis"])()
+    driver.internal_port = server.getsockname()[1]
+
+    class Container:
+        name = "127.0.0.1"
+
+    try:
+        assert driver.activity(Container()) == 7
+    finally:
+        server.close()
@@ -0,0 +1,103 @@
+import asyncio
+import mongomock
+import pytest
+
+@pytest.fixture
+def monitor(service, monkeypatch):
+    monitor = service("monitor")
+    monkeypatch.setattr(monitor, "MONITOR_FAILURE_THRESHOLD", 2)
+    monkeypatch.setattr(monitor, "MONITOR_LATENCY_WINDOW", 3)
+    return monitor
+
+def test_percentile(monitor):
+    values = list(range(1, 101))
+    assert monitor.percentile(values, 50) == 50
+    assert monitor.percentile(values, 95) == 95
+    assert monitor.percentile(values, 99) == 99
+    assert monitor.percentile([7], 99) == 7
+    assert monitor.percentile([3, 1, 2], 50) == 2
+    assert monitor.percentile([], 50) is None
+
+def test_latencies_are_kept_over_a_window(monitor):
+    health = {}
+    for latency in (0.004, 0.001, 0.002, 0.003):
+        health = monitor.next_health(health, latency, None)
+    assert health["status"] == "up"
+    assert health["samples_ms"] == [1.0, 2.0, 3.0]
+    assert health["latency_ms"] == 3.0
+    assert health["p50_ms"] == 2.0
+    assert health["p99_ms"] == 3.0
+
+def test_database_goes_down_after_failures_in_a_row(monitor):
+    health = monitor.next_health({}, 0.001, None)
+    health = monitor.next_health(health, None, "TimeoutError")
+    assert health["status"] == "up"
+    assert health["samples_ms"] == [1.0]
+    assert health["latency_ms"] is None
+
+    health = monitor.next_health(health, None, "TimeoutError")
+    assert health["status"] == "down"
+    assert health["samples_ms"] == [] and health["p50_ms"] is None
+    assert health["consecutive_failures"] == 2
+
+    health = monitor.next_health(health, 0.005, None)
+    assert health["status"] == "up"
+    assert health["consecutive_failures"] == 0
+    assert health["samples_ms"] == [5.0]
+
+def test_woken_database_is_unknown_until_probed(monitor):
+    health = monitor.next_health({"status": "hibernated"}, None, "ConnectionRefusedError")
+    assert health["status"] == "unknown"
+
+def document(id: str, port: int, **fields):
+    return {"id": id, "tags": {"team": "test"}, "state": "running",
+            "connection": {"manager": "mongodb", "ip": id, "port": port, "external": False}, **fields}
+
+def test_cycle_writes_the_health_of_every_database(monitor, monkeypatch):
+    async def probe(host: str, port: int):
+        if host == "b":
+            raise ConnectionRefusedError()
+
+    monkeypatch.setitem(monitor.PROBES, "mongodb", probe)
+    monkeypatch.setattr(monitor, "MONITOR_FAILURE_THRESHOLD", 1)
+    monitor.client = mongomock.MongoClient()
+    monitor.get_collection().insert_many([
+        document("a", 50000), document("b", 50001),
+        document("c", 50002, state="hibernated", health={"status": "up", "p50_ms": 1.0}),
+        document("d", 50003, state="hibernated", health={"status": "hibernated"}),
+    ])
+    #? mongomock can not run the UpdateOne of recent pymongo versions, the updates are checked as sent
+    writes = []
+    monkeypatch.setattr(monitor, "write_health", writes.extend)
+
+    asyncio.run(monitor.run_cycle())
+
+    assert all(set(update._filter) == {"id", "state"} for update in writes)
+    health = {update._filter["id"]: update._doc["$set"]["health"] for update in writes}
+    assert set(health) == {"a", "b", "c"}
+    assert health["a"]["status"] == "up"
+    assert health["b"]["status"] == "down"
+    assert health["b"]["error"] == "ConnectionRefusedError"
+    assert health["c"]["status"] == "hibernated"
+    assert health["c"]["p50_ms"] == 1.0
+    assert monitor.last_cycle["statuses"] == {"up": 1, "down": 1, "hibernated": 2}
+
+def test_search_sorted_by_latency(run_in_cluster):
+    async def scenario(cluster):
+        cluster.collection.insert_many([
+            document("slow", 50000, health={"status": "up", "p50_ms": 9.0}),
+            document("down", 50001, health={"status": "down", "p50_ms": 0.5}),
+            document("fast", 50002, health={"status": "up", "p50_ms": 1.0}),
+            document("unknown", 50003),
+        ])
+        response = await cluster.client.post("/operation", json={"operation": "search", "parameters": {
+            "tags": {"team": "test"}, "sort": "latency"}})
+        assert response.status_code == 200
+        #? Databases down or never probed go last, even with a lower latency kept from before
+        assert [r["id"] for r in response.json()["results"]][:2] == ["fast", "slow"]
+
+        response = await cluster.client.post("/operation", json={"operation": "search", "parameters": {
+            "tags": {"team": "test"}, "sort": "fastest"}})
+        assert response.status_code == 400
+
+    run_in_cluster(scenario)
@@ -0,0 +1,49 @@
+from ports import PortAllocator
+import pytest
+
+def test_allocates_every_port_once():
+    allocator = PortAllocator(50000, 50009)
+    ports = [allocator.allocate() for _ in range(10)]
+    assert sorted(ports) == list(range(50000, 50010))
+    assert allocator.allocate() is None
+    assert allocator.free_count() == 0
+
+def test_released_ports_are_allocated_again():
+    allocator = PortAllocator(50000, 50002)
+    ports = [allocator.allocate() for _ in range(3)]
+    allocator.release(ports[1])
+    assert allocator.free_count() == 1
+    assert allocator.allocate() == ports[1]
+
+def test_allocation_moves_on_from_the_last_port():
+    allocator = PortAllocator(50000, 50009)
+    first = allocator.allocate()
+    allocator.release(first)
+    assert allocator.allocate() == first + 1
+
+def test_reserved_ports_are_skipped():
+    allocator = PortAllocator(50000, 50002)
+    assert allocator.reserve(50000)
+    assert not allocator.reserve(50000)
+    assert allocator.allocate() == 50001
+
+def test_reconcile_replaces_the_used_ports():
+    allocator = PortAllocator(50000, 50004)
+    allocator.allocate()
+    allocator.reconcile({50002, 50003, 8080})
+    assert not allocator.is_used(50000)
+    assert allocator.is_used(50002)
+    assert allocator.is_used(8080)
+    assert allocator.free_count() == 3
+
+def test_ports_out_of_range_are_tracked_apart():
+    allocator = PortAllocator(50000, 50001)
+    assert allocator.reserve(27017)
+    assert not allocator.reserve(27017)
+    assert allocator.free_count() == 2
+    allocator.release(27017)
+    assert allocator.reserve(27017)
+
+def test_invalid_range():
+    with pytest.raises(ValueError):
+        PortAllocator(50001, 50000)
@@ -0,0 +1,142 @@
+from common.resilience import CircuitBreaker, CircuitOpen, ConcurrencyLimiter, Guard, Overloaded, CLOSED, OPEN, HALF_OPEN
+import asyncio
+import httpx
+import pytest
+
+def breaker(**kwargs):
+    return CircuitBreaker("test", **{"window": 10, "min_requests": 4, "error_rate": 0.5, **kwargs})
+
+def open_breaker(**kwargs):
+    circuit = breaker(**kwargs)
+    for _ in range(4):
+        circuit.record(0.01, error=True)
+    return circuit
+
+def half_open_breaker(**kwargs):
+    circuit = open_breaker(**kwargs)
+    circuit.opened_at -= circuit.open_seconds
+    circuit.before_call()
+    return circuit
+
+def test_breaker_waits_for_enough_requests():
+    circuit = breaker()
+    for _ in range(3):
+        circuit.record(0.01, error=True)
+    assert circuit.state == CLOSED
+    circuit.record(0.01, error=True)
+    assert circuit.state == OPEN
+
+def test_breaker_stays_closed_below_the_error_rate():
+    circuit = breaker()
+    for error in (True, False, False, False, True, False):
+        circuit.record(0.01, error=error)
+    assert circuit.state == CLOSED
+
+def test_open_breaker_rejects_until_it_half_opens():
+    circuit = open_breaker()
+    with pytest.raises(CircuitOpen) as rejection:
+        circuit.before_call()
+    assert 0 < rejection.value.retry_after <= circuit.open_seconds
+
+    circuit.opened_at -= circuit.open_seconds
+    circuit.before_call()
+    assert circuit.state == HALF_OPEN
+    #? Only one probe at a time while half open
+    with pytest.raises(CircuitOpen):
+        circuit.before_call()
+
+def test_half_open_success_closes():
+    circuit = half_open_breaker()
+    circuit.record(0.01, error=False)
+    assert circuit.state == CLOSED
+    circuit.before_call()
+
+def test_half_open_failure_opens_again():
+    circuit = half_open_breaker()
+    circuit.record(0.01, error=True)
+    assert circuit.state == OPEN
+    with pytest.raises(CircuitOpen):
+        circuit.before_call()
+
+def test_abandoned_probe_gives_its_slot_back():
+    circuit = half_open_breaker()
+    circuit.record(0.01, error=None)
+    assert circuit.state == HALF_OPEN
+    circuit.before_call()
+
+def test_slow_calls_open_the_breaker():
+    circuit = breaker(slow_call_seconds=0.5, slow_call_rate=0.75)
+    for _ in range(4):
+        circuit.record(1, error=False)
+    assert circuit.state == OPEN
+
+    circuit = half_open_breaker(slow_call_seconds=0.5)
+    circuit.record(1, error=False)
+    assert circuit.state == OPEN
+
+def test_full_queue_is_rejected_at_once():
+    limiter = ConcurrencyLimiter("test", max_concurrency=1, max_queue=0, queue_timeout=5)
+
+    async def scenario():
+        async with limiter.slot():
+            with pytest.raises(Overloaded, match="Too many requests"):
+                async with limiter.slot():
+                    pass
+
+    asyncio.run(scenario())
+    assert limiter.active == 0
+
+def test_queued_requests_time_out():
+    limiter = ConcurrencyLimiter("test", max_concurrency=1, max_queue=1, queue_timeout=0.01)
+
+    async def scenario():
+        async with limiter.slot():
+            with pytest.raises(Overloaded, match="Timed out"):
+                async with limiter.slot():
+                    pass
+            assert limiter.waiting == 0
+
+    asyncio.run(scenario())
+
+def test_queued_requests_run_once_a_slot_frees():
+    limiter = ConcurrencyLimiter("test", max_concurrency=1, max_queue=1, queue_timeout=5)
+    order = []
+
+    async def hold(name: str):
+        async with limiter.slot():
+            order.append(name)
+            await asyncio.sleep(0.01)
+
+    async def scenario():
+        await asyncio.gather(hold("first"), hold("second"))
+
+    asyncio.run(scenario())
+    assert order == ["first", "second"]
+
+def test_guard_counts_server_errors():
+    guard = Guard(ConcurrencyLimiter("test", 1, 1, 1), breaker(min_requests=2))
+
+    async def scenario():
+        for status_code in (500, 503):
+            async with guard.call() as call:
+                call.record(status_code)
+
+    asyncio.run(scenario())
+    assert guard.breaker.state == OPEN
+
+@pytest.mark.parametrize("error, status_code", [
+    (httpx.ReadTimeout, 504), (httpx.ConnectError, 502),
+])
+def test_unreachable_upstreams_are_gateway_errors(run_in_cluster, error, status_code):
+    async def scenario(cluster):
+        accessor = cluster.services["accessor"]
+
+        def fail(request):
+            raise error("upstream failed", request=request)
+
+        await accessor.http_client.aclose()
+        accessor.http_client = httpx.AsyncClient(transport=httpx.MockTransport(fail))
+        response = await cluster.client.post("/operation", json={"operation": "wake", "parameters": {"id": "a"}})
+        assert response.status_code == status_code
+
+    run_in_cluster(scenario)
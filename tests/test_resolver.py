@@ -0,0 +1,152 @@
+from client.connectors import CONNECTORS, Connector
+from client.resolver import NotFound, PoolCache, ResolveError, Resolver, usable
+from types import SimpleNamespace
+import httpx
+import json
+import pytest
+
+class Handle:
+
+    def __init__(self, target: tuple):
+        self.target = target
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+class FakeConnector(Connector):
+    name = "fake"
+
+    def open(self, host: str, port: int, options: dict):
+        return Handle((host, port))
+
+@pytest.fixture(autouse=True)
+def fake_connector(monkeypatch):
+    monkeypatch.setitem(CONNECTORS, FakeConnector.name, FakeConnector())
+
+def open_handle(target: tuple):
+    return lambda: Handle(target)
+
+def test_pools_are_reused_per_target():
+    pools = PoolCache(max_pools=4, idle_seconds=60)
+    first, opened = pools.acquire(("fake", "localhost", 1), open_handle(1))
+    pools.release(first)
+    second, reopened = pools.acquire(("fake", "localhost", 1), open_handle(1))
+    assert opened and not reopened
+    assert second is first
+
+def test_evicted_pools_close_after_their_last_release():
+    pools = PoolCache(max_pools=1, idle_seconds=60)
+    leased, _ = pools.acquire(("fake", "localhost", 1), open_handle(1))
+    other, _ = pools.acquire(("fake", "localhost", 2), open_handle(2))
+    assert leased.retired and not leased.handle.closed
+
+    pools.release(leased)
+    assert leased.handle.closed
+    pools.release(other)
+    assert not other.handle.closed
+
+def test_sweep_closes_idle_pools():
+    pools = PoolCache(max_pools=4, idle_seconds=10)
+    idle, _ = pools.acquire(("fake", "localhost", 1), open_handle(1))
+    busy, _ = pools.acquire(("fake", "localhost", 2), open_handle(2))
+    pools.release(idle)
+    idle.released_at -= 11
+    busy.released_at -= 11
+
+    pools.sweep()
+    assert idle.handle.closed
+    assert list(pools.pools) == [busy.target]
+
+def test_usable_records():
+    assert usable({"state": "running", "health": {"status": "up"}})
+    assert usable({"state": None, "health": None})
+    assert not usable({"state": "hibernated"})
+    assert not usable({"state": "running", "health": {"status": "down"}})
+
+def result(id: str, **fields):
+    return {"id": id, "connection": {"manager": "fake", "ip": "10.0.0.1", "port": 50000, "external": False}, **fields}
+
+@pytest.fixture
+def accessor():
+    calls = []
+    results = {"a": result("a", state="running")}
+
+    def handle(request):
+        body = json.loads(request.content)
+        calls.append((body["operation"], body["parameters"]["id"]))
+        if body["operation"] == "delete":
+            return httpx.Response(200, json={"message": "deleted"})
+        if body["parameters"]["id"] == "broken":
+            return httpx.Response(503, json={"message": "Too many requests"})
+        return httpx.Response(200, json={"result": results.get(body["parameters"]["id"])})
+
+    return SimpleNamespace(calls=calls, results=results, transport=httpx.MockTransport(handle))
+
+@pytest.fixture
+def resolver(accessor):
+    resolver = Resolver(max_pools=2, revalidate_seconds=30)
+    resolver.http = httpx.Client(transport=accessor.transport, base_url="http://accessor")
+    yield resolver
+    resolver.close()
+
+def test_lookups_are_cached(resolver, accessor):
+    record = resolver.resolve("a")
+    assert resolver.resolve("a") is record
+    assert accessor.calls == [("search", "a")]
+
+    resolver.connections.entries["a"]["used_at"] -= 31
+    resolver.resolve("a")
+    assert accessor.calls == [("search", "a")] * 2
+
+def test_leases_share_one_pool(resolver):
+    with resolver.connection("a") as first:
+        with resolver.connection("a") as second:
+            assert first is second
+    assert first.target == ("localhost", 50000)
+    assert resolver.stats["pools_opened"] == 1
+    assert resolver.stats["pool_hits"] == 1
+
+def test_hibernated_databases_are_looked_up_again(resolver, accessor):
+    accessor.results["a"]["state"] = "hibernated"
+    resolver.resolve("a")
+    accessor.results["a"]["state"] = "running"
+    resolver.resolve("a")
+    assert len(accessor.calls) == 2
+
+def test_pools_to_databases_down_are_closed(resolver, accessor):
+    with resolver.connection("a") as handle:
+        pass
+    accessor.results["a"]["health"] = {"status": "down"}
+    resolver.connections.entries["a"]["used_at"] -= 31
+    resolver.resolve("a")
+    assert handle.closed
+    assert not resolver.pools.pools
+
+def test_invalidate_closes_the_pool(resolver, accessor):
+    with resolver.connection("a") as handle:
+        pass
+    resolver.invalidate("a")
+    assert handle.closed
+    with resolver.connection("a") as reopened:
+        assert reopened is not handle
+    assert len(accessor.calls) == 2
+
+def test_delete_invalidates(resolver, accessor):
+    with resolver.connection("a") as handle:
+        pass
+    resolver.delete("a")
+    assert handle.closed
+    assert accessor.calls[-1] == ("delete", "a")
+
+def test_lookup_errors(resolver, accessor):
+    with pytest.raises(NotFound):
+        resolver.resolve("missing")
+    with pytest.raises(ResolveError) as error:
+        resolver.resolve("broken")
+    assert error.value.status_code == 503
+
+    accessor.results["b"] = result("b")
+    accessor.results["b"]["connection"]["manager"] = "oracle"
+    with pytest.raises(ResolveError, match="no connector"):
+        resolver.acquire("b")
@@ -0,0 +1,66 @@
+from resources import ResourceLedger, ResourceProfile, parse_memory, resolve_profile
+import pytest
+
+GIB = 1024 ** 3
+
+def test_parse_memory():
+    assert parse_memory("512m") == 512 * 1024 ** 2
+    assert parse_memory("1.5g") == int(1.5 * GIB)
+    assert parse_memory("2048") == 2048
+    assert parse_memory(100) == 100
+    assert parse_memory(None) is None
+
+def test_requested_values_override_the_manager_profile():
+    default = ResourceProfile(mem_limit="1g", nano_cpus=1_000_000_000)
+    profile = resolve_profile(default, ResourceProfile(mem_limit="512m"))
+    assert profile.mem_limit == 512 * 1024 ** 2
+    assert profile.nano_cpus == 1_000_000_000
+
+@pytest.mark.parametrize("requested", [
+    ResourceProfile(blkio_weight=5), ResourceProfile(nano_cpus=0), ResourceProfile(mem_limit="0"),
+])
+def test_invalid_profiles(requested):
+    with pytest.raises(ValueError):
+        resolve_profile(ResourceProfile(), requested)
+
+def test_admission_until_the_host_is_full():
+    ledger = ResourceLedger(memory_capacity=2 * GIB, nano_cpus_capacity=4_000_000_000)
+    profile = ResourceProfile(mem_limit=GIB, nano_cpus=1_000_000_000)
+    assert ledger.reserve("a", profile) is None
+    assert ledger.reserve("b", profile) is None
+    assert "memory" in ledger.reserve("c", profile)
+    assert ledger.summary()["containers"] == 2
+
+def test_cpu_is_admitted_apart_from_memory():
+    ledger = ResourceLedger(memory_capacity=8 * GIB, nano_cpus_capacity=1_000_000_000)
+    assert ledger.reserve("a", ResourceProfile(mem_limit=GIB, nano_cpus=1_000_000_000)) is None
+    assert "CPU" in ledger.reserve("b", ResourceProfile(mem_limit=GIB, nano_cpus=1))
+
+def test_released_resources_admit_again():
+    ledger = ResourceLedger(memory_capacity=GIB, nano_cpus_capacity=1_000_000_000)
+    profile = ResourceProfile(mem_limit=GIB)
+    assert ledger.reserve("a", profile) is None
+    assert ledger.reserve("b", profile) is not None
+    ledger.release("a")
+    assert ledger.reserve("b", profile) is None
+
+def test_reconcile_replaces_the_allocations():
+    ledger = ResourceLedger(memory_capacity=GIB, nano_cpus_capacity=1_000_000_000)
+    ledger.reserve("a", ResourceProfile(mem_limit=GIB))
+    ledger.reconcile({"b": (GIB // 2, 0)})
+    assert ledger.summary()["memory"]["used"] == GIB // 2
+    assert ledger.reserve("c", ResourceProfile(mem_limit=GIB // 2)) is None
+
+def test_deployments_beyond_capacity_are_rejected(run_in_cluster):
+    async def scenario(cluster):
+        deployer = cluster.services["deployer"]
+        deployer.resource_ledger = ResourceLedger(memory_capacity=GIB, nano_cpus_capacity=4_000_000_000)
+        parameters = {"tags": {"team": "test"}, "connection": {"manager": "mongodb"}, "resources": {"mem_limit": "1g"}}
+
+        first = await cluster.client.post("/operation", json={"operation": "deploy", "parameters": {"id": "a", **parameters}})
+        second = await cluster.client.post("/operation", json={"operation": "deploy", "parameters": {"id": "b", **parameters}})
+        assert first.status_code == 200
+        assert second.status_code == 409
+        assert "b" not in cluster.docker.containers_by_name
+
+    run_in_cluster(scenario)
@@ -0,0 +1,93 @@
+from routing import UpstreamPool
+import asyncio
+import time
+import pytest
+
+def pool(size: int = 3, **kwargs):
+    return UpstreamPool("searcher", [f"http://searcher-{i}:46000" for i in range(size)], **kwargs)
+
+def test_p2c_never_picks_the_busiest_of_two():
+    upstreams = pool(2)
+    upstreams.upstreams[0].outstanding = 5
+    assert all(upstreams.choose() is upstreams.upstreams[1] for _ in range(50))
+
+def test_least_outstanding_picks_the_idlest():
+    upstreams = pool(3, strategy="least_outstanding")
+    upstreams.upstreams[0].outstanding = 2
+    upstreams.upstreams[1].outstanding = 1
+    upstreams.upstreams[2].outstanding = 3
+    assert all(upstreams.choose() is upstreams.upstreams[1] for _ in range(20))
+
+def test_excluded_upstreams_are_not_chosen_again():
+    upstreams = pool(2)
+    first = upstreams.choose()
+    assert upstreams.choose(exclude=[first]) is not first
+    assert upstreams.choose(exclude=upstreams.upstreams) is None
+
+def test_consecutive_failures_eject():
+    upstreams = pool(2, ejection_failures=3)
+    upstream = upstreams.upstreams[0]
+    for _ in range(2):
+        upstreams.report_failure(upstream)
+    upstreams.report_success(upstream)
+    upstreams.report_failure(upstream)
+    assert upstream.available(time.monotonic())
+
+    upstreams.report_failure(upstream)
+    upstreams.report_failure(upstream)
+    assert not upstream.available(time.monotonic())
+    assert upstreams.available_count() == 1
+    assert all(upstreams.choose() is upstreams.upstreams[1] for _ in range(20))
+
+def test_ejection_is_capped():
+    upstreams = pool(4, ejection_failures=1, max_ejection_percent=50)
+    for upstream in upstreams.upstreams:
+        upstreams.report_failure(upstream)
+    assert upstreams.available_count() == 2
+
+def test_one_upstream_can_always_be_ejected():
+    upstreams = pool(1, ejection_failures=1, max_ejection_percent=10)
+    upstreams.report_failure(upstreams.upstreams[0])
+    assert upstreams.available_count() == 0
+    #? With nothing available every upstream is tried anyway
+    assert upstreams.choose() is upstreams.upstreams[0]
+
+def test_repeated_ejections_last_longer():
+    upstreams = pool(2, ejection_failures=1, ejection_seconds=10)
+    upstream = upstreams.upstreams[0]
+    upstreams.report_failure(upstream)
+    first = upstream.ejected_until - time.monotonic()
+    upstream.ejected_until = 0
+    upstreams.report_failure(upstream)
+    assert upstream.ejected_until - time.monotonic() > first + 5
+
+def test_invalid_pools():
+    with pytest.raises(ValueError):
+        UpstreamPool("searcher", [])
+    with pytest.raises(ValueError):
+        pool(strategy="random")
+
+def test_health_checks_take_replicas_out_and_back(service):
+    proxier = service("proxier")
+    table = proxier.routing_table
+    upstream = table.pools["searcher"].upstreams[0]
+    replies = {"status": 503}
+    urls = []
+
+    class Client:
+        async def get(self, url, timeout):
+            urls.append(url)
+            class Response:
+                status_code = replies["status"]
+            return Response()
+
+    async def check(times: int):
+        for _ in range(times):
+            await table.check_upstream(Client(), upstream)
+
+    asyncio.run(check(table.unhealthy_threshold))
+    assert not upstream.healthy
+    replies["status"] = 200
+    asyncio.run(check(table.healthy_threshold))
+    assert upstream.healthy
+    assert all(url == f"{upstream.address}/ready" for url in urls)